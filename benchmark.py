@@ -0,0 +1,331 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import platform
+import subprocess
+import time
+import warnings
+
+import numpy as np
+import scipy
+import tabulate
+
+import kernels
+import pf
+import read_system
+from contingency import ContingencyAnalyzer
+from cpf import ContinuationPowerFlow
+
+# Tamaños por defecto de las redes sintéticas (barras)
+SIZES = (100, 500, 2000, 5000, 10000, 20000)
+
+def synthetic_system(n_buses, seed=0):
+    '''
+    Crear una red mallada sintética de aproximadamente n_buses barras.
+
+    Las barras forman una cuadrícula (cada una conectada con sus vecinas)
+    con algunas líneas adicionales entre barras cercanas; uno de cada diez
+    nodos tiene un generador (barra PV) y la generación total iguala la
+    carga. Con la misma semilla se obtiene siempre la misma red.
+    '''
+
+    rng = np.random.default_rng(seed)
+    side = max(2, int(round(np.sqrt(n_buses))))
+    N = side*side
+    grid = np.arange(N).reshape(side, side)
+
+    # Barras: 10 % PV, la primera de ellas oscilante
+    bus_type = np.full(N, pf.PQ, dtype=np.int8)
+    generators = rng.choice(N, max(1, N//10), replace=False)
+    bus_type[generators] = pf.PV
+    bus_type[generators[0]] = pf.SLACK
+    PL = rng.uniform(0.05, 0.2, N)
+    QL = 0.3*PL
+    PL[generators] -= PL.sum()/len(generators)
+    QL[generators] = 0
+    V = np.where(bus_type == pf.PQ, 1.0, 1.02)
+
+    system = pf.System(name=f'synthetic-{N}')
+    system.add_buses(bus_type, [str(i) for i in range(N)], V=V, PL=PL,
+                     QL=QL, Vb=230.0, Vset=np.where(bus_type == pf.PQ,
+                                                    np.nan, V))
+
+    # Ramas: cuadrícula más 5 % de líneas a barras a dos pasos
+    from_bus = np.concatenate([grid[:, :-1].ravel(), grid[:-1, :].ravel()])
+    to_bus = np.concatenate([grid[:, 1:].ravel(), grid[1:, :].ravel()])
+    chords = rng.choice(N - 2*side - 2, max(1, N//20), replace=False)
+    from_bus = np.concatenate([from_bus, chords])
+    to_bus = np.concatenate([to_bus, chords + 2*side + 2])
+    X = rng.uniform(0.005, 0.02, len(from_bus))
+    system.add_branches(from_bus, to_bus, R=X/8, X=X,
+                        from_Y=0.01j, to_Y=0.01j, MVA=np.nan)
+
+    return system
+
+def timed(func, repeat):
+    '''
+    Ejecutar func repeat veces y devolver los tiempos (s) y su último
+    resultado.
+    '''
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+
+    return times, result
+
+def record(case, system, benchmark, times, **extra):
+    '''
+    Armar una fila de resultados.
+    '''
+
+    return {'case': case,
+            'n_buses': system.n_buses,
+            'n_branches': system.n_branches,
+            'benchmark': benchmark,
+            'repeat': len(times),
+            'min_s': float(np.min(times)),
+            'median_s': float(np.median(times)),
+            **extra}
+
+def benchmark_case(case, system, repeat=5, cpf_buses=None, cpf_points=30,
+                   n_contingencies=50):
+    '''
+    Medir las etapas del flujo de potencia en un sistema.
+
+    Se miden: build_Y desde cero (sin caché) e incremental, build_J, una
+    iteración de Newton-Raphson (F, J y paso), run_pf completo desde 'flat
+    start' (con LU dispersa y con GMRES), el flujo de continuación sobre
+    cpf_buses (por defecto todas las barras PQ, hasta cpf_points puntos) y
+    el análisis N-1 en este proceso sobre las primeras n_contingencies
+    ramas, además de su preselección lineal (dc_screen).
+    '''
+
+    rows = []
+
+    def clear_cache():
+        system._cache.clear()
+        system.build_Y()
+
+    times, _ = timed(clear_cache, repeat)
+    rows.append(record(case, system, 'build_Y (cold)', times))
+    times, _ = timed(system.build_Y, repeat)
+    rows.append(record(case, system, 'build_Y', times))
+
+    # Estado resuelto para medir J y una iteración en un punto realista
+    system.run_pf()
+    x = system.get_state()
+    times, _ = timed(system.build_J, repeat)
+    rows.append(record(case, system, 'build_J', times, nnz=system.J.nnz))
+
+    def iteration():
+        system.update_v(x)
+        system.build_F_J()
+        return system.solve_step()
+
+    times, _ = timed(iteration, repeat)
+    rows.append(record(case, system, 'newton_iteration', times))
+
+    def full():
+        return system.run_pf()
+
+    times, converged = timed(full, repeat)
+    rows.append(record(case, system, 'run_pf', times,
+                       converged=bool(converged),
+                       iterations=system.iterations))
+
+    # Paso de Newton con GMRES y precondicionador ILU (reutilizado entre
+    # repeticiones, como entre escenarios)
+    times, converged = timed(lambda: system.run_pf(solver='gmres'), repeat)
+    rows.append(record(case, system, 'run_pf (gmres)', times,
+                       converged=bool(converged),
+                       iterations=system.iterations))
+
+    # Cargabilidad
+    if cpf_buses is None:
+        cpf_buses = system.pq
+    continuation = ContinuationPowerFlow(system, cpf_buses)
+    times, curves = timed(lambda: continuation.run(max_points=cpf_points), 1)
+    rows.append(record(case, system, 'loadability', times,
+                       points=len(curves), lambda_max=curves.lambda_max))
+
+    # Contingencias N-1
+    outages = np.flatnonzero(system.branch_in_operation)[:n_contingencies]
+    analyzer = ContingencyAnalyzer(system, max_workers=1)
+    times, results = timed(lambda: analyzer.run(outages), 1)
+    rows.append(record(case, system, 'n-1', times,
+                       contingencies=len(results),
+                       failed=len(results.failed())))
+    times, flagged = timed(lambda: analyzer.dc_screen(outages), 1)
+    rows.append(record(case, system, 'n-1 dc_screen', times,
+                       contingencies=len(outages), flagged=len(flagged)))
+
+    return rows
+
+def check_kernels(tol=1e-10, path=None):
+    '''
+    Comparar F y J del núcleo de Numba con los del de NumPy en el sistema
+    nórdico (por defecto, el del repositorio), resuelto y con el estado desplazado de la solución (ver
+    kernels.compare). Devuelve un mensaje y si la comparación pasó; se
+    omite si Numba no está instalado.
+    '''
+
+    if kernels.numba is None:
+        return 'Numba kernel check skipped (numba is not installed)', True
+    path = path or read_system.NORDIC_PATH
+
+    system, _ = read_system.load_nordic(path)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        system.run_pf()
+    system.theta[system.pqpv] += 0.01
+    system.V[system.pq] *= 0.98
+    error_F, error_J = kernels.compare(system, 'numba')
+    passed = max(error_F, error_J) <= tol
+
+    return (f'Numba kernel check {"passed" if passed else "FAILED"} on '
+            f'nordic: relative error {error_F:.3g} (F), {error_J:.3g} (J)',
+            passed)
+
+def environment():
+    '''
+    Describir el entorno de la medición (versiones y commit).
+    '''
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor()}
+
+def run(sizes=SIZES, repeat=5, nordic=True, seed=0, nordic_path=None,
+        **options):
+    '''
+    Correr todas las mediciones: el sistema nórdico (nordic_path, por
+    defecto el del repositorio) y las redes sintéticas de los tamaños
+    dados. Devuelve las filas.
+    '''
+
+    rows = []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        if nordic:
+            system, _ = read_system.load_nordic(
+                nordic_path or read_system.NORDIC_PATH)
+            central = [system.bus_names.index(name) for name in
+                       ('1', '2', '3', '4', '5', '41', '42', '43', '46',
+                        '47', '51')]
+            rows += benchmark_case('nordic', system, repeat,
+                                   cpf_buses=central, **options)
+        for size in sizes:
+            system = synthetic_system(size, seed)
+            rows += benchmark_case(system.name, system, repeat, **options)
+
+    return rows
+
+def write_json(path, rows):
+    with open(path, 'w') as f:
+        json.dump({'environment': environment(), 'results': rows}, f,
+                  indent=2)
+
+def write_csv(path, rows):
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def compare(rows, baseline_path, threshold=1.2):
+    '''
+    Comparar las medianas con las de un JSON anterior. Devuelve una tabla
+    (texto) y la lista de mediciones que empeoraron más que threshold.
+    '''
+
+    with open(baseline_path) as f:
+        baseline = {(row['case'], row['benchmark']): row
+                    for row in json.load(f)['results']}
+
+    table = []
+    regressions = []
+    for row in rows:
+        old = baseline.get((row['case'], row['benchmark']))
+        if old is None:
+            continue
+        ratio = row['median_s']/old['median_s']
+        table.append([row['case'], row['benchmark'], old['median_s'],
+                      row['median_s'], ratio])
+        if ratio > threshold:
+            regressions.append((row['case'], row['benchmark'], ratio))
+
+    text = tabulate.tabulate(table, headers=['Case', 'Benchmark', 'Before (s)',
+                                             'After (s)', 'Ratio'],
+                             floatfmt=('', '', '.4g', '.4g', '.2f'))
+
+    return text, regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks of the power flow solver.')
+    parser.add_argument('--sizes', type=int, nargs='*', default=list(SIZES),
+                        help='synthetic network sizes (buses)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-nordic', action='store_true')
+    parser.add_argument('--nordic', default=None,
+                        help='nordic system file (default: the one in '
+                             'the repository)')
+    parser.add_argument('--cpf-points', type=int, default=30)
+    parser.add_argument('--contingencies', type=int, default=50)
+    parser.add_argument('--json', help='write results to this JSON file')
+    parser.add_argument('--csv', help='write results to this CSV file')
+    parser.add_argument('--compare', help='JSON file of a previous run')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='median ratio reported as a regression')
+    args = parser.parse_args(argv)
+
+    message, passed = check_kernels(path=args.nordic)
+    print(message)
+    if not passed:
+        return 1
+
+    rows = run(args.sizes, args.repeat, nordic=not args.no_nordic,
+               seed=args.seed, nordic_path=args.nordic,
+               cpf_points=args.cpf_points,
+               n_contingencies=args.contingencies)
+
+    print(tabulate.tabulate(
+        [[row['case'], row['benchmark'], row['min_s'], row['median_s']]
+         for row in rows],
+        headers=['Case', 'Benchmark', 'Min (s)', 'Median (s)'],
+        floatfmt=('', '', '.4g', '.4g')))
+
+    if args.json:
+        write_json(args.json, rows)
+    if args.csv:
+        write_csv(args.csv, rows)
+    if args.compare:
+        text, regressions = compare(rows, args.compare, args.threshold)
+        print()
+        print(text)
+        for case, benchmark, ratio in regressions:
+            print(f'Regression: {case} {benchmark} is {ratio:.2f}x slower')
+        return 1 if regressions else 0
+
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,329 @@
+import concurrent.futures
+import os
+import pickle
+import warnings
+
+import numpy as np
+import tabulate
+
+import pf
+
+# Copia del sistema en cada proceso de trabajo (se recibe una sola vez), su
+# estado inicial (la solución del caso base) y los arreglos de ese caso que
+# cada contingencia puede modificar
+_worker_system = None
+_worker_x0 = None
+_worker_base = None
+
+# Arreglos que una corrida modifica (tensiones, consignas y tomas)
+_STATE_FIELDS = ('V', 'theta', 'Vset', 'branch_n')
+
+def _base_state(system):
+    '''
+    Copiar los arreglos de _STATE_FIELDS del sistema.
+    '''
+
+    return {field: getattr(system, field).copy() for field in _STATE_FIELDS}
+
+def _restore(system, base):
+    '''
+    Devolver el sistema al estado copiado con _base_state.
+    '''
+
+    for field, values in base.items():
+        getattr(system, field)[:] = values
+
+def _init_worker(payload):
+    '''
+    Deserializar el sistema en el proceso de trabajo.
+    '''
+
+    global _worker_system, _worker_x0, _worker_base
+    _worker_system = pickle.loads(payload)
+    _worker_x0 = _worker_system.get_state()
+    _worker_base = _base_state(_worker_system)
+
+def _solve_contingency(task):
+    '''
+    Resolver una contingencia en el proceso de trabajo y resumir el resultado.
+    Al terminar, el sistema vuelve al caso base, de modo que el resultado no
+    depende de las contingencias resueltas antes en el mismo proceso.
+    '''
+
+    name, branches, pf_options, loading_limit, warm_start = task
+    system = _worker_system
+    if warm_start:
+        pf_options = {**pf_options, 'x0': _worker_x0}
+
+    before = dict(system.stats.totals)
+    try:
+        with system.outage(*branches):
+            converged = _solve(system, pf_options)
+            row = _summarize(system, name, branches, converged,
+                             loading_limit)
+    finally:
+        _restore(system, _worker_base)
+
+    # Telemetría de esta contingencia
+    row['stats'] = {key: value - before[key]
+                    for key, value in system.stats.totals.items()}
+    row['max_mismatch'] = (system.stats.log[-1]['max_mismatch']
+                           if system.stats.log else np.nan)
+
+    return row
+
+def _solve(system, pf_options):
+    '''
+    Correr System.run_pf sin avisos. Una jacobiana singular se registra
+    (estado, causa y telemetría) como una corrida que no converge.
+    Devuelve si convergió.
+    '''
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        try:
+            return system.run_pf(**pf_options)
+        except (np.linalg.LinAlgError, RuntimeError):
+            system.status = 'singular Jacobian'
+            system.failure = 'singular Jacobian'
+            system.iterations = 0
+            system.stats.finish(False, max(len(system.stats.log) - 1, 0))
+            return False
+
+def _summarize(system, name, branches, converged, loading_limit):
+    '''
+    Construir la fila de resultados de una contingencia.
+    '''
+
+    row = {'contingency': name,
+           'branches': tuple(branches),
+           'converged': bool(converged),
+           'iterations': system.iterations,
+           'status': system.status,
+           'failure': None if converged else system.failure,
+           'V_min': np.nan, 'V_min_bus': None,
+           'V_max': np.nan, 'V_max_bus': None,
+           'max_loading': np.nan, 'max_loading_branch': None,
+           'overloaded': (), 'losses': np.nan,
+           'islands': int(np.max(system.islands, initial=0)) + 1,
+           'de_energized': tuple(system.bus_names[i]
+                                 for i in system.de_energized)}
+
+    if not converged:
+        return row
+
+    # Tensiones extremas de las barras energizadas
+    V = system.V.copy()
+    V[system.de_energized] = np.nan
+    i_min = np.nanargmin(V)
+    i_max = np.nanargmax(V)
+    row.update(V_min=float(system.V[i_min]),
+               V_min_bus=system.bus_names[i_min],
+               V_max=float(system.V[i_max]),
+               V_max_bus=system.bus_names[i_max])
+
+    # Cargabilidad de las ramas con capacidad, en servicio, y pérdidas
+    branches = system.branch_results()
+    row['losses'] = float(system.Sb*branches.total_losses().real)
+    loading = branches.loading
+    loading[~system.branch_in_operation] = np.nan
+    if np.any(np.isfinite(loading)):
+        k = np.nanargmax(loading)
+        row.update(max_loading=float(loading[k]),
+                   max_loading_branch=str(system.get_branch(k)),
+                   overloaded=tuple(int(k) for k in np.flatnonzero(
+                       branches.overloaded(loading_limit))))
+
+    return row
+
+class ContingencyResults:
+    '''
+    Tabla de resultados de un análisis de contingencias (una fila por
+    contingencia, en el mismo orden en que se pidieron).
+    '''
+
+    headers = {'contingency': 'Contingency',
+               'converged': 'Converged',
+               'iterations': 'Iterations',
+               'V_min': 'Vmin\n(pu)',
+               'V_min_bus': 'Vmin\nbus',
+               'V_max': 'Vmax\n(pu)',
+               'V_max_bus': 'Vmax\nbus',
+               'max_loading': 'Max.\nloading (%)',
+               'max_loading_branch': 'Most loaded\nbranch',
+               'islands': 'Islands'}
+
+    def __init__(self, rows):
+
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __getitem__(self, i):
+        return self.rows[i]
+
+    def column(self, key):
+        '''
+        Devolver una columna de la tabla como arreglo.
+        '''
+
+        return np.array([row[key] for row in self.rows])
+
+    def failed(self, failure=None):
+        '''
+        Devolver las filas de las contingencias que no convergieron; con
+        failure, solo las de esa causa (ver pf.StepControl.failures).
+        '''
+
+        return [row for row in self.rows if not row['converged']
+                and failure in (None, row['failure'])]
+
+    def overloaded(self):
+        '''
+        Devolver las filas de las contingencias con alguna rama sobrecargada.
+        '''
+
+        return [row for row in self.rows if row['overloaded']]
+
+    def islanded(self):
+        '''
+        Devolver las filas de las contingencias que dividen la red en islas
+        (se distinguen así de los colapsos de tensión).
+        '''
+
+        return [row for row in self.rows if row['islands'] > 1]
+
+    def stats(self):
+        '''
+        Devolver un pf.SolverStats con los contadores y tiempos sumados de
+        todas las contingencias (de todos los procesos de trabajo).
+        '''
+
+        stats = pf.SolverStats()
+        for row in self.rows:
+            stats.merge(row['stats'])
+
+        return stats
+
+    def __str__(self):
+
+        data = [[row[key] for key in self.headers] for row in self.rows]
+        precision = (0, 0, 0, '.4f', 0, '.4f', 0, '.1f', 0, 0)
+
+        return tabulate.tabulate(data, headers=list(self.headers.values()),
+                                 floatfmt=precision)
+
+class ContingencyAnalyzer:
+    '''
+    Análisis de contingencias de ramas (líneas y transformadores) en paralelo.
+
+    El sistema se serializa una sola vez y cada proceso de trabajo lo recibe
+    al iniciar; luego solo viajan los índices de las ramas de cada
+    contingencia y las filas de resultados.
+    '''
+
+    def __init__(self, system, max_workers=None, loading_limit=100,
+                 warm_start=True, **pf_options):
+        '''
+        pf_options se pasan a System.run_pf (tol, max_iters, solver,
+        step_control, ...); con step_control las contingencias sin solución
+        se abandonan tras pocas iteraciones y la causa queda en la columna
+        'failure'.
+        Con max_workers=1 las contingencias se resuelven en este proceso.
+        Con warm_start=True cada contingencia parte de la solución actual
+        del sistema (el caso base) en lugar de 'flat start'.
+        '''
+
+        self.system = system
+        self.max_workers = max_workers or os.cpu_count()
+        self.loading_limit = loading_limit
+        self.warm_start = warm_start
+        self.pf_options = pf_options
+
+    def build_tasks(self, outages):
+        '''
+        Convertir las contingencias en tareas.
+
+        Cada contingencia puede ser una rama (vista o índice) o una tupla de
+        ramas que salen simultáneamente (N-2, ...).
+        '''
+
+        tasks = []
+        for outage in outages:
+            branches = outage if isinstance(outage, (tuple, list)) else (outage,)
+            indices = tuple(int(getattr(br, 'index', br)) for br in branches)
+            name = ' & '.join(str(self.system.get_branch(k)) for k in indices)
+            tasks.append((name, indices, self.pf_options, self.loading_limit,
+                          self.warm_start))
+
+        return tasks
+
+    def dc_screen(self, outages=None, loading_limit=100):
+        '''
+        Preseleccionar contingencias sencillas (N-1) con factores lineales.
+
+        Los flujos de potencia activa posteriores a cada salida se estiman
+        con la matriz LODF del modelo DC a partir de los flujos del caso base
+        (la solución actual del sistema), con unos pocos productos
+        matriciales; la potencia reactiva de cada rama se mantiene en su
+        valor del caso base. Devuelve los índices de las ramas cuya salida
+        divide la red o lleva alguna rama con capacidad por encima de
+        loading_limit (%), que son las que conviene resolver con run(). El
+        modelo lineal no ve problemas de tensión.
+        '''
+
+        system = self.system
+        if outages is None:
+            outages = np.flatnonzero(system.branch_in_operation)
+        k = np.array([int(getattr(br, 'index', br)) for br in outages],
+                     dtype=int)
+
+        # Flujos del caso base
+        Sf, St = system.branch_flows()
+        P = Sf.real
+        Q = np.maximum(np.abs(Sf.imag), np.abs(St.imag))
+
+        # Flujos posteriores: una columna por contingencia
+        LODF = system.build_LODF(branches=k)
+        P_post = P[:, None] + LODF*P[k]
+        P_post[k, np.arange(len(k))] = 0
+        S_post = np.hypot(P_post, Q[:, None])
+        loading = 100*system.Sb*S_post/system.branch_MVA[:, None]
+
+        islanding = np.any(np.isnan(P_post), axis=0)
+        overloaded = np.any(loading > loading_limit, axis=0)
+
+        return k[islanding | overloaded]
+
+    def run(self, outages=None, chunksize=None):
+        '''
+        Resolver todas las contingencias y devolver un ContingencyResults.
+
+        Si no se dan contingencias, se analiza la salida de cada rama en
+        servicio (N-1).
+        '''
+
+        if outages is None:
+            outages = np.flatnonzero(self.system.branch_in_operation)
+
+        tasks = self.build_tasks(outages)
+        payload = pickle.dumps(self.system)
+
+        if self.max_workers == 1:
+            _init_worker(payload)
+            rows = [_solve_contingency(task) for task in tasks]
+        else:
+            if chunksize is None:
+                chunksize = max(1, len(tasks) // (4*self.max_workers))
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    initializer=_init_worker,
+                    initargs=(payload,)) as executor:
+                rows = list(executor.map(_solve_contingency, tasks,
+                                         chunksize=chunksize))
+
+        return ContingencyResults(rows)
@@ -0,0 +1,223 @@
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+
+class CPFResults:
+    '''
+    Curvas PV obtenidas con el flujo de potencia de continuación.
+
+    lambdas[i] es el parámetro de carga del punto i; V[i] y theta[i] son las
+    tensiones de todas las barras (en el orden de los arreglos del sistema)
+    en ese punto.
+    '''
+
+    def __init__(self, system, lambdas, V, theta, status, iterations):
+
+        self.system = system
+        self.lambdas = np.array(lambdas)
+        self.V = np.array(V)
+        self.theta = np.array(theta)
+        self.status = status
+        self.iterations = iterations
+        self.nose_index = int(np.argmax(self.lambdas))
+        self.lambda_max = float(self.lambdas[self.nose_index])
+
+    def __len__(self):
+        return len(self.lambdas)
+
+    def pv_curve(self, bus):
+        '''
+        Devolver (lambdas, V) de una barra (vista, índice o nombre).
+        '''
+
+        if isinstance(bus, str):
+            i = self.system.bus_names.index(bus)
+        else:
+            i = getattr(bus, 'index', bus)
+
+        return self.lambdas, self.V[:, i]
+
+    def __str__(self):
+        return (f'CPF: {self.status}; maximum loading lambda = '
+                f'{self.lambda_max:.4f} after {len(self)} points and '
+                f'{self.iterations} corrector iterations')
+
+class ContinuationPowerFlow:
+    '''
+    Flujo de potencia de continuación (predictor-corrector) sobre un System.
+
+    La carga de las barras escogidas crece con el parámetro lambda a factor
+    de potencia constante:
+
+        PL(lambda) = PL0 + (lambda - 1)*factor*PL0
+        QL(lambda) = QL0 + (lambda - 1)*factor*QL0
+
+    de modo que con factor = 1 la carga de esas barras es lambda*PL0, como en
+    el análisis de cargabilidad de read_system.py. El predictor sigue la
+    tangente a la curva y el corrector resuelve el flujo de potencia
+    aumentado con una parametrización local: se fija la variable (una
+    tensión, un ángulo o lambda) que más cambia a lo largo de la tangente.
+    Así el sistema aumentado no es singular en la nariz y se puede seguir la
+    curva más allá de ella.
+    '''
+
+    def __init__(self, system, buses, factors=1.0):
+
+        self.system = system
+        self.buses = np.array([getattr(bus, 'index', bus) for bus in buses],
+                              dtype=int)
+        factors = np.broadcast_to(np.asarray(factors, dtype=float),
+                                  self.buses.shape)
+
+        # Dirección de crecimiento de la carga
+        self.dPL = np.zeros(system.n_buses)
+        self.dQL = np.zeros(system.n_buses)
+        np.add.at(self.dPL, self.buses, factors*system.PL[self.buses])
+        np.add.at(self.dQL, self.buses, factors*system.QL[self.buses])
+
+    def set_point(self, y, PL0, QL0):
+        '''
+        Llevar el sistema al punto y = [x, lambda] y construir F y J.
+        '''
+
+        system = self.system
+        system.update_v(y[:-1])
+        system.PL[:] = PL0 + (y[-1] - 1)*self.dPL
+        system.QL[:] = QL0 + (y[-1] - 1)*self.dQL
+        system.build_F()
+        system.build_J()
+
+    def augmented_J(self, k):
+        '''
+        Jacobiana aumentada [[J, dF/dlambda], [e_k, 0]] en el punto actual.
+        '''
+
+        system = self.system
+        dF_dlambda = np.concatenate([self.dPL[system.pqpv],
+                                     self.dQL[system.pq]])
+        n = len(dF_dlambda)
+        e_k = scipy.sparse.csr_matrix(([1.0], ([0], [k])), shape=(1, n + 1))
+
+        top = scipy.sparse.hstack([system.J, dF_dlambda[:, None]])
+
+        return scipy.sparse.vstack([top, e_k], format='csc')
+
+    def tangent(self, k, previous):
+        '''
+        Calcular la tangente unitaria a la curva en el punto actual, con el
+        mismo sentido de avance que la tangente anterior.
+        '''
+
+        rhs = np.zeros(self.system.J.shape[0] + 1)
+        rhs[-1] = 1
+        t = scipy.sparse.linalg.splu(self.augmented_J(k)).solve(rhs)
+        t /= np.linalg.norm(t)
+        if previous is not None and np.dot(t, previous) < 0:
+            t = -t
+
+        return t
+
+    def correct(self, y, k, PL0, QL0, tol, max_iters):
+        '''
+        Corregir el punto predicho y fijando la variable k. Devuelve el punto
+        corregido (o None si no converge) y el número de iteraciones.
+
+        Cerca de la curva el corrector converge cuadráticamente, así que se
+        abandona en cuanto la norma de las diferencias crece: el paso del
+        predictor fue demasiado largo y conviene reducirlo sin gastar las
+        iteraciones restantes.
+        '''
+
+        y = y.copy()
+        target = y[k]
+        previous = np.inf
+        for iters in range(max_iters + 1):
+            self.set_point(y, PL0, QL0)
+            G = np.append(self.system.F, y[k] - target)
+            if np.max(np.abs(G)) < tol:
+                return y, iters
+            norm = np.linalg.norm(G)
+            if iters == max_iters or not norm < previous:
+                break
+            previous = norm
+            try:
+                y -= scipy.sparse.linalg.splu(self.augmented_J(k)).solve(G)
+            except RuntimeError:
+                break
+            if not np.all(np.isfinite(y)):
+                break
+
+        return None, iters
+
+    def run(self, step=0.05, min_step=1e-4, max_step=0.5, max_points=300,
+            lambda_stop=None, tol=1e-9, max_iters=8, **pf_options):
+        '''
+        Trazar las curvas PV desde el caso base (lambda = 1).
+
+        El paso se adapta según el número de iteraciones del corrector y se
+        reduce a la mitad cuando este falla. Se termina cuando, pasada la
+        nariz, lambda baja de lambda_stop (por defecto 1), cuando el paso es
+        menor que min_step o al llegar a max_points. Al terminar, las cargas
+        y tensiones del sistema vuelven a las del caso base. pf_options se
+        pasan a System.run_pf para resolver el caso base.
+        '''
+
+        system = self.system
+        PL0 = system.PL.copy()
+        QL0 = system.QL.copy()
+        V0 = system.V.copy()
+        theta0 = system.theta.copy()
+        lambda_stop = 1.0 if lambda_stop is None else lambda_stop
+
+        try:
+            # Caso base
+            pf_options.setdefault('warm_start', True)
+            if not system.run_pf(**pf_options):
+                raise RuntimeError('The base case power flow did not converge')
+
+            y = np.append(system.get_state(), 1.0)
+            lambdas, V, theta = [1.0], [system.V.copy()], [system.theta.copy()]
+            iterations = 0
+            k = len(y) - 1
+            t = None
+            status = 'maximum number of points reached'
+
+            self.set_point(y, PL0, QL0)
+            while len(lambdas) < max_points:
+                # Predictor
+                t = self.tangent(k, t)
+                k = int(np.argmax(np.abs(t)))
+                y_new, iters = self.correct(y + step*t, k, PL0, QL0, tol,
+                                            max_iters)
+                iterations += iters
+
+                # Adaptar el paso
+                if y_new is None:
+                    step /= 2
+                    self.set_point(y, PL0, QL0)
+                    if step < min_step:
+                        status = 'step size below minimum'
+                        break
+                    continue
+                if iters <= 3:
+                    step = min(1.5*step, max_step)
+                elif iters >= 6:
+                    step = max(step/1.5, min_step)
+
+                # Aceptar el punto
+                y = y_new
+                lambdas.append(y[-1])
+                V.append(system.V.copy())
+                theta.append(system.theta.copy())
+                if y[-1] < max(lambdas) and y[-1] <= lambda_stop:
+                    status = 'nose point passed'
+                    break
+
+        finally:
+            # Volver al caso base
+            system.PL[:] = PL0
+            system.QL[:] = QL0
+            system.V[:] = V0
+            system.theta[:] = theta0
+
+        return CPFResults(system, lambdas, V, theta, status, iterations)
@@ -0,0 +1,271 @@
+import concurrent.futures
+import itertools
+import os
+
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.sparse.linalg
+
+# Resultados de las zonas factorizadas en este proceso, entre las dos etapas
+# de un paso: (solucionador, zona) -> (A^-1 F, A^-1 B) (ver _factor_area)
+_blocks = {}
+
+# Identificadores de los solucionadores (claves de _blocks)
+_solver_ids = itertools.count()
+
+def partition(system, n_areas):
+    '''
+    Dividir las barras en n_areas zonas conexas de tamaño parecido.
+
+    Las barras se ordenan por niveles a partir de una barra periférica
+    (orden de Cuthill-McKee inverso del grafo de las ramas en servicio) y
+    el orden se corta en tramos iguales, de modo que cada frontera entre
+    zonas es un nivel del grafo (pocas barras). Devuelve la zona de cada
+    barra.
+    '''
+
+    N = system.n_buses
+    on = system.branch_in_operation
+    f = system.branch_from[on]
+    t = system.branch_to[on]
+    graph = scipy.sparse.csr_matrix((np.ones(2*len(f)),
+                                     (np.concatenate([f, t]),
+                                      np.concatenate([t, f]))), shape=(N, N))
+    order = scipy.sparse.csgraph.reverse_cuthill_mckee(graph,
+                                                       symmetric_mode=True)
+    areas = np.empty(N, dtype=int)
+    areas[order] = np.arange(N)*n_areas//max(N, 1)
+
+    return areas
+
+def _factor_area(task):
+    '''
+    Factorizar el bloque interior A de una zona (en el proceso de trabajo) y
+    devolver su aporte al complemento de Schur, C A^-1 B, y al lado
+    derecho, C A^-1 F. A^-1 F y A^-1 B quedan guardados para recuperar el
+    paso de la zona (ver _step_area).
+    '''
+
+    key, A, B, C, F = task
+    lu = scipy.sparse.linalg.splu(A)
+    y = lu.solve(F)
+    Z = lu.solve(B.toarray()) if B.shape[1] else np.zeros((len(F), 0))
+    _blocks[key] = (y, Z)
+
+    return C @ Z, C @ y
+
+def _step_area(task):
+    '''
+    Recuperar el paso de las incógnitas interiores de una zona a partir del
+    de las de la interfaz: x = A^-1 F - A^-1 B x_s.
+    '''
+
+    key, x_s = task
+    y, Z = _blocks.pop(key)
+
+    return y - Z @ x_s
+
+def _drop_blocks(solver_id):
+    '''
+    Descartar los resultados guardados de las zonas de un solucionador.
+    '''
+
+    for key in [key for key in _blocks if key[0] == solver_id]:
+        del _blocks[key]
+
+class DecomposedSolver:
+    '''
+    Solucionador del paso de Newton (J*dx = F) por descomposición en zonas,
+    con las zonas repartidas entre procesos de trabajo.
+
+    Las barras se dividen en zonas (areas: la zona de cada barra, como
+    números o nombres, o un diccionario zona -> barras; por defecto
+    n_areas zonas, ver partition). Las incógnitas de las barras vecinas de
+    otra zona de número menor forman la interfaz; las demás son interiores
+    a su zona y, ordenadas por zonas, dejan J en forma de bloques con borde:
+
+        | A_1          B_1 | |x_1|   |F_1|
+        |      ...     ... | |...| = |...|
+        |          A_k B_k | |x_k|   |F_k|
+        | C_1  ... C_k  D  | |x_s|   |F_s|
+
+    Cada proceso factoriza los bloques A de sus zonas (LU dispersa) y
+    devuelve su aporte al complemento de Schur de la interfaz,
+
+        S = D - sum(C_i A_i^-1 B_i),
+
+    que se resuelve (denso) en este proceso; luego cada proceso recupera el
+    paso de sus zonas, x_i = A_i^-1 (F_i - B_i x_s), sin volver a
+    factorizar. Solo viajan los bloques de J, los aportes (del tamaño de la
+    interfaz de cada zona) y los pasos.
+
+    Se usa como solver de System.run_pf (o solve_step):
+
+        with DecomposedSolver(system, n_areas=4) as solver:
+            system.run_pf(solver=solver)
+
+    Con max_workers=1 todo se resuelve en este proceso.
+    '''
+
+    def __init__(self, system, areas=None, n_areas=None, max_workers=None):
+
+        self.system = system
+        self.max_workers = max_workers or os.cpu_count()
+        if areas is None:
+            areas = partition(system, n_areas or self.max_workers)
+        elif isinstance(areas, dict):
+            labels = np.full(system.n_buses, -1)
+            for k, buses in enumerate(areas.values()):
+                labels[[system.bus_names.index(bus) if isinstance(bus, str)
+                        else int(getattr(bus, 'index', bus))
+                        for bus in buses]] = k
+            if np.any(labels < 0):
+                raise ValueError('Every bus must belong to an area')
+            areas = labels
+        _, self.areas = np.unique(np.asarray(areas), return_inverse=True)
+        self.n_areas = int(self.areas.max(initial=-1)) + 1
+        self._executors = None
+        self._id = next(_solver_ids)
+
+        # Contadores
+        self.interface_size = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        '''
+        Crear los procesos de trabajo (si no existen). Cada uno tiene su
+        propio ejecutor para que las dos etapas de una zona corran en el
+        mismo proceso.
+        '''
+
+        if self._executors is None and self.max_workers > 1:
+            self._executors = [
+                concurrent.futures.ProcessPoolExecutor(max_workers=1)
+                for _ in range(min(self.max_workers, self.n_areas))]
+
+    def close(self):
+        '''
+        Cerrar los procesos de trabajo.
+        '''
+
+        _drop_blocks(self._id)
+        if self._executors is not None:
+            for executor in self._executors:
+                executor.shutdown()
+            self._executors = None
+
+    def _map(self, func, tasks, areas):
+        '''
+        Ejecutar func en el proceso de cada zona y devolver los resultados.
+        '''
+
+        if self.max_workers == 1:
+            return [func(task) for task in tasks]
+
+        self.start()
+        futures = [self._executors[area % len(self._executors)].submit(
+                       func, task) for area, task in zip(areas, tasks)]
+
+        return [future.result() for future in futures]
+
+    def unknown_buses(self, size):
+        '''
+        Devolver la barra de cada incógnita de J (de tamaño size): ángulos
+        de system.pqpv y magnitudes de system.pq, o de system.pqpv con
+        límites de reactivos.
+        '''
+
+        system = self.system
+        pqpv = system.pqpv
+        second = system.pq if size == len(pqpv) + len(system.pq) else pqpv
+
+        return np.concatenate([pqpv, second])
+
+    def split(self, J):
+        '''
+        Clasificar las incógnitas de J: devuelve la zona de cada una y las
+        de la interfaz.
+        '''
+
+        buses = self.unknown_buses(J.shape[0])
+        area = self.areas[buses]
+
+        # En cada acoplamiento entre zonas, la barra de la zona mayor pasa
+        # a la interfaz (con sus dos incógnitas)
+        J = J.tocsc()
+        rows = J.indices
+        cols = np.repeat(np.arange(J.shape[1]), np.diff(J.indptr))
+        cross = area[rows] != area[cols]
+        higher = np.where(area[rows[cross]] > area[cols[cross]],
+                          rows[cross], cols[cross])
+        interface = np.zeros(self.system.n_buses, dtype=bool)
+        interface[buses[higher]] = True
+
+        return area, interface[buses]
+
+    def reset(self):
+        '''
+        Comenzar una nueva corrida (ver System.run_pf): descartar los
+        resultados de las zonas que haya dejado un paso interrumpido.
+        '''
+
+        _drop_blocks(self._id)
+        if self._executors is not None:
+            for executor in self._executors:
+                executor.submit(_drop_blocks, self._id).result()
+
+    def __call__(self, J, F):
+
+        J = J.tocsr()
+        area, interface = self.split(J)
+        s = np.flatnonzero(interface)
+        self.interface_size = len(s)
+        J_s = J[s]
+
+        # Bloques de cada zona: columnas de B y filas de C no nulas
+        tasks, areas, interior, couplings = [], [], [], []
+        for k in range(self.n_areas):
+            i = np.flatnonzero((area == k) & ~interface)
+            if len(i) == 0:
+                continue
+            J_i = J[i]
+            B = J_i[:, s].tocsc()
+            C = J_s[:, i].tocsr()
+            cols = np.flatnonzero(np.diff(B.indptr))
+            rows = np.flatnonzero(np.diff(C.indptr))
+            tasks.append(((self._id, k), J_i[:, i].tocsc(), B[:, cols],
+                          C[rows], F[i]))
+            areas.append(k)
+            interior.append(i)
+            couplings.append((rows, cols))
+
+        try:
+            # Complemento de Schur de la interfaz
+            results = self._map(_factor_area, tasks, areas)
+            S = J_s[:, s].toarray()
+            g = F[s].copy()
+            for (rows, cols), (S_k, g_k) in zip(couplings, results):
+                S[np.ix_(rows, cols)] -= S_k
+                g[rows] -= g_k
+            x_s = np.linalg.solve(S, g) if len(s) else g
+
+            # Paso de las incógnitas interiores
+            steps = self._map(_step_area,
+                              [((self._id, k), x_s[cols]) for k, (_, cols)
+                               in zip(areas, couplings)], areas)
+        except Exception:
+            self.reset()
+            raise
+        dx = np.empty(J.shape[0])
+        dx[s] = x_s
+        for i, x_i in zip(interior, steps):
+            dx[i] = x_i
+
+        return dx
@@ -0,0 +1,542 @@
+import csv
+import re
+import warnings
+
+import numpy as np
+
+import pf
+
+# Tipos de barra de MATPOWER y PSS/E (1 PQ, 2 PV, 3 oscilante, 4 aislada)
+_BUS_TYPES = {1: pf.PQ, 2: pf.PV, 3: pf.SLACK}
+ISOLATED = 4
+
+def _bus_name(number):
+    '''
+    Nombre de una barra a partir de su número (los enteros, con todas sus
+    cifras).
+    '''
+
+    number = float(number)
+
+    return str(int(number)) if number.is_integer() else repr(number)
+
+def _lookup(numbers, query):
+    '''
+    Convertir números de barra en índices (posición en numbers).
+    '''
+
+    query = np.asarray(query, dtype=float)
+    order = np.argsort(numbers, kind='stable')
+    pos = np.searchsorted(numbers, query, sorter=order)
+    pos = np.minimum(pos, len(numbers) - 1)
+    found = numbers[order[pos]] == query if len(numbers) else \
+            np.zeros(len(query), dtype=bool)
+    if not np.all(found):
+        raise ValueError(f'Unknown bus {_bus_name(query[~found][0])}')
+
+    return order[pos]
+
+def build_system(Sb, buses, gens, branches, name=''):
+    '''
+    Crear un pf.System a partir de arreglos por columnas.
+
+    buses: number, type (1 PQ, 2 PV, 3 oscilante, 4 aislada), Pd, Qd, Gs,
+    Bs (MW y Mvar; Gs y Bs a tensión de 1 pu), Vm (pu), Va (grados) y
+    baseKV. gens: bus (número), Pg, Qg, Qmax, Qmin (MW, Mvar), Vg (pu) y
+    status; los límites de Q de los generadores de una barra se suman.
+    branches: from, to (números), R, X (pu), from_Y, to_Y (admitancias en
+    derivación en pu, tal como las usa System.branch_admittances), n, MVA
+    (nan si no tiene capacidad), in_operation e is_transformer.
+
+    Se sigue la convención de MATPOWER: las barras aisladas y sus ramas se
+    descartan, las barras PV sin generadores en servicio pasan a PQ y los
+    generadores en barras PQ se tratan como cargas negativas (P y Q).
+    '''
+
+    number = np.asarray(buses['number'], dtype=float)
+    code = np.asarray(buses['type'], dtype=int)
+
+    # Descartar barras aisladas y ramas conectadas a ellas
+    keep = code != ISOLATED
+    number = number[keep]
+    code = code[keep]
+    buses = {key: np.asarray(value)[keep] for key, value in buses.items()}
+    n = len(number)
+
+    gen_on = np.asarray(gens['status'], dtype=bool) & \
+             np.isin(gens['bus'], number)
+    gen_bus = _lookup(number, np.asarray(gens['bus'])[gen_on])
+    Pg = np.asarray(gens['Pg'], dtype=float)[gen_on]
+    Qg = np.asarray(gens['Qg'], dtype=float)[gen_on]
+    Vg = np.asarray(gens['Vg'], dtype=float)[gen_on]
+    Qmax = np.asarray(gens['Qmax'], dtype=float)[gen_on]
+    Qmin = np.asarray(gens['Qmin'], dtype=float)[gen_on]
+
+    bus_type = np.array([_BUS_TYPES.get(c, pf.PQ) for c in code],
+                        dtype=np.int8)
+    has_gen = np.zeros(n, dtype=bool)
+    has_gen[gen_bus] = True
+    bus_type[(bus_type == pf.PV) & ~has_gen] = pf.PQ
+
+    # Cargas netas: consumo menos generación (Q solo en barras PQ)
+    PL = np.asarray(buses['Pd'], dtype=float)/Sb
+    QL = np.asarray(buses['Qd'], dtype=float)/Sb
+    np.add.at(PL, gen_bus, -Pg/Sb)
+    at_PQ = bus_type[gen_bus] == pf.PQ
+    np.add.at(QL, gen_bus[at_PQ], -Qg[at_PQ]/Sb)
+
+    # Consignas de tensión: la del primer generador de cada barra
+    V = np.asarray(buses['Vm'], dtype=float).copy()
+    regulated = bus_type[gen_bus] != pf.PQ
+    V[gen_bus[regulated][::-1]] = Vg[regulated][::-1]
+    Vset = np.where(bus_type != pf.PQ, V, np.nan)
+
+    # Límites de potencia reactiva de las barras PV
+    Q_upper = np.full(n, np.inf)
+    Q_lower = np.full(n, -np.inf)
+    at_PV = bus_type[gen_bus] == pf.PV
+    if np.any(at_PV):
+        Q_upper[gen_bus[at_PV]] = 0
+        Q_lower[gen_bus[at_PV]] = 0
+        np.add.at(Q_upper, gen_bus[at_PV], Qmax[at_PV]/Sb)
+        np.add.at(Q_lower, gen_bus[at_PV], Qmin[at_PV]/Sb)
+
+    system = pf.System(Sb=Sb, name=name)
+    system.add_buses(bus_type, [_bus_name(k) for k in number],
+                     V=V,
+                     theta=np.deg2rad(np.asarray(buses['Va'], dtype=float)),
+                     PL=PL, QL=QL,
+                     G=np.asarray(buses['Gs'], dtype=float)/Sb,
+                     B=np.asarray(buses['Bs'], dtype=float)/Sb,
+                     Vb=buses['baseKV'], Vset=Vset, Qmin=Q_lower,
+                     Qmax=Q_upper)
+
+    connected = np.isin(branches['from'], number) & \
+                np.isin(branches['to'], number)
+    branches = {key: np.asarray(value)[connected]
+                for key, value in branches.items()}
+    system.add_branches(_lookup(number, branches['from']),
+                        _lookup(number, branches['to']),
+                        R=branches['R'], X=branches['X'],
+                        from_Y=branches['from_Y'], to_Y=branches['to_Y'],
+                        n=branches['n'], MVA=branches['MVA'],
+                        in_operation=branches['in_operation'],
+                        is_transformer=branches['is_transformer'])
+
+    return system
+
+# ---------------
+# MATPOWER (.m)
+# ---------------
+
+# Inicio de una matriz: mpc.bus = [
+_MATPOWER_MATRIX = re.compile(r'^\s*mpc\.(\w+)\s*=\s*\[')
+_MATPOWER_SCALAR = re.compile(r'^\s*mpc\.(\w+)\s*=\s*([^;\[{]+);')
+_MATPOWER_NAME = re.compile(r'^\s*function\s+\w+\s*=\s*(\w+)')
+
+def read_matpower_data(path, matrices=('bus', 'gen', 'branch')):
+    '''
+    Leer las matrices de un caso de MATPOWER (formato de caso versión 2).
+
+    El archivo se recorre línea por línea: el texto numérico de cada matriz
+    pedida se acumula y se convierte en un solo arreglo al cerrarla. Devuelve
+    un diccionario con baseMVA, el nombre del caso y las matrices.
+    '''
+
+    data = {'baseMVA': 100.0, 'name': ''}
+    current = None
+    chunks = []
+
+    with open(path) as f:
+        for line in f:
+            line = line.split('%', 1)[0]
+            if current is None:
+                if match := _MATPOWER_MATRIX.match(line):
+                    if match.group(1) in matrices:
+                        current = match.group(1)
+                        chunks = []
+                        line = line[match.end():]
+                    else:
+                        current = ''
+                        line = line[match.end():]
+                elif match := _MATPOWER_SCALAR.match(line):
+                    if match.group(1) == 'baseMVA':
+                        data['baseMVA'] = float(match.group(2))
+                    continue
+                elif match := _MATPOWER_NAME.match(line):
+                    data['name'] = match.group(1)
+                    continue
+                else:
+                    continue
+
+            # Dentro de una matriz
+            end = line.find(']')
+            if end >= 0:
+                line = line[:end]
+            if current:
+                chunks.append(line.replace(';', '\n'))
+            if end >= 0:
+                if current:
+                    data[current] = _matpower_matrix(''.join(chunks))
+                current = None
+
+    for key in matrices:
+        if key not in data:
+            raise ValueError(f'{path}: mpc.{key} not found')
+
+    return data
+
+def _matpower_matrix(text):
+    '''
+    Convertir el texto de una matriz de MATPOWER en un arreglo 2-D.
+    '''
+
+    rows = [row for row in text.splitlines() if row.strip()]
+    if not rows:
+        return np.empty((0, 0))
+    n_columns = len(rows[0].replace(',', ' ').split())
+    values = np.array(' '.join(rows).replace(',', ' ').split(), dtype=float)
+
+    return values.reshape(-1, n_columns)
+
+def read_matpower(path, name=None):
+    '''
+    Crear un pf.System a partir de un caso de MATPOWER (.m).
+
+    Los desfasadores (ángulo de desplazamiento distinto de cero) se
+    modelan sin el desfase, porque System no lo representa.
+    '''
+
+    data = read_matpower_data(path)
+    bus, gen, branch = data['bus'], data['gen'], data['branch']
+
+    # Columnas de MATPOWER (idx_bus, idx_gen, idx_brch)
+    buses = {'number': bus[:, 0], 'type': bus[:, 1],
+             'Pd': bus[:, 2], 'Qd': bus[:, 3],
+             'Gs': bus[:, 4], 'Bs': bus[:, 5],
+             'Vm': bus[:, 7], 'Va': bus[:, 8], 'baseKV': bus[:, 9]}
+    gens = {'bus': gen[:, 0], 'Pg': gen[:, 1], 'Qg': gen[:, 2],
+            'Qmax': gen[:, 3], 'Qmin': gen[:, 4],
+            'Vg': gen[:, 5], 'status': gen[:, 7] > 0}
+
+    ratio = branch[:, 8]
+    is_transformer = ratio != 0
+    n = np.where(is_transformer, ratio, 1.0)
+    B_half = 1j*branch[:, 4]/2
+    if np.any(branch[:, 9] != 0):
+        warnings.warn(f'{path}: phase shift angles are ignored')
+    branches = {'from': branch[:, 0], 'to': branch[:, 1],
+                'R': branch[:, 2], 'X': branch[:, 3],
+                'from_Y': B_half/n**2, 'to_Y': B_half,
+                'n': n, 'MVA': np.where(branch[:, 5] > 0, branch[:, 5], np.nan),
+                'in_operation': branch[:, 10] > 0,
+                'is_transformer': is_transformer}
+
+    return build_system(data['baseMVA'], buses, gens, branches,
+                        name=data['name'] if name is None else name)
+
+# ---------------
+# PSS/E RAW
+# ---------------
+
+# Parte de una línea antes del comentario ('/' fuera de comillas)
+_RAW_DATA = re.compile(r'''(?:'[^']*'|"[^"]*"|[^'"/])*''')
+
+# Orden de las secciones según la versión del formato. Las que no se
+# necesitan se leen y se descartan.
+_RAW_SECTIONS = {
+    30: ('bus', 'load', 'generator', 'branch', 'transformer', 'area',
+         'two_terminal_dc', 'vsc_dc', 'switched_shunt'),
+    31: ('bus', 'load', 'fixed_shunt', 'generator', 'branch', 'transformer',
+         'area', 'two_terminal_dc', 'vsc_dc', 'impedance_correction',
+         'multi_terminal_dc', 'multi_section_line', 'zone', 'interarea',
+         'owner', 'facts', 'switched_shunt'),
+}
+
+def _raw_fields(line):
+    '''
+    Separar los campos de una línea de un archivo RAW (sin comentario).
+    '''
+
+    data = _RAW_DATA.match(line).group(0).strip()
+    if not data:
+        return []
+    if ',' in data:
+        fields = next(csv.reader([data], quotechar="'",
+                                 skipinitialspace=True))
+    else:
+        fields = re.findall(r"'[^']*'|\S+", data)
+
+    return [field.strip().strip("'\"").strip() for field in fields]
+
+def _raw_records(lines, state):
+    '''
+    Recorrer los registros de una sección hasta su terminador ('0').
+    state['end'] se activa si se encuentra el fin de datos ('Q').
+    '''
+
+    for line in lines:
+        fields = _raw_fields(line)
+        if not fields:
+            continue
+        if fields[0] == 'Q':
+            state['end'] = True
+            return
+        if fields[0] == '0':
+            return
+        yield fields
+
+def _value(fields, i, default=0.0):
+    '''
+    Campo numérico i (o default si falta o está vacío).
+    '''
+
+    if i < len(fields) and fields[i] != '':
+        return float(fields[i])
+
+    return default
+
+def read_psse_raw(path, name=None):
+    '''
+    Crear un pf.System a partir de un archivo PSS/E RAW (versiones 29 a 33).
+
+    Se leen barras, cargas, compensadores fijos y conmutables (con su valor
+    inicial), generadores, ramas y transformadores de dos y tres devanados
+    (estos últimos con una barra interna en estrella). Las cargas de
+    corriente constante se toman como de potencia constante y los ángulos
+    de desfase de los transformadores se ignoran.
+    '''
+
+    buses = {key: [] for key in ('number', 'type', 'Pd', 'Qd', 'Gs', 'Bs',
+                                 'Vm', 'Va', 'baseKV')}
+    gens = {key: [] for key in ('bus', 'Pg', 'Qg', 'Qmax', 'Qmin', 'Vg',
+                                'status')}
+    branches = {key: [] for key in ('from', 'to', 'R', 'X', 'from_Y',
+                                    'to_Y', 'n', 'MVA', 'in_operation',
+                                    'is_transformer')}
+    # Cargas y compensadores por barra (se suman al final)
+    bus_loads = {key: [] for key in ('bus', 'P', 'Q', 'G', 'B')}
+    base_kV = None
+    # Barras en estrella de los transformadores de tres devanados (se
+    # numeran con -1, -2, ... hasta conocer todas las barras)
+    stars = []
+    phase_shift = False
+    state = {'end': False}
+
+    def add_load(bus, P=0.0, Q=0.0, G=0.0, B=0.0):
+        for key, value in zip(('bus', 'P', 'Q', 'G', 'B'), (bus, P, Q, G, B)):
+            bus_loads[key].append(value)
+
+    def add_branch(i, j, R, X, from_Y, to_Y, n, MVA, on, transformer):
+        for key, value in zip(branches, (i, j, R, X, from_Y, to_Y, n, MVA,
+                                         on, transformer)):
+            branches[key].append(value)
+
+    with open(path, encoding='latin-1') as f:
+        lines = iter(f)
+        header = _raw_fields(next(lines))
+        Sb = _value(header, 1, 100.0)
+        rev = int(_value(header, 2, 33))
+        if rev > 33:
+            raise ValueError(f'{path}: PSS/E RAW version {rev} is not '
+                             'supported (versions 29 to 33)')
+        title = next(lines).strip()
+        next(lines)
+        sections = _RAW_SECTIONS[30 if rev <= 30 else 31]
+
+        for section in sections:
+            if state['end']:
+                break
+            for fields in _raw_records(lines, state):
+                if section == 'bus':
+                    buses['number'].append(float(fields[0]))
+                    buses['baseKV'].append(_value(fields, 2))
+                    buses['type'].append(int(_value(fields, 3, 1)))
+                    if rev <= 30:
+                        # I, NAME, BASKV, IDE, GL, BL, AREA, ZONE, VM, VA
+                        add_load(float(fields[0]), G=_value(fields, 4),
+                                 B=_value(fields, 5))
+                        vm, va = 8, 9
+                    else:
+                        # I, NAME, BASKV, IDE, AREA, ZONE, OWNER, VM, VA
+                        vm, va = 7, 8
+                    buses['Vm'].append(_value(fields, vm, 1.0))
+                    buses['Va'].append(_value(fields, va))
+
+                elif section == 'load':
+                    # I, ID, STATUS, AREA, ZONE, PL, QL, IP, IQ, YP, YQ
+                    if _value(fields, 2, 1):
+                        add_load(float(fields[0]),
+                                 P=_value(fields, 5) + _value(fields, 7),
+                                 Q=_value(fields, 6) + _value(fields, 8),
+                                 G=_value(fields, 9), B=_value(fields, 10))
+
+                elif section == 'fixed_shunt':
+                    # I, ID, STATUS, GL, BL
+                    if _value(fields, 2, 1):
+                        add_load(float(fields[0]), G=_value(fields, 3),
+                                 B=_value(fields, 4))
+
+                elif section == 'generator':
+                    # I, ID, PG, QG, QT, QB, VS, IREG, MBASE, ZR, ZX, RT,
+                    # XT, GTAP, STAT
+                    gens['bus'].append(float(fields[0]))
+                    gens['Pg'].append(_value(fields, 2))
+                    gens['Qg'].append(_value(fields, 3))
+                    gens['Qmax'].append(_value(fields, 4, 9999.0))
+                    gens['Qmin'].append(_value(fields, 5, -9999.0))
+                    gens['Vg'].append(_value(fields, 6, 1.0))
+                    gens['status'].append(_value(fields, 14, 1) > 0)
+
+                elif section == 'branch':
+                    # I, J, CKT, R, X, B, RATEA, RATEB, RATEC, GI, BI, GJ,
+                    # BJ, ST
+                    B_half = 1j*_value(fields, 5)/2
+                    rate = _value(fields, 6)
+                    add_branch(float(fields[0]), abs(float(fields[1])),
+                               _value(fields, 3), _value(fields, 4),
+                               _value(fields, 9) + 1j*_value(fields, 10)
+                               + B_half,
+                               _value(fields, 11) + 1j*_value(fields, 12)
+                               + B_half,
+                               1.0, rate if rate > 0 else np.nan,
+                               _value(fields, 13, 1) > 0, False)
+
+                elif section == 'transformer':
+                    if base_kV is None:
+                        base_kV = dict(zip(buses['number'], buses['baseKV']))
+                    phase_shift |= _read_raw_transformer(
+                        fields, lines, Sb, base_kV, stars, add_branch)
+
+                elif section == 'switched_shunt':
+                    # Valor inicial BINIT (en la versión 32 se agregaron
+                    # ADJM y STAT)
+                    if rev >= 32:
+                        if _value(fields, 3, 1):
+                            add_load(float(fields[0]), B=_value(fields, 9))
+                    else:
+                        add_load(float(fields[0]), B=_value(fields, 7))
+
+    if phase_shift:
+        warnings.warn(f'{path}: phase shift angles are ignored')
+
+    buses = {key: np.array(value) for key, value in buses.items()}
+    branches = {key: np.array(value) for key, value in branches.items()}
+    _add_star_buses(buses, branches, stars)
+
+    # Sumar cargas y compensadores a sus barras
+    bus_loads = {key: np.array(value) for key, value in bus_loads.items()}
+    index = _lookup(buses['number'], bus_loads['bus'])
+    for key, load_key in (('Pd', 'P'), ('Qd', 'Q'), ('Gs', 'G'), ('Bs', 'B')):
+        buses[key] = np.zeros(len(buses['number']))
+        np.add.at(buses[key], index, bus_loads[load_key])
+
+    return build_system(Sb, buses, gens, branches,
+                        name=title if name is None else name)
+
+def _read_raw_transformer(fields, lines, Sb, base_kV, stars, add_branch):
+    '''
+    Leer un transformador (registro de 4 o 5 líneas) y agregar sus ramas.
+
+    Un transformador de dos devanados es una rama con relación
+    n = t1/t2 e impedancia referida al devanado 2 (Z*t2**2). Uno de tres
+    devanados se representa con una barra interna en estrella y una rama
+    por devanado. Devuelve True si tiene ángulos de desfase.
+    '''
+
+    # I, J, K, CKT, CW, CZ, CM, MAG1, MAG2, NMETR, NAME, STAT
+    ends = [float(fields[0]), abs(float(fields[1])), abs(_value(fields, 2))]
+    three_winding = ends[2] != 0
+    CW, CZ, CM = (int(_value(fields, i, 1)) for i in (4, 5, 6))
+    MAG = _value(fields, 7) + 1j*_value(fields, 8)
+    status = int(_value(fields, 11, 1))
+
+    impedances = _raw_fields(next(lines))
+    windings = [_raw_fields(next(lines))
+                for _ in range(3 if three_winding else 2)]
+
+    # Relación de cada devanado en pu de la tensión base de su barra
+    t = []
+    for bus, winding in zip(ends, windings):
+        windv = _value(winding, 0, 1.0)
+        if CW == 2:
+            windv /= base_kV.get(bus, np.nan)
+        elif CW == 3:
+            nomv = _value(winding, 1)
+            windv *= nomv/base_kV.get(bus, np.nan) if nomv else 1.0
+        t.append(windv)
+    # ANG1 (y ANG2, ANG3); el registro del devanado 2 de un transformador
+    # de dos devanados no tiene ángulo
+    phase_shift = any(_value(winding, 2) != 0 for winding in windings)
+
+    # Impedancias en pu de la base del sistema: R1-2, X1-2, SBASE1-2, ...
+    Z = []
+    for k in range(3 if three_winding else 1):
+        R, X = _value(impedances, 3*k), _value(impedances, 3*k + 1)
+        Sbase = _value(impedances, 3*k + 2, Sb)
+        if CZ == 3:
+            # R en W de pérdidas y X como |Z|, en base del devanado
+            R = R/1e6/Sbase
+            X = np.sqrt(max(X**2 - R**2, 0.0))
+        if CZ in (2, 3):
+            R, X = R*Sb/Sbase, X*Sb/Sbase
+        Z.append(R + 1j*X)
+
+    if CM == 2:
+        # MAG1 en W de pérdidas sin carga, MAG2 corriente de excitación (pu)
+        Sbase = _value(impedances, 2, Sb)
+        G = MAG.real/1e6/Sb
+        MAG = G - 1j*np.sqrt(max((MAG.imag*Sbase/Sb)**2 - G**2, 0.0))
+
+    rate = [_value(winding, 3) for winding in windings]
+    rate = [r if r > 0 else np.nan for r in rate]
+
+    if not three_winding:
+        Z_t = Z[0]*t[1]**2
+        add_branch(ends[0], ends[1], Z_t.real, Z_t.imag, MAG, 0j,
+                   t[0]/t[1], rate[0], status == 1, True)
+        return phase_shift
+
+    # Estrella: Z1 = (Z12 + Z31 - Z23)/2, ...
+    Z12, Z23, Z31 = Z
+    Z_star = [(Z12 + Z31 - Z23)/2, (Z12 + Z23 - Z31)/2, (Z23 + Z31 - Z12)/2]
+    star = -(len(stars) + 1)
+    stars.append((_value(impedances, 9, 1.0), _value(impedances, 10)))
+    # STAT: 0 fuera, 1 en servicio, 2/3/4 fuera el devanado 2/3/1
+    out = {0: (0, 1, 2), 2: (1,), 3: (2,), 4: (0,)}.get(status, ())
+    for w in range(3):
+        add_branch(ends[w], star, Z_star[w].real, Z_star[w].imag,
+                   MAG if w == 0 else 0j, 0j, t[w], rate[w],
+                   w not in out, True)
+
+    return phase_shift
+
+def _add_star_buses(buses, branches, stars):
+    '''
+    Agregar las barras internas de los transformadores de tres devanados,
+    numeradas después de la última barra del archivo.
+    '''
+
+    if not stars:
+        return
+    first = buses['number'].max() + 1
+    branches['to'] = np.where(branches['to'] < 0, first - 1 - branches['to'],
+                              branches['to'])
+    Vm, Va = np.array(stars).T
+    extra = {'number': first + np.arange(len(stars)),
+             'type': np.full(len(stars), 1),
+             'Vm': Vm, 'Va': Va, 'baseKV': np.full(len(stars), np.nan)}
+    for key, value in extra.items():
+        buses[key] = np.concatenate([buses[key], value])
+
+def read_case(path, name=None):
+    '''
+    Crear un pf.System a partir de un caso de MATPOWER (.m) o PSS/E (.raw).
+    '''
+
+    if path.lower().endswith('.m'):
+        return read_matpower(path, name)
+    if path.lower().endswith('.raw'):
+        return read_psse_raw(path, name)
+
+    raise ValueError(f'Unknown case format: {path}')
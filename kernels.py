@@ -0,0 +1,253 @@
+import warnings
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Núcleos disponibles; por defecto se usa Numba si está instalado y pasa la
+# comprobación de default_backend
+BACKENDS = ('numba', 'numpy')
+
+# Resultado de la comprobación del núcleo de Numba (None: sin hacer)
+_numba_checked = None
+
+def default_backend():
+    '''
+    Elegir el núcleo por defecto: el de Numba si está instalado y, la
+    primera vez que se usa, da los mismos F y J que el de NumPy en una red
+    de prueba (ver compare); si no, el de NumPy.
+    '''
+
+    global _numba_checked
+
+    if numba is None:
+        return 'numpy'
+    if _numba_checked is None:
+        _numba_checked = _check_numba()
+
+    return 'numba' if _numba_checked else 'numpy'
+
+def _check_numba(tol=1e-10):
+    '''
+    Comparar el núcleo de Numba con el de NumPy en una red de prueba de
+    cinco barras, lejos de 'flat start'.
+    '''
+
+    import pf
+
+    system = pf.System()
+    buses = [system.add_slack(V=1.02, Vb=230),
+             system.add_PV(PL=-0.6, V=1.01, Vb=230),
+             system.add_PQ(PL=0.9, QL=0.3, Vb=230, B=0.05),
+             system.add_PQ(PL=0.4, QL=-0.1, Vb=230),
+             system.add_PQ(PL=0.0, QL=0.0, Vb=230)]
+    for i, j, X in ((0, 1, 0.08), (1, 2, 0.12), (2, 3, 0.1), (3, 0, 0.15),
+                    (3, 4, 0.05), (4, 1, 0.2)):
+        system.add_line(buses[i], buses[j], X=X, R=X/8, total_B=0.02)
+    system.add_transformer(buses[2], buses[4], R=0.005, X=0.1, n=0.97,
+                           MVA=100)
+    system.V[:] = [1.02, 1.01, 0.95, 0.97, 1.03]
+    system.theta[:] = [0.0, 0.05, -0.12, -0.08, -0.02]
+
+    errors = compare(system, 'numba')
+    if max(errors) > tol:
+        warnings.warn('The numba kernel does not match the numpy kernel '
+                      f'(relative error {max(errors):.3g}); using numpy')
+        return False
+
+    return True
+
+def compare(system, backend='numba'):
+    '''
+    Comparar F y los valores de J de un núcleo con los del de NumPy en el
+    estado actual de system. backend es 'numba' o 'loops' (los lazos de
+    _fused_loops sin compilar, lo que compila Numba). Devuelve las mayores
+    diferencias de F y de J, relativas a su mayor valor absoluto.
+    '''
+
+    system.build_Y()
+    Y = system.Y
+    ws = workspace(Y, system.build_J_structure())
+    args = (Y, system.V, system.theta, -system.PL - 1j*system.QL,
+            system.pqpv, system.pq)
+    F_ref, J_ref = _fused_numpy(ws, *args)
+    J_ref = J_ref.copy()
+    if backend == 'loops':
+        F, J = _run_loops(_fused_loops, ws, *args)
+    else:
+        F, J = mismatch_jacobian(ws, *args, backend=backend)
+
+    def error(value, reference):
+        scale = max(np.max(np.abs(reference), initial=0), 1.0)
+        return float(np.max(np.abs(value - reference), initial=0)/scale)
+
+    return error(F, F_ref), error(J, J_ref)
+
+def workspace(Y, structure):
+    '''
+    Preparar los índices y los arreglos de trabajo de los núcleos para el
+    patrón de Y y una estructura de J (ver System.build_J_structure). Se
+    calculan una vez y se reutilizan en todas las iteraciones.
+    '''
+
+    nnz = len(Y.data)
+    rows = np.repeat(np.arange(Y.shape[0]), np.diff(Y.indptr))
+    part = structure['part']
+    source = structure['source']
+
+    return {'Y_nnz': nnz,
+            'rows': rows,
+            'diagonal': np.flatnonzero(rows == Y.indices),
+            'part': part,
+            'source': source,
+            # Posición de cada valor de J en la vista real de [dS/dVa,
+            # dS/dVm] (parte 0 = Re dVa, 1 = Re dVm, 2 = Im dVa, 3 = Im dVm)
+            'flat': (part % 2)*2*nnz + 2*source + part//2,
+            'J': np.empty(len(part)),
+            'buffers': None}
+
+def mismatch_jacobian(ws, Y, Vm, Va, S_injected, pqpv, pq, backend=None):
+    '''
+    Calcular en una pasada el vector de diferencias de potencia F (ángulos
+    de pqpv y magnitudes de pq, como System.build_F) y los valores de J en
+    el orden de su estructura, escritos en ws['J'] (que se sobrescribe en
+    cada llamada). Devuelve F y ws['J'].
+
+    Vm y Va pueden ser matrices con un escenario por fila (solo con el
+    núcleo de NumPy); entonces F y los valores de J tienen una fila por
+    escenario y los valores se guardan en un arreglo de trabajo de esa
+    forma, que se conserva mientras no cambie el número de escenarios.
+    '''
+
+    backend = backend or default_backend()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown kernel backend '{backend}'")
+    if backend == 'numba' and numba is None:
+        raise ImportError('The numba backend requires Numba')
+
+    if backend == 'numba' and np.ndim(Vm) == 1:
+        return _run_loops(_fused_jit, ws, Y, Vm, Va, S_injected, pqpv, pq)
+
+    return _fused_numpy(ws, Y, Vm, Va, S_injected, pqpv, pq)
+
+def _run_loops(func, ws, Y, Vm, Va, S_injected, pqpv, pq):
+    '''
+    Llamar a un núcleo con la firma de _fused_loops.
+    '''
+
+    F = np.empty(len(pqpv) + len(pq))
+    func(Y.data, Y.indptr, Y.indices, ws['rows'], Vm, Va, S_injected, pqpv,
+         pq, ws['part'], ws['source'], F, ws['J'])
+
+    return F, ws['J']
+
+def _fused_numpy(ws, Y, Vm, Va, S_injected, pqpv, pq):
+    '''
+    Núcleo de NumPy: las derivadas sobre las entradas de Y se escriben en
+    arreglos de trabajo (sin matrices diagonales ni temporales del tamaño
+    de Y) y los valores de J se obtienen con una sola indexación.
+    '''
+
+    shape = np.shape(Vm)[:-1]
+    nnz = ws['Y_nnz']
+    buffers = ws['buffers']
+    if buffers is None or buffers['shape'] != shape:
+        buffers = {'shape': shape,
+                   'dS': np.empty(shape + (2, nnz), dtype=complex),
+                   'V_rows': np.empty(shape + (nnz,), dtype=complex),
+                   'Y_V': np.empty(shape + (nnz,), dtype=complex),
+                   'abs_cols': np.empty(shape + (nnz,)),
+                   'J': ws['J'] if shape == () else
+                        np.empty(shape + ws['J'].shape)}
+        ws['buffers'] = buffers
+
+    rows = ws['rows']
+    cols = Y.indices
+    diagonal = ws['diagonal']
+    d = rows[diagonal]
+
+    V = Vm*np.exp(1j*Va)
+    I = Y @ V if V.ndim == 1 else (Y @ V.T).T
+    S = V*np.conj(I) - S_injected
+    F = np.concatenate([S[..., pqpv].real, S[..., pq].imag], axis=-1)
+
+    # conj(Y*V[cols]) y V[rows]
+    Y_V = buffers['Y_V']
+    V_rows = buffers['V_rows']
+    np.take(V, cols, axis=-1, out=Y_V)
+    np.multiply(Y.data, Y_V, out=Y_V)
+    np.conjugate(Y_V, out=Y_V)
+    np.take(V, rows, axis=-1, out=V_rows)
+
+    # dS_dVa = j diag(V) conj(diag(Ibus) - Y diag(V))
+    dS = buffers['dS']
+    dVa = dS[..., 0, :]
+    dVm = dS[..., 1, :]
+    np.multiply(V_rows, Y_V, out=dVa)
+    dVa *= -1j
+    dVa[..., diagonal] += 1j*V[..., d]*np.conj(I[..., d])
+
+    # dS_dVm = diag(V) conj(Y diag(Vnorm)) + conj(diag(Ibus)) diag(Vnorm)
+    # (las barras desenergizadas, con V = 0, no son incógnitas: sus
+    # entradas quedan indefinidas pero no pasan a J)
+    abs_V = np.abs(V)
+    np.multiply(V_rows, Y_V, out=dVm)
+    np.take(abs_V, cols, axis=-1, out=buffers['abs_cols'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dVm /= buffers['abs_cols']
+        dVm[..., diagonal] += np.conj(I[..., d])*V[..., d]/abs_V[..., d]
+
+    # Valores de J
+    values = dS.view(float).reshape(shape + (4*nnz,))
+    J = buffers['J']
+    np.take(values, ws['flat'], axis=-1, out=J)
+
+    return F, J
+
+def _fused_loops(Y_data, Y_indptr, Y_indices, rows, Vm, Va, S_injected,
+                 pqpv, pq, part, source, F, J):
+    '''
+    Núcleo con lazos explícitos (se compila con Numba): una pasada por las
+    entradas de Y para las corrientes, otra por las barras para F y otra
+    por las entradas de J, sin arreglos intermedios del tamaño de Y.
+    '''
+
+    N = len(Vm)
+    V = np.empty(N, dtype=np.complex128)
+    I = np.zeros(N, dtype=np.complex128)
+    for i in range(N):
+        V[i] = Vm[i]*np.exp(1j*Va[i])
+    for i in range(N):
+        for k in range(Y_indptr[i], Y_indptr[i + 1]):
+            I[i] += Y_data[k]*V[Y_indices[k]]
+
+    # Diferencias de potencia
+    n = len(pqpv)
+    for i in range(n):
+        b = pqpv[i]
+        F[i] = (V[b]*np.conj(I[b]) - S_injected[b]).real
+    for i in range(len(pq)):
+        b = pq[i]
+        F[n + i] = (V[b]*np.conj(I[b]) - S_injected[b]).imag
+
+    # Valores de J: parte 0 = Re dVa, 1 = Re dVm, 2 = Im dVa, 3 = Im dVm
+    for j in range(len(part)):
+        k = source[j]
+        r = rows[k]
+        c = Y_indices[k]
+        Y_V = np.conj(Y_data[k]*V[c])
+        if part[j] % 2 == 0:
+            value = -1j*V[r]*Y_V
+            if r == c:
+                value += 1j*V[r]*np.conj(I[r])
+        else:
+            value = V[r]*Y_V/abs(Vm[c])
+            if r == c:
+                value += np.conj(I[r])*V[r]/abs(Vm[r])
+        J[j] = value.real if part[j] < 2 else value.imag
+
+_fused_jit = numba.njit(cache=True)(_fused_loops) if numba is not None \
+             else None
@@ -1,26 +1,101 @@
+import contextlib
+import functools
 import numpy as np
 import scipy
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.sparse.linalg
 import tabulate
+import time
 import warnings
 
+import kernels
+
+# Tipos de barra; en System.bus_type se guarda el índice en esta tupla
+BUS_TYPES = ('Slack', 'PQ', 'PV')
+SLACK, PQ, PV = range(3)
+
+class _ArrayField:
+    '''
+    Atributo de una vista que lee y escribe el elemento 'index' de uno de los
+    arreglos del sistema.
+    '''
+
+    def __init__(self, array, cast=float):
+
+        self.array = array
+        self.cast = cast
+
+    def __get__(self, view, owner=None):
+
+        if view is None:
+            return self
+
+        return self.cast(getattr(view.system, self.array)[view.index])
+
+    def __set__(self, view, value):
+
+        getattr(view.system, self.array)[view.index] = value
+
+class _VoltageField(_ArrayField):
+    '''
+    Tensión de una barra: en las barras PV es también su consigna, de modo
+    que escribirla actualiza Vset (run_pf parte de Vset en esas barras).
+    '''
+
+    def __set__(self, view, value):
+
+        super().__set__(view, value)
+        if view.system.bus_type[view.index] == PV:
+            view.system.Vset[view.index] = value
+
 class Bus:
     '''
     Clase para representar una barra de la red eléctrica.
-    '''
 
-    def __init__(self, V, theta, PL, QL, G, B, Vb, bus_type, name):
+    Es una vista liviana: los datos viven en los arreglos de System (V,
+    theta, PL, ...) y la barra solo guarda su índice en ellos.
+    '''
 
-        self.V = V
-        self.theta = theta
-        self.PL = PL
-        self.QL = QL
-        self.G = G
-        self.B = B
-        self.Vb = Vb
-        self.bus_type = bus_type
-        self.name = name
-        self.P_to_network = np.nan
-        self.Q_to_network = np.nan
+    __slots__ = ('system', 'index')
+
+    V = _VoltageField('V')
+    theta = _ArrayField('theta')
+    PL = _ArrayField('PL')
+    QL = _ArrayField('QL')
+    G = _ArrayField('G')
+    B = _ArrayField('B')
+    Vb = _ArrayField('Vb')
+    Vset = _ArrayField('Vset')
+    Qmin = _ArrayField('Qmin')
+    Qmax = _ArrayField('Qmax')
+    P_to_network = _ArrayField('P_to_network')
+    Q_to_network = _ArrayField('Q_to_network')
+
+    def __init__(self, system, index):
+
+        self.system = system
+        self.index = index
+
+    @property
+    def bus_type(self):
+        return BUS_TYPES[self.system.bus_type[self.index]]
+
+    @bus_type.setter
+    def bus_type(self, bus_type):
+        system = self.system
+        system.bus_type[self.index] = BUS_TYPES.index(bus_type)
+        if bus_type == 'PV' and np.isnan(system.Vset[self.index]):
+            system.Vset[self.index] = system.V[self.index]
+        system.store_bus(self)
+
+    @property
+    def name(self):
+        return self.system.bus_names[self.index]
+
+    @name.setter
+    def name(self, name):
+        self.system.bus_names[self.index] = name
 
     def __str__(self):
         return f'{self.name}'
@@ -32,44 +107,63 @@ class Bus:
 
         return self.V*np.exp(1j*self.theta)
 
-class Line:
+class Branch:
     '''
-    Clase para representar una línea de la red eléctrica.
+    Vista liviana de una rama (línea o transformador) de System.
     '''
 
-    def __init__(self, from_bus, to_bus, X, R, from_Y, to_Y, in_operation):
+    __slots__ = ('system', 'index')
+
+    R = _ArrayField('branch_R')
+    X = _ArrayField('branch_X')
+    in_operation = _ArrayField('branch_in_operation', bool)
+
+    def __init__(self, system, index):
+
+        self.system = system
+        self.index = index
 
-        self.from_bus = from_bus
-        self.to_bus = to_bus
-        self.X = X
-        self.R = R
-        self.from_Y = from_Y
-        self.to_Y = to_Y
-        self.in_operation = in_operation
+    @property
+    def from_bus(self):
+        return self.system.get_bus(self.system.branch_from[self.index])
+
+    @property
+    def to_bus(self):
+        return self.system.get_bus(self.system.branch_to[self.index])
 
     def __str__(self):
         return f'{self.from_bus} -> {self.to_bus}'
 
-class Transformer:
+class Line(Branch):
     '''
-    Clase para representar transformador con cambiador de tomas.
+    Clase para representar una línea de la red eléctrica.
     '''
 
-    def __init__(self, from_bus, to_bus, R, X, n, MVA, Sbase):
-        '''
-        R y X están en pu de base propia, n está en pu.
+    __slots__ = ()
 
-        Se suponen la siguiente convención:
+    from_Y = _ArrayField('branch_from_Y', complex)
+    to_Y = _ArrayField('branch_to_Y', complex)
 
-        from   n:1   R+jX      to
-        |------0 0---xxxx------|
-        '''
+class Transformer(Branch):
+    '''
+    Clase para representar transformador con cambiador de tomas.
+
+    R y X están en pu de la base del sistema, n está en pu. Se supone la
+    siguiente convención:
+
+    from   n:1   R+jX      to
+    |------0 0---xxxx------|
+    '''
 
-        self.from_bus = from_bus
-        self.to_bus = to_bus
-        self.R = R * Sbase / MVA
-        self.X = X * Sbase / MVA
-        self.n = n
+    __slots__ = ()
+
+    n = _ArrayField('branch_n')
+    MVA = _ArrayField('branch_MVA')
+    tap_bus = _ArrayField('branch_tap_bus', int)
+    tap_Vset = _ArrayField('branch_tap_Vset')
+    tap_min = _ArrayField('branch_tap_min')
+    tap_max = _ArrayField('branch_tap_max')
+    tap_step = _ArrayField('branch_tap_step')
 
     def get_pi_model(self):
         '''
@@ -83,88 +177,903 @@ class Transformer:
 
         return Y_series, from_Y, to_Y
 
+class BatchResults:
+    '''
+    Resultados de System.run_pf_batch: tensiones, ángulos, convergencia e
+    iteraciones de cada escenario (una fila por escenario).
+    '''
+
+    def __init__(self, V, theta, converged, iterations):
+
+        self.V = V
+        self.theta = theta
+        self.converged = converged
+        self.iterations = iterations
+
+    def __len__(self):
+        return len(self.converged)
+
+    def get_phasor_V(self):
+        '''
+        Devolver las tensiones de todos los escenarios en forma fasorial.
+        '''
+
+        return self.V*np.exp(1j*self.theta)
+
+class BranchResults:
+    '''
+    Flujos de las ramas de System.branch_results: potencias complejas que
+    entran a cada rama desde sus barras 'from' y 'to' (Sf, St), corrientes
+    (If, It), pérdidas (Sf + St), todo en pu, y cargabilidad (%) respecto de
+    la capacidad en MVA (nan si no está definida). Cada arreglo tiene una
+    columna por rama y, si se calcularon varios escenarios, una fila por
+    escenario.
+    '''
+
+    def __init__(self, system, Sf, St, If, It):
+
+        self.system = system
+        self.Sf = Sf
+        self.St = St
+        self.If = If
+        self.It = It
+        self.losses = Sf + St
+        self.loading = 100*system.Sb*np.maximum(np.abs(Sf), np.abs(St)) \
+                       / system.branch_MVA
+
+    def __len__(self):
+        return self.Sf.shape[-1]
+
+    def total_losses(self):
+        '''
+        Devolver las pérdidas totales (pu) de cada escenario.
+        '''
+
+        return np.sum(self.losses, axis=-1)
+
+    def overloaded(self, limit=100):
+        '''
+        Devolver una máscara de las ramas en servicio con cargabilidad
+        mayor que limit (%), con la misma forma que loading.
+        '''
+
+        with np.errstate(invalid='ignore'):
+            return (self.loading > limit) & self.system.branch_in_operation
+
+    def __str__(self):
+
+        system = self.system
+        if self.Sf.ndim > 1:
+            # Varios escenarios: un resumen por escenario
+            loading = np.where(np.isnan(self.loading), -np.inf, self.loading)
+            losses = system.Sb*self.total_losses()
+            data = list(zip(range(len(self.Sf)), losses.real, losses.imag,
+                            np.max(loading, axis=1),
+                            np.sum(self.overloaded(), axis=1)))
+            headers = ['Scenario', 'Losses\n(MW)', 'Losses\n(Mvar)',
+                       'Max.\nloading (%)', 'Overloaded\nbranches']
+            precision = (0, '.3f', '.3f', '.1f', 0)
+            return tabulate.tabulate(data, headers=headers,
+                                     floatfmt=precision)
+
+        names = np.array(system.bus_names, dtype=object)
+        kind = np.where(system.branch_is_transformer, 'Transformer', 'Line')
+        Sb = system.Sb
+        data = list(zip(np.arange(1, len(self) + 1),
+                        names[system.branch_from], names[system.branch_to],
+                        kind, system.branch_in_operation,
+                        Sb*self.Sf.real, Sb*self.Sf.imag,
+                        Sb*self.St.real, Sb*self.St.imag,
+                        Sb*self.losses.real, Sb*self.losses.imag,
+                        self.loading))
+        headers = ['\nBranch', '\nFrom', '\nTo', '\nType', 'In\noperation',
+                   'P from\n(MW)', 'Q from\n(Mvar)', 'P to\n(MW)',
+                   'Q to\n(Mvar)', 'Losses\n(MW)', 'Losses\n(Mvar)',
+                   '\nLoading (%)']
+        precision = (0, 0, 0, 0, 0, '.3f', '.3f', '.3f', '.3f', '.3f', '.3f',
+                     '.1f')
+
+        return tabulate.tabulate(data, headers=headers, floatfmt=precision)
+
+class SolverStats:
+    '''
+    Telemetría de los flujos de potencia de un sistema (System.stats).
+
+    log tiene un registro por iteración de la última corrida: la diferencia
+    de potencia máxima y su norma 2, la barra y la ecuación ('P' o 'Q') con
+    la mayor diferencia, y el tiempo (s) gastado desde el registro anterior
+    en construir Y, F y J y en resolver el sistema lineal. totals acumula
+    contadores y tiempos de todas las corridas (simples, por lotes o de
+    contingencias) hasta llamar a reset.
+    '''
+
+    phases = ('Y', 'F', 'J', 'solve')
+    counters = ('runs', 'scenarios', 'converged', 'iterations')
+
+    def __init__(self):
+
+        self.log = []
+        self.callback = None
+        self._times = dict.fromkeys(self.phases, 0.0)
+        self._start = None
+        self.reset()
+
+    def __getstate__(self):
+        '''
+        No serializar la función de retorno (puede ser una lambda).
+        '''
+
+        state = self.__dict__.copy()
+        state['callback'] = None
+        return state
+
+    def reset(self):
+        '''
+        Poner en cero los contadores acumulados.
+        '''
+
+        self.totals = dict.fromkeys(self.counters, 0)
+        self.totals.update({'time_' + phase: 0.0
+                            for phase in self.phases + ('total',)})
+
+    def merge(self, totals):
+        '''
+        Sumar los contadores de otro SolverStats (o de su diccionario
+        totals), por ejemplo los de un proceso de trabajo.
+        '''
+
+        totals = getattr(totals, 'totals', totals)
+        for key, value in totals.items():
+            self.totals[key] = self.totals.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        '''
+        Medir el tiempo de un bloque y sumarlo a la etapa phase.
+        '''
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._times[phase] += elapsed
+            self.totals['time_' + phase] += elapsed
+
+    def start(self, callback=None):
+        '''
+        Comenzar una corrida: vaciar log y guardar la función de retorno.
+        '''
+
+        self.log = []
+        self.callback = callback
+        self._times = dict.fromkeys(self.phases, 0.0)
+        self._start = time.perf_counter()
+
+    def iteration(self, system, iteration, F, first, second, labels='PQ',
+                  **extra):
+        '''
+        Registrar una iteración a partir del vector de diferencias F, cuyas
+        ecuaciones corresponden a las barras first (las de tipo labels[0])
+        y luego second (tipo labels[1]). Si hay función de retorno, se llama
+        con el registro.
+        '''
+
+        record = {'iteration': iteration,
+                  'max_mismatch': 0.0,
+                  'norm': float(np.linalg.norm(F)),
+                  'bus': None,
+                  'equation': None}
+        if len(F):
+            k = int(np.argmax(np.abs(F)))
+            n = len(first)
+            bus = first[k] if k < n else second[k - n]
+            record.update(max_mismatch=float(abs(F[k])),
+                          bus=system.bus_names[bus],
+                          equation=labels[0] if k < n else labels[1])
+        record.update({'time_' + phase: elapsed
+                       for phase, elapsed in self._times.items()})
+        record.update(extra)
+        self._times = dict.fromkeys(self.phases, 0.0)
+
+        self.log.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def finish(self, converged, iterations, scenarios=1):
+        '''
+        Terminar una corrida y sumar sus resultados a los contadores.
+        '''
+
+        self.totals['runs'] += 1
+        self.totals['scenarios'] += scenarios
+        self.totals['converged'] += int(np.sum(converged))
+        self.totals['iterations'] += int(np.sum(iterations))
+        if self._start is not None:
+            self.totals['time_total'] += time.perf_counter() - self._start
+        self._start = None
+        self.callback = None
+
+    def __str__(self):
+
+        headers = ['Iteration', 'Max. |F|\n(pu)', '||F||\n(pu)', 'Bus',
+                   'Equation', 'Y\n(ms)', 'F\n(ms)', 'J\n(ms)',
+                   'Solve\n(ms)']
+        data = [[row['iteration'], row['max_mismatch'], row['norm'],
+                 row['bus'], row['equation']]
+                + [1e3*row['time_' + phase] for phase in self.phases]
+                for row in self.log]
+        precision = (0, '.3e', '.3e', 0, 0, '.3f', '.3f', '.3f', '.3f')
+        table = tabulate.tabulate(data, headers=headers, floatfmt=precision)
+
+        totals = ', '.join(f'{key}: {value:.4g}' if isinstance(value, float)
+                           else f'{key}: {value}'
+                           for key, value in self.totals.items())
+
+        return table + '\n\nTotals: ' + totals
+
+class KrylovSolver:
+    '''
+    Solucionador iterativo del paso de Newton (J*dx = F) con GMRES o
+    BiCGSTAB, precondicionado con una factorización LU incompleta (ILU) de
+    J. Es mucho más liviano en memoria que la LU completa en redes muy
+    grandes.
+
+    El precondicionador se reutiliza en las iteraciones siguientes y en
+    las corridas posteriores (escenarios de un barrido, contingencias)
+    mientras el método converja en pocas iteraciones: solo se vuelve a
+    factorizar si cambia J (forma o número de elementos), si hicieron
+    falta más de refresh_iters iteraciones o si el método no convergió.
+    La tolerancia relativa de cada paso sigue el criterio de Eisenstat y
+    Walker (Newton inexacto): holgada (eta_max) lejos de la solución y
+    cada vez más estricta cerca de ella. Si aun con un precondicionador
+    nuevo el método no converge, el paso se resuelve con LU dispersa.
+
+    System.run_pf acepta como solver cualquier objeto invocable
+    solver(J, F) -> dx; si además tiene un método reset, se llama al
+    comenzar cada corrida.
+    '''
+
+    methods = ('gmres', 'bicgstab')
+
+    def __init__(self, method='gmres', drop_tol=1e-4, fill_factor=10,
+                 refresh_iters=30, eta_max=0.1, restart=50, maxiter=500):
+
+        if method not in self.methods:
+            raise ValueError(f"Unknown Krylov method '{method}'")
+        self.method = method
+        self.drop_tol = drop_tol
+        self.fill_factor = fill_factor
+        self.refresh_iters = refresh_iters
+        self.eta_max = eta_max
+        self.restart = restart
+        self.maxiter = maxiter
+        self.ilu = None
+        self.previous = None
+        self.eta = eta_max
+
+        # Contadores
+        self.factorizations = 0
+        self.krylov_iterations = 0
+        self.fallbacks = 0
+
+    def reset(self):
+        '''
+        Comenzar una nueva corrida de Newton (el precondicionador se
+        conserva).
+        '''
+
+        self.previous = None
+
+    def tolerance(self, norm):
+        '''
+        Devolver la tolerancia relativa del paso para un ||F|| dado.
+        '''
+
+        if not self.previous:
+            eta = self.eta_max
+        else:
+            eta = 0.9*(norm/self.previous)**2
+            # Salvaguarda: no ajustar de golpe mientras eta sea grande
+            if 0.9*self.eta**2 > 0.1:
+                eta = max(eta, 0.9*self.eta**2)
+            eta = min(eta, self.eta_max)
+        self.eta = max(eta, 1e-14)
+        self.previous = norm
+
+        return self.eta
+
+    def factorize(self, J, ordered=False):
+        '''
+        Calcular el precondicionador ILU de J. Con ordered=True, J ya está
+        permutada con un orden que reduce el llenado (ver
+        System.permuted_J) y se factoriza en ese orden.
+        '''
+
+        options = {}
+        if ordered:
+            options = dict(permc_spec='NATURAL', diag_pivot_thresh=0.1,
+                           options={'SymmetricMode': True})
+        self.ilu = scipy.sparse.linalg.spilu(J.tocsc(), drop_tol=self.drop_tol,
+                                             fill_factor=self.fill_factor,
+                                             **options)
+        self.preconditioner = scipy.sparse.linalg.LinearOperator(
+            J.shape, self.ilu.solve)
+        self.pattern = (J.shape, J.nnz, ordered)
+        self.factorizations += 1
+
+    def krylov(self, J, F, rtol):
+        '''
+        Resolver J*dx = F con el método de Krylov. Devuelve dx, si convergió
+        y el número de iteraciones.
+        '''
+
+        iterations = 0
+
+        def count(_):
+            nonlocal iterations
+            iterations += 1
+
+        if self.method == 'gmres':
+            dx, info = scipy.sparse.linalg.gmres(
+                J, F, rtol=rtol, atol=0.0, restart=self.restart,
+                maxiter=max(1, self.maxiter//self.restart),
+                M=self.preconditioner, callback=count,
+                callback_type='pr_norm')
+        else:
+            dx, info = scipy.sparse.linalg.bicgstab(
+                J, F, rtol=rtol, atol=0.0, maxiter=self.maxiter,
+                M=self.preconditioner, callback=count)
+        self.krylov_iterations += iterations
+
+        return dx, info == 0 and np.all(np.isfinite(dx)), iterations
+
+    def __call__(self, J, F, ordered=False):
+
+        rtol = self.tolerance(np.linalg.norm(F))
+        fresh = self.ilu is None \
+            or self.pattern != (J.shape, J.nnz, ordered)
+        if fresh:
+            self.factorize(J, ordered)
+
+        dx, converged, iterations = self.krylov(J, F, rtol)
+        if not fresh and (not converged or iterations > self.refresh_iters):
+            # Precondicionador desactualizado
+            self.factorize(J, ordered)
+            if not converged:
+                dx, converged, _ = self.krylov(J, F, rtol)
+        if not converged:
+            self.fallbacks += 1
+            dx = scipy.sparse.linalg.splu(J.tocsc()).solve(F)
+
+        return dx
+
+class StepControl:
+    '''
+    Control del largo del paso de Newton-Raphson y detección temprana de
+    divergencia.
+
+    Cada paso es x - mu*dx, con mu según method:
+
+    - 'full': paso completo (mu = 1).
+    - 'iwamoto': multiplicador óptimo de Iwamoto. F(x - mu*dx) se aproxima
+      por (1 - mu)*F(x) + mu**2*F(x - dx) y mu minimiza su norma (raíz de
+      un polinomio cúbico), con una evaluación adicional de F por paso.
+    - 'backtracking': se parte de mu = 1 y se divide por dos hasta que la
+      norma de F baje lo suficiente (condición de Armijo).
+
+    Tras cada iteración se clasifica la corrida como fallida en cuanto:
+
+    - F deja de ser finita o su norma crece en dos iteraciones seguidas
+      ('diverged');
+    - mu baja de min_step, lo que indica que no hay solución cerca, por
+      ejemplo más allá de la nariz de la curva PV ('stalled');
+    - la norma no mejora su mínimo en window iteraciones ('oscillating').
+
+    La jacobiana singular ('singular Jacobian') y el agotamiento de las
+    iteraciones ('max iterations') completan la clasificación; la falla
+    queda en System.failure.
+    '''
+
+    methods = ('full', 'iwamoto', 'backtracking')
+    failures = ('diverged', 'stalled', 'oscillating', 'singular Jacobian',
+                'max iterations')
+
+    def __init__(self, method='iwamoto', min_step=0.05, max_step=1.0,
+                 window=4, armijo=1e-4):
+
+        if method not in self.methods:
+            raise ValueError(f"Unknown step control method '{method}'")
+        self.method = method
+        self.min_step = min_step
+        self.max_step = max_step
+        self.window = window
+        self.armijo = armijo
+        self.reset()
+
+    def reset(self):
+        '''
+        Comenzar una nueva corrida.
+        '''
+
+        self.norms = []
+        self.steps = []
+
+    def optimal_multiplier(self, F, F_full):
+        '''
+        Devolver el multiplicador de Iwamoto a partir de F en el estado
+        actual y en el paso completo.
+        '''
+
+        ff = np.dot(F, F)
+        fh = np.dot(F, F_full)
+        hh = np.dot(F_full, F_full)
+        roots = np.roots([2*hh, -3*fh, ff + 2*fh, -ff])
+        roots = roots.real[(np.abs(roots.imag) < 1e-10) & (roots.real > 0)]
+        if len(roots) == 0:
+            return self.max_step
+        g = [np.linalg.norm((1 - mu)*F + mu**2*F_full) for mu in roots]
+
+        return float(min(roots[int(np.argmin(g))], self.max_step))
+
+    def step(self, F, evaluate):
+        '''
+        Elegir el largo del paso. evaluate(mu) devuelve F en el estado
+        x - mu*dx (el sistema puede quedar en cualquiera de los estados
+        evaluados). Devuelve mu.
+        '''
+
+        mu = 1.0
+        if self.method == 'iwamoto':
+            mu = self.optimal_multiplier(F, evaluate(1.0))
+        elif self.method == 'backtracking':
+            norm = np.linalg.norm(F)
+            while np.linalg.norm(evaluate(mu)) > (1 - self.armijo*mu)*norm \
+                    and mu >= self.min_step:
+                mu /= 2
+        self.steps.append(mu)
+
+        return mu
+
+    def check(self, F):
+        '''
+        Registrar F tras una iteración y devolver la falla detectada (ver
+        failures) o None.
+        '''
+
+        norm = float(np.linalg.norm(F))
+        self.norms.append(norm)
+        norms = self.norms
+        if not np.isfinite(norm):
+            return 'diverged'
+        if len(norms) >= 3 and norms[-1] > norms[-2] > norms[-3]:
+            return 'diverged'
+        if self.steps and self.steps[-1] < self.min_step:
+            return 'stalled'
+        if len(norms) > self.window \
+                and min(norms[-self.window:]) >= min(norms[:-self.window]):
+            return 'oscillating'
+
+        return None
+
 class System:
     '''
     Clase para representar una red eléctrica.
+
+    Los datos de barras y ramas se guardan en arreglos contiguos de NumPy
+    (uno por atributo, en orden de inserción); Bus, Line y Transformer son
+    vistas sobre ellos. Los arreglos se deben modificar en sitio, por
+    ejemplo sys.PL[i] *= 2 o sys.PL[:] = PL_nuevo.
+
+    La consigna de tensión de las barras PV está solo en Vset: cada
+    corrida parte de V = Vset en ellas (ver set_PV_voltages), y asignar
+    bus.V en una barra PV cambia su consigna.
     '''
 
+    # Arreglos de barras y de ramas: nombre -> (tipo, valor por defecto)
+    bus_fields = {'V': (float, 1.0),
+                  'theta': (float, 0.0),
+                  'PL': (float, 0.0),
+                  'QL': (float, 0.0),
+                  'G': (float, 0.0),
+                  'B': (float, 0.0),
+                  'Vb': (float, np.nan),
+                  'Vset': (float, np.nan),
+                  'Qmin': (float, -np.inf),
+                  'Qmax': (float, np.inf),
+                  'P_to_network': (float, np.nan),
+                  'Q_to_network': (float, np.nan),
+                  'bus_type': (np.int8, PQ)}
+
+    branch_fields = {'branch_from': (np.intp, -1),
+                     'branch_to': (np.intp, -1),
+                     'branch_R': (float, 0.0),
+                     'branch_X': (float, 0.0),
+                     'branch_from_Y': (complex, 0.0),
+                     'branch_to_Y': (complex, 0.0),
+                     'branch_n': (float, 1.0),
+                     'branch_MVA': (float, np.nan),
+                     'branch_in_operation': (bool, True),
+                     'branch_is_transformer': (bool, False),
+                     'branch_tap_bus': (np.intp, -1),
+                     'branch_tap_Vset': (float, np.nan),
+                     'branch_tap_min': (float, 0.9),
+                     'branch_tap_max': (float, 1.1),
+                     'branch_tap_step': (float, 0.0)}
+
     def __init__(self, Sb=100, name=''):
 
-        self.slack = None
-        self.buses = []
-        self.non_slack_buses = []
-        self.PQ_buses = []
-        self.PV_buses = []
-        self.lines = []
-        self.transformers = []
+        self.n_buses = 0
+        self.n_branches = 0
+        self.bus_names = []
+        self._buffers = {}
+        for field, (dtype, _) in {**self.bus_fields,
+                                  **self.branch_fields}.items():
+            self._buffers[field] = np.empty(0, dtype=dtype)
+            setattr(self, field, self._buffers[field])
+        self._bus_views = []
+        self._branch_views = []
+        self._organized = None
+        self._cache = {}
         self.Sb = Sb
         self.name = name
         self.status = 'unsolved'
+        self.failure = None
+        self.iterations = 0
+        self.Q_limited = np.empty(0, dtype=int)
+        self.islands = np.empty(0, dtype=int)
+        self.de_energized = np.empty(0, dtype=int)
+        self.taps_settled = None
+        self.stats = SolverStats()
+
+    def __getstate__(self):
+        '''
+        Excluir los cachés (matrices base, factorizaciones) al serializar.
+        '''
+
+        state = self.__dict__.copy()
+        state['_cache'] = {}
+
+        return state
+
+    def _append(self, fields, size_attr, count, **values):
+        '''
+        Agregar 'count' elementos al final de los arreglos 'fields'.
+
+        Los arreglos reservan capacidad por duplicación, de modo que agregar
+        elementos uno a uno cuesta O(1) amortizado. Devuelve los índices de
+        los nuevos elementos.
+        '''
+
+        n0 = getattr(self, size_attr)
+        n1 = n0 + count
+
+        for field, (dtype, default) in fields.items():
+            buffer = self._buffers[field]
+            current = getattr(self, field)
+            # Recuperar arreglos reemplazados (no modificados en sitio)
+            if current.base is not buffer:
+                buffer[:n0] = current
+            if n1 > len(buffer):
+                new_buffer = np.empty(max(2*len(buffer), n1, 8), dtype=dtype)
+                new_buffer[:n0] = buffer[:n0]
+                buffer = self._buffers[field] = new_buffer
+            buffer[n0:n1] = values.get(field, default)
+            setattr(self, field, buffer[:n1])
+
+        setattr(self, size_attr, n1)
+
+        return np.arange(n0, n1)
+
+    def get_bus(self, i):
+        '''
+        Devolver la vista de la barra con índice i.
+        '''
+
+        view = self._bus_views[i]
+        if view is None:
+            view = self._bus_views[i] = Bus(self, i)
+
+        return view
+
+    def get_branch(self, k):
+        '''
+        Devolver la vista (Line o Transformer) de la rama con índice k.
+        '''
+
+        view = self._branch_views[k]
+        if view is None:
+            kind = Transformer if self.branch_is_transformer[k] else Line
+            view = self._branch_views[k] = kind(self, k)
+
+        return view
 
     def organize_buses(self):
         '''
         Organizar las barras en este orden: slack, PQ, PV.
+
+        Calcula los índices self.ref, self.pq, self.pv y self.pqpv (barras no
+        oscilantes: primero las PQ y luego las PV), que son los que usa el
+        solucionador. Las listas de vistas (self.buses, self.PQ_buses, ...)
+        solo se construyen cuando se piden. Se vuelve a llamar sola cuando
+        cambia self.bus_type, también al escribir el arreglo directamente.
         '''
 
-        # Ordenar barras que no son la oscilante
-        self.non_slack_buses = self.PQ_buses + self.PV_buses
+        ref = np.flatnonzero(self.bus_type == SLACK)
+        pq = np.flatnonzero(self.bus_type == PQ)
+        pv = np.flatnonzero(self.bus_type == PV)
+        self._organized = {'ref': ref, 'pq': pq, 'pv': pv,
+                           'pqpv': np.concatenate([pq, pv]),
+                           'bus_type': self.bus_type.copy()}
 
-        # Colocar barra oscilante al principio
-        if self.slack != None:
-            self.buses = [self.slack] + self.non_slack_buses
-        else:
-            self.buses = self.non_slack_buses
+    def find_islands(self):
+        '''
+        Encontrar las islas eléctricas: componentes conexas del grafo de las
+        barras con las ramas en servicio. Devuelve el número de islas y la
+        isla de cada barra. El resultado se guarda en caché según la
+        topología y las ramas en servicio.
+        '''
 
-    def store_bus(self, bus):
+        on = self.branch_in_operation
+        key = (self.n_buses, hash(b''.join(a.tobytes() for a in (
+            self.branch_from, self.branch_to, on))))
+        cached = self._cache.get('islands')
+        if cached is not None and cached[0] == key:
+            n_islands, labels = cached[1]
+            return n_islands, labels.copy()
+
+        graph = scipy.sparse.coo_matrix(
+            (np.ones(np.count_nonzero(on)),
+             (self.branch_from[on], self.branch_to[on])),
+            shape=(self.n_buses, self.n_buses))
+        n_islands, labels = scipy.sparse.csgraph.connected_components(
+            graph, directed=False)
+        self._cache['islands'] = (key, (n_islands, labels))
+
+        return n_islands, labels.copy()
+
+    def organize_islands(self, labels):
         '''
-        Almacenar barra en las listas correspondientes y organizarlas.
+        Organizar las barras para resolver por separado cada isla de labels
+        (ver find_islands).
+
+        En cada isla con generadores pero sin barra oscilante, la barra PV
+        de mayor generación pasa a ser su referencia (tensión en Vset); las
+        barras de las islas sin generadores quedan desenergizadas (V = 0) y
+        fuera de las incógnitas (ver seed_de_energized). Los tipos de barra
+        no cambian: solo la organización (self.ref, self.pq, ...), que se
+        restablece con organize_buses. Devuelve las nuevas referencias y
+        las barras desenergizadas.
         '''
 
-        if bus.bus_type == 'Slack':
-            self.slack = bus
-        elif bus.bus_type == 'PQ':
-            self.PQ_buses.append(bus)
-        elif bus.bus_type == 'PV':
-            self.PV_buses.append(bus)
+        n_islands = np.max(labels, initial=-1) + 1
+        generators = np.bincount(labels, weights=self.bus_type != PQ,
+                                 minlength=n_islands) > 0
+        slacks = np.bincount(labels, weights=self.bus_type == SLACK,
+                             minlength=n_islands) > 0
+
+        # Referencias: PV de mayor generación (menor PL) de cada isla
+        candidates = np.flatnonzero((self.bus_type == PV)
+                                    & ~slacks[labels])
+        candidates = candidates[np.lexsort((self.PL[candidates],
+                                            labels[candidates]))]
+        _, first = np.unique(labels[candidates], return_index=True)
+        references = candidates[first]
+        dead = np.flatnonzero(~generators[labels])
+
+        fixed = self.bus_type == SLACK
+        fixed[references] = True
+        ref = np.flatnonzero(fixed)
+        fixed[dead] = True
+        pq = np.flatnonzero((self.bus_type == PQ) & ~fixed)
+        pv = np.flatnonzero((self.bus_type == PV) & ~fixed)
+        self._organized = {'ref': ref, 'pq': pq, 'pv': pv,
+                           'pqpv': np.concatenate([pq, pv]),
+                           'bus_type': self.bus_type.copy()}
+
+        # Tensiones fijas
+        Vset = self.Vset[references]
+        self.V[references] = np.where(np.isnan(Vset), self.V[references],
+                                      Vset)
+        self.V[dead] = 0
+        self.theta[dead] = 0
+
+        return references, dead
+
+    def seed_de_energized(self):
+        '''
+        Dar a las barras desenergizadas (V = 0, ver organize_islands) la
+        tensión y el ángulo de una vecina energizada a través de las ramas
+        en servicio, de modo que al reconectarse partan cerca de la red a
+        la que vuelven. Las que siguen aisladas quedan en 1 pu y ángulo 0.
+        '''
 
-        self.organize_buses()
+        dead = self.V <= 0
+        on = self.branch_in_operation
+        f = self.branch_from[on]
+        t = self.branch_to[on]
+        while np.any(dead):
+            # Ramas entre una barra energizada y una desenergizada
+            k = np.flatnonzero(dead[f] != dead[t])
+            if len(k) == 0:
+                break
+            source = np.where(dead[f[k]], t[k], f[k])
+            target = np.where(dead[f[k]], f[k], t[k])
+            self.V[target] = self.V[source]
+            self.theta[target] = self.theta[source]
+            dead[target] = False
+        self.V[dead] = 1.0
+        self.theta[dead] = 0.0
+
+    def _organization(self, key):
+
+        # La organización se rehace si cambiaron los tipos de barra, aunque
+        # se hayan escrito directamente en self.bus_type
+        if (self._organized is None
+                or not np.array_equal(self._organized['bus_type'],
+                                      self.bus_type)):
+            self.organize_buses()
+
+        return self._organized[key]
+
+    def _views(self, key, get_view, indices):
+
+        self._organization('ref')
+        if key not in self._organized:
+            self._organized[key] = [get_view(i) for i in indices]
+
+        return self._organized[key]
+
+    ref = property(lambda self: self._organization('ref'))
+    pq = property(lambda self: self._organization('pq'))
+    pv = property(lambda self: self._organization('pv'))
+    pqpv = property(lambda self: self._organization('pqpv'))
+
+    @property
+    def slack(self):
+        return self.get_bus(self.ref[0]) if len(self.ref) else None
+
+    @property
+    def PQ_buses(self):
+        return self._views('PQ_buses', self.get_bus, self.pq)
+
+    @property
+    def PV_buses(self):
+        return self._views('PV_buses', self.get_bus, self.pv)
+
+    @property
+    def non_slack_buses(self):
+        return self._views('non_slack_buses', self.get_bus, self.pqpv)
+
+    @property
+    def buses(self):
+        return self._views('buses', self.get_bus,
+                           np.concatenate([self.ref, self.pqpv]))
+
+    @property
+    def lines(self):
+        return self._views('lines', self.get_branch,
+                           np.flatnonzero(~self.branch_is_transformer))
+
+    @property
+    def transformers(self):
+        return self._views('transformers', self.get_branch,
+                           np.flatnonzero(self.branch_is_transformer))
 
-    def add_slack(self, V, Vb, theta=0, PL=0, QL=0, G=0, B=0, name=''):
+    def store_bus(self, bus):
         '''
-        Agregar barra oscilante a la red.
+        Registrar una barra nueva (o que cambió de tipo) y reorganizar.
+        '''
+
+        self._organized = None
+
+    def add_bus(self, bus_type, name='', **values):
+        '''
+        Agregar una barra de tipo 'Slack', 'PQ' o 'PV' con los valores dados
+        (V, theta, PL, QL, G, B, Vb, Vset, Qmin, Qmax).
         '''
 
-        bus = Bus(V, theta, PL, QL, G, B, Vb, 'Slack', name)
+        i, = self._append(self.bus_fields, 'n_buses', 1,
+                          bus_type=BUS_TYPES.index(bus_type), **values)
+        self.bus_names.append(name)
+        self._bus_views.append(None)
+        bus = self.get_bus(i)
         self.store_bus(bus)
 
         return bus
 
+    def add_slack(self, V, Vb, theta=0, PL=0, QL=0, G=0, B=0, name=''):
+        '''
+        Agregar barra oscilante a la red.
+        '''
+
+        return self.add_bus('Slack', name, V=V, theta=theta, PL=PL, QL=QL,
+                            G=G, B=B, Vb=Vb)
+
     def add_PQ(self, PL, QL, Vb, G=0, B=0, name=''):
         '''
         Agregar barra PQ a la red.
         '''
 
-        bus = Bus(1, 0, PL, QL, G, B, Vb, 'PQ', name)
-        self.store_bus(bus)
+        return self.add_bus('PQ', name, V=1, theta=0, PL=PL, QL=QL,
+                            G=G, B=B, Vb=Vb)
 
-        return bus
-
-    def add_PV(self, PL, V, Vb, QL=0, G=0, B=0, name=''):
+    def add_PV(self, PL, V, Vb, QL=0, G=0, B=0, name='',
+               Qmin=-np.inf, Qmax=np.inf):
         '''
         Agregar barra PV a la red.
+
+        Qmin y Qmax son los límites (pu) de la potencia reactiva que
+        entregan los generadores de la barra (ver run_pf con q_limits).
         '''
 
-        bus = Bus(V, 0, PL, 0, G, B, Vb, 'PV', name)
-        self.store_bus(bus)
+        return self.add_bus('PV', name, V=V, theta=0, PL=PL, QL=0,
+                            G=G, B=B, Vb=Vb, Vset=V, Qmin=Qmin, Qmax=Qmax)
 
-        return bus
+    def add_branch(self, from_bus, to_bus, **values):
+        '''
+        Agregar una rama entre dos barras con los valores dados (ver
+        System.branch_fields sin el prefijo 'branch_').
+        '''
 
-    def add_transformer(self, from_bus, to_bus, R, X, n, MVA, Sbase=100):
+        values = {'branch_' + field: value for field, value in values.items()}
+        k, = self._append(self.branch_fields, 'n_branches', 1,
+                          branch_from=from_bus.index, branch_to=to_bus.index,
+                          **values)
+        self._branch_views.append(None)
+        self._organized = None
+
+        return self.get_branch(k)
+
+    def add_buses(self, bus_types, names, **values):
+        '''
+        Agregar varias barras de una vez.
 
-        t = Transformer(from_bus, to_bus, R, X, n, MVA, Sbase)
-        self.transformers.append(t)
+        bus_types es un arreglo de códigos SLACK, PQ o PV y values son
+        arreglos (o escalares) con los campos de System.bus_fields, todos de
+        la misma longitud que names. Devuelve los índices de las barras
+        nuevas; las vistas se crean solo cuando se piden.
+        '''
+
+        names = list(names)
+        indices = self._append(self.bus_fields, 'n_buses', len(names),
+                               bus_type=bus_types, **values)
+        self.bus_names.extend(names)
+        self._bus_views.extend([None]*len(names))
+        self._organized = None
+
+        return indices
+
+    def add_branches(self, from_buses, to_buses, **values):
+        '''
+        Agregar varias ramas de una vez entre los índices de barras dados.
+
+        values son arreglos (o escalares) con los campos de
+        System.branch_fields sin el prefijo 'branch_'. Devuelve los índices
+        de las ramas nuevas.
+        '''
 
-        return t
+        from_buses = np.asarray(from_buses, dtype=np.intp)
+        values = {'branch_' + field: value for field, value in values.items()}
+        indices = self._append(self.branch_fields, 'n_branches',
+                               len(from_buses), branch_from=from_buses,
+                               branch_to=to_buses, **values)
+        self._branch_views.extend([None]*len(from_buses))
+        self._organized = None
+
+        return indices
+
+    def add_transformer(self, from_bus, to_bus, R, X, n, MVA, Sbase=100):
+        '''
+        Agregar transformador a la red. R y X están en pu de base propia.
+        '''
+
+        return self.add_branch(from_bus, to_bus,
+                               R=R * Sbase / MVA,
+                               X=X * Sbase / MVA,
+                               n=n,
+                               MVA=MVA,
+                               is_transformer=True)
 
     def add_line(self, from_bus, to_bus, X, R=0, total_G=0, total_B=0):
         '''
@@ -172,111 +1081,512 @@ class System:
         '''
 
         total_Y = total_G + 1j*total_B
-        line = Line(from_bus,
-                    to_bus,
-                    X,
-                    R,
-                    total_Y/2,
-                    total_Y/2,
-                    in_operation=True)
-        self.lines.append(line)
 
-        return line
+        return self.add_branch(from_bus, to_bus,
+                               X=X,
+                               R=R,
+                               from_Y=total_Y/2,
+                               to_Y=total_Y/2,
+                               in_operation=True)
+
+    def branch_admittances(self, in_operation=None):
+        '''
+        Devolver Yff, Yft, Ytf, Ytt de cada rama (cero si está fuera de operación).
+
+        Son las entradas de la matriz 2x2 que cada rama aporta a Y:
+
+        |If|   |Yff  Yft| |Vf|
+        |It| = |Ytf  Ytt| |Vt|
+
+        Líneas y transformadores usan el mismo modelo (en las líneas n = 1 y
+        en los transformadores from_Y = to_Y = 0). Con in_operation se puede
+        reemplazar el estado de las ramas (por ejemplo, todas en servicio).
+        '''
+
+        if in_operation is None:
+            in_operation = self.branch_in_operation
+
+        Y_series = in_operation/(self.branch_R + 1j*self.branch_X)
+        n = self.branch_n
+
+        Yff = Y_series/n**2 + in_operation*self.branch_from_Y
+        Ytt = Y_series + in_operation*self.branch_to_Y
+        Yft = -Y_series/n
+        Ytf = -Y_series/n
+
+        return Yff, Yft, Ytf, Ytt
+
+    def build_Y_base(self):
+        '''
+        Construir la matriz de admitancias base con todas las ramas en servicio.
+
+        Todas las contribuciones se ensamblan en un solo paso COO -> CSR (las
+        entradas repetidas se suman). Además se guardan, para cada rama y cada
+        barra, las posiciones de sus entradas en Y.data, de modo que build_Y
+        pueda aplicar salidas o cambios de parámetros sin reensamblar Y.
+        '''
+
+        N = self.n_buses
+        f = self.branch_from
+        t = self.branch_to
+        ib = np.arange(N)
+
+        # Contribuciones de las barras y de las ramas
+        Y_shunt = self.G + 1j*self.B
+        stamps = np.column_stack(
+            self.branch_admittances(np.ones(self.n_branches, dtype=bool)))
+
+        rows = np.concatenate([ib, f, f, t, t])
+        cols = np.concatenate([ib, f, t, f, t])
+        vals = np.concatenate([Y_shunt, stamps.T.ravel()])
+
+        Y = scipy.sparse.coo_matrix((vals, (rows, cols)), shape=(N, N)).tocsr()
+        Y.sum_duplicates()
+
+        # Ubicar cada entrada (fila, columna) en Y.data
+        Y_rows = np.repeat(ib, np.diff(Y.indptr))
+        keys = Y_rows*N + Y.indices
+        positions = np.searchsorted(keys, rows*N + cols)
+
+        self._cache['Y_base'] = {'Y': Y,
+                                 'Y_shunt': Y_shunt,
+                                 'stamps': stamps,
+                                 'from': f.copy(),
+                                 'to': t.copy(),
+                                 'diagonal': positions[:N],
+                                 'positions': positions[N:].reshape(4, -1).T}
+
+        return self._cache['Y_base']
 
     def build_Y(self):
         '''
-        Construir matriz de admitancias nodales.
-        '''
-
-        # Inicializar matriz de admitancias
-        N = len(self.buses)
-        self.Y = np.zeros([N, N], dtype=complex)
-
-        # Agregar contribuciones de las barras
-        for i, bus in enumerate(self.buses):
-            self.Y[i, i] += bus.G + 1j*bus.B
-
-        # Agregar contribuciones de las líneas
-        for line in self.lines:
-            if line.in_operation:
-                # Obtener índices
-                i = self.buses.index(line.from_bus)
-                j = self.buses.index(line.to_bus)
-                # Obtener admitancia serie
-                Y_series = 1/(line.R + 1j*line.X)
-                # Agregar contribuciones
-                self.Y[i, i] += line.from_Y + Y_series
-                self.Y[j, j] += line.to_Y + Y_series
-                self.Y[i, j] -= Y_series
-                self.Y[j, i] -= Y_series
-
-        # Agregar contribuciones de transformadores
-        for trafo in self.transformers:
-            # Obtener índices
-            i = self.buses.index(trafo.from_bus)
-            j = self.buses.index(trafo.to_bus)
-            # Obtener admitancias
-            Y_series, from_Y, to_Y = trafo.get_pi_model()
-            # Agregar contribuciones
-            self.Y[i, i] += from_Y + Y_series
-            self.Y[j, j] += to_Y + Y_series
-            self.Y[i, j] -= Y_series
-            self.Y[j, i] -= Y_series
+        Construir matriz de admitancias nodales (dispersa, formato CSR).
+
+        Las filas y columnas siguen el orden de los arreglos de barras. Y se
+        obtiene de la matriz base en caché (ver build_Y_base) sumando solo la
+        diferencia de las ramas y barras que cambiaron: una salida de rama es
+        una modificación de rango 1 o 2 que toca 4 entradas. Las ramas fuera
+        de servicio quedan como ceros explícitos, por lo que el patrón de Y (y
+        por ende el de la jacobiana) no cambia entre contingencias. La base
+        solo se reconstruye si cambia la topología (barras o ramas nuevas).
+        '''
 
-    def build_dS_dV(self):
+        base = self._cache.get('Y_base')
+        if (base is None
+                or len(base['Y_shunt']) != self.n_buses
+                or not np.array_equal(base['from'], self.branch_from)
+                or not np.array_equal(base['to'], self.branch_to)):
+            base = self.build_Y_base()
+
+        Y = base['Y'].copy()
+
+        # Ramas que difieren de la base (salidas, tomas, parámetros)
+        stamps = np.column_stack(self.branch_admittances())
+        delta = stamps - base['stamps']
+        changed = np.flatnonzero(np.any(delta != 0, axis=1))
+        np.add.at(Y.data, base['positions'][changed].ravel(),
+                  delta[changed].ravel())
+
+        # Barras cuya admitancia en derivación difiere de la base
+        delta = self.G + 1j*self.B - base['Y_shunt']
+        changed = np.flatnonzero(delta)
+        np.add.at(Y.data, base['diagonal'][changed], delta[changed])
+
+        self.Y = Y
+
+    @contextlib.contextmanager
+    def outage(self, *branches):
         '''
-        Construir eficientemente las derivadas parciales de la potencia de las barras.
+        Sacar de operación temporalmente las ramas dadas (vistas o índices).
+
+        Por ejemplo, para una contingencia N-2:
+
+            with sys.outage(line_a, line_b):
+                sys.run_pf()
+        '''
+
+        k = np.array([getattr(br, 'index', br) for br in branches], dtype=int)
+        previous = self.branch_in_operation[k].copy()
+        self.branch_in_operation[k] = False
+        try:
+            yield
+        finally:
+            self.branch_in_operation[k] = previous
+
+    def set_tap_control(self, branches, bus=None, Vset=None, n_min=0.9,
+                        n_max=1.1, step=0.0):
+        '''
+        Activar el control de tensión con cambiador de tomas bajo carga en
+        los transformadores dados (vistas o índices).
+
+        bus es la barra controlada de cada uno (vistas o índices; por
+        defecto su barra 'to') y Vset su consigna (por defecto, la tensión
+        actual de esa barra). Las tomas se mueven entre n_min y n_max en
+        pasos de step (0 para tomas continuas). Para desactivar el control
+        basta con poner branch_tap_bus = -1.
+        '''
+
+        k = np.array([getattr(br, 'index', br) for br in branches], dtype=int)
+        if bus is None:
+            bus = self.branch_to[k]
+        else:
+            bus = np.array([getattr(b, 'index', b) for b in np.atleast_1d(bus)],
+                           dtype=int)
+        bus = np.broadcast_to(bus, k.shape)
+
+        self.branch_tap_bus[k] = bus
+        self.branch_tap_Vset[k] = self.V[bus] if Vset is None else Vset
+        self.branch_tap_min[k] = n_min
+        self.branch_tap_max[k] = n_max
+        self.branch_tap_step[k] = step
+
+    def adjust_taps(self, tap_tol=1e-4, move=True):
+        '''
+        Mover las tomas de los transformadores en servicio con control de
+        tensión (ver set_tap_control) hacia su consigna, a partir de las
+        tensiones actuales. Devuelve el número de tomas que cambiaron (con
+        move=False solo se cuentan las que cambiarían, sin moverlas).
+
+        La tensión del lado 'to' es aproximadamente V_from/n y la del lado
+        'from', n*V_to, de modo que la toma necesaria se estima con el
+        cociente entre la tensión y la consigna. Las tomas discretas se
+        mueven solo los pasos completos que caben en ese cambio (una banda
+        muerta de un paso, que evita que oscilen entre dos posiciones) y
+        las continuas mientras el error de tensión supere tap_tol; en ambos
+        casos se limitan a [n_min, n_max]. Como solo cambian las
+        tomas, build_Y actualiza Y de forma incremental.
+        '''
+
+        k = np.flatnonzero((self.branch_tap_bus >= 0)
+                           & self.branch_in_operation)
+        bus = self.branch_tap_bus[k]
+        V = self.V[bus]
+        Vset = self.branch_tap_Vset[k]
+        n = self.branch_n[k]
+        step = self.branch_tap_step[k]
+
+        # Toma necesaria, en pasos completos y limitada
+        n_new = n*np.where(bus == self.branch_to[k], V/Vset, Vset/V)
+        discrete = step > 0
+        n_new = np.where(discrete,
+                         n + np.fix((n_new - n)/np.where(discrete, step, 1))
+                         * step,
+                         n_new)
+        n_new = np.clip(n_new, self.branch_tap_min[k], self.branch_tap_max[k])
+
+        # Las barras desenergizadas no se controlan
+        moved = (V > 0) & (np.abs(n_new - n) > 1e-12) \
+                & (discrete | (np.abs(V - Vset) > tap_tol))
+        if move:
+            self.branch_n[k[moved]] = n_new[moved]
+
+        return int(np.count_nonzero(moved))
+
+    def get_phasor_V(self):
+        '''
+        Devolver las tensiones de todas las barras en forma fasorial.
+        '''
+
+        return self.V*np.exp(1j*self.theta)
+
+    def dS_dV_values(self, V):
+        '''
+        Evaluar dS/dVm y dS/dVa entrada por entrada sobre el patrón de Y.
+
+        V puede ser un vector de tensiones fasoriales o una matriz con un
+        escenario por fila; el resultado tiene la misma forma que V con la
+        última dimensión reemplazada por las entradas de Y.data.
 
         Ver detalles en https://matpower.org/docs/TN2-OPF-Derivatives.pdf
         '''
 
-        V = np.array([bus.V*np.exp(1j*bus.theta) for bus in self.buses])
-        ib = range(len(V))
-        Ybus = scipy.sparse.csr_matrix(self.Y)
+        Ybus = self.Y
+        # Las barras desenergizadas (V = 0) quedan con Vnorm = 0
+        Vnorm = np.divide(V, np.abs(V), out=np.zeros_like(V),
+                          where=V != 0)
+        Ibus = (Ybus @ V.T).T
+
+        # Posición (fila, columna) de cada entrada de Y.data
+        rows = np.repeat(np.arange(Ybus.shape[0]), np.diff(Ybus.indptr))
+        cols = Ybus.indices
+        diagonal = np.flatnonzero(rows == cols)
+        d = rows[diagonal]
+
+        # dS_dVm = diag(V) conj(Y diag(Vnorm)) + conj(diag(Ibus)) diag(Vnorm)
+        dVm = V[..., rows]*np.conj(Ybus.data*Vnorm[..., cols])
+        dVm[..., diagonal] += np.conj(Ibus[..., d])*Vnorm[..., d]
+
+        # dS_dVa = j diag(V) conj(diag(Ibus) - Y diag(V))
+        dVa = -1j*V[..., rows]*np.conj(Ybus.data*V[..., cols])
+        dVa[..., diagonal] += 1j*V[..., d]*np.conj(Ibus[..., d])
+
+        return dVm, dVa
+
+    def build_dS_dV(self):
+        '''
+        Construir eficientemente las derivadas parciales de la potencia de las barras.
 
-        Ibus = Ybus*V
-        diagV = scipy.sparse.csr_matrix((V, (ib, ib)))
-        diagIbus = scipy.sparse.csr_matrix((Ibus, (ib, ib)))
-        diagVnorm = scipy.sparse.csr_matrix((V/np.abs(V), (ib, ib)))
+        Las derivadas se evalúan entrada por entrada sobre el patrón de Y
+        (ver dS_dV_values), de modo que las matrices resultantes (CSR) tienen
+        exactamente el patrón de Y, incluso cuando hay ramas fuera de
+        servicio.
+        '''
 
-        dS_dVm = diagV*np.conj(Ybus*diagVnorm) + np.conj(diagIbus)*diagVnorm
-        dS_dVa = 1j*diagV*np.conj(diagIbus - Ybus*diagV)
+        dVm, dVa = self.dS_dV_values(self.get_phasor_V())
 
-        dS_dVm = dS_dVm.toarray()
-        dS_dVa = dS_dVa.toarray()
+        Ybus = self.Y
+        pattern = (Ybus.indices, Ybus.indptr)
+        dS_dVm = scipy.sparse.csr_matrix((dVm, *pattern), shape=Ybus.shape)
+        dS_dVa = scipy.sparse.csr_matrix((dVa, *pattern), shape=Ybus.shape)
 
         return dS_dVm, dS_dVa
 
+    def build_J_structure(self, pq=None):
+        '''
+        Devolver la estructura (CSC) de la jacobiana según el patrón de Y y la
+        división de las barras en PQ y PV (con pq se pueden dar otras barras
+        con magnitud de tensión incógnita; por defecto self.pq).
+
+        Para cada entrada de J se guarda de qué entrada de Y.data proviene
+        ('source') y de qué parte ('part': 0 = Re dS/dVa, 1 = Re dS/dVm,
+        2 = Im dS/dVa, 3 = Im dS/dVm), de modo que los valores de J se
+        obtienen con una sola indexación (ver J_values). Las estructuras se
+        guardan en caché según el patrón de Y y la división de las barras,
+        junto con su orden de factorización (ver J_ordering), de modo que la
+        estructura y el orden se calculan una vez por topología.
+        '''
+
+        Ybus = self.Y
+        pq = self.pq if pq is None else pq
+        pqpv = self.pqpv
+        key = hash(b''.join(a.tobytes() for a in (Ybus.indptr, Ybus.indices,
+                                                   pq, pqpv)))
+        structures = self._cache.setdefault('J_structures', {})
+        structure = structures.get(key)
+        if structure is not None:
+            self._cache['J_structure'] = structure
+            return structure
+
+        N = Ybus.shape[0]
+        n = len(pqpv)
+        size = n + len(pq)
+
+        # Posición de cada barra entre las incógnitas de ángulo y de tensión
+        angle = np.full(N, -1)
+        angle[pqpv] = np.arange(n)
+        magnitude = np.full(N, -1)
+        magnitude[pq] = n + np.arange(len(pq))
+
+        rows = np.repeat(np.arange(N), np.diff(Ybus.indptr))
+        cols = Ybus.indices
+        J_rows, J_cols, source, part = [], [], [], []
+        for p, (row_map, col_map) in enumerate([(angle, angle),
+                                                (angle, magnitude),
+                                                (magnitude, angle),
+                                                (magnitude, magnitude)]):
+            k = np.flatnonzero((row_map[rows] >= 0) & (col_map[cols] >= 0))
+            J_rows.append(row_map[rows[k]])
+            J_cols.append(col_map[cols[k]])
+            source.append(k)
+            part.append(np.full(len(k), p))
+
+        J_rows = np.concatenate(J_rows)
+        J_cols = np.concatenate(J_cols)
+        order = np.lexsort((J_rows, J_cols))
+        indptr = np.zeros(size + 1, dtype=int)
+        np.cumsum(np.bincount(J_cols, minlength=size), out=indptr[1:])
+
+        structure = {'key': key,
+                     'shape': (size, size),
+                     'indices': J_rows[order],
+                     'indptr': indptr,
+                     'source': np.concatenate(source)[order],
+                     'part': np.concatenate(part)[order]}
+        if len(structures) >= 8:
+            structures.clear()
+        structures[key] = structure
+        self._cache['J_structure'] = structure
+
+        return structure
+
+    def J_ordering(self, structure, values):
+        '''
+        Devolver el orden de filas y columnas de J que reduce el llenado de
+        sus factores LU, calculado una sola vez por estructura.
+
+        El patrón de J es simétrico, como el de Y, así que se usa el orden de
+        grado mínimo de SuperLU sobre A^T + A (con los valores dados para la
+        primera factorización) y luego se aplica como permutación simétrica.
+        Además del orden ('perm') se guardan la estructura CSC de la matriz
+        permutada y la posición de cada uno de sus valores en J ('take').
+        '''
+
+        ordering = structure.get('ordering')
+        if ordering is not None:
+            return ordering
+
+        J = scipy.sparse.csc_matrix(
+            (values, structure['indices'], structure['indptr']),
+            shape=structure['shape'])
+        lu = scipy.sparse.linalg.splu(J, permc_spec='MMD_AT_PLUS_A',
+                                      diag_pivot_thresh=0.1,
+                                      options={'SymmetricMode': True})
+        perm = np.argsort(lu.perm_c)
+
+        # Posición nueva de cada entrada de J
+        size = structure['shape'][0]
+        new_index = np.empty(size, dtype=int)
+        new_index[perm] = np.arange(size)
+        cols = np.repeat(np.arange(size), np.diff(structure['indptr']))
+        rows = new_index[structure['indices']]
+        cols = new_index[cols]
+        take = np.lexsort((rows, cols))
+        indptr = np.zeros(size + 1, dtype=int)
+        np.cumsum(np.bincount(cols, minlength=size), out=indptr[1:])
+
+        ordering = structure['ordering'] = {'perm': perm,
+                                            'take': take,
+                                            'indices': rows[take],
+                                            'indptr': indptr}
+
+        return ordering
+
+    def permuted_J(self):
+        '''
+        Devolver self.J permutada simétricamente según J_ordering y la
+        permutación, o (self.J, None) si J no se construyó sobre la
+        estructura en caché.
+        '''
+
+        structure = self._cache.get('J_structure')
+        if structure is None or self.J.shape != structure['shape'] \
+                or self.J.nnz != len(structure['indices']):
+            return self.J, None
+
+        ordering = self.J_ordering(structure, self.J.data)
+        J = scipy.sparse.csc_matrix(
+            (self.J.data[ordering['take']], ordering['indices'],
+             ordering['indptr']), shape=structure['shape'])
+
+        return J, ordering['perm']
+
+    def factorize_J(self):
+        '''
+        Factorizar self.J (LU dispersa) y devolver una función que resuelve
+        J*x = b.
+
+        Si J se construyó sobre la estructura en caché, se factoriza J ya
+        permutada según J_ordering, sin volver a calcular el orden; si no,
+        SuperLU calcula su propio orden (COLAMD). Solo se reutiliza el orden:
+        splu no admite refactorizaciones solo numéricas, así que cada llamada
+        repite el análisis simbólico (eliminación y llenado) de SuperLU.
+        '''
+
+        J, perm = self.permuted_J()
+        if perm is None:
+            return scipy.sparse.linalg.splu(J).solve
+
+        lu = scipy.sparse.linalg.splu(J, permc_spec='NATURAL',
+                                      diag_pivot_thresh=0.1,
+                                      options={'SymmetricMode': True})
+
+        def solve(b):
+            x = np.empty_like(b)
+            x[perm] = lu.solve(b[perm])
+            return x
+
+        return solve
+
+    def J_values(self, structure, dVm, dVa):
+        '''
+        Devolver los valores de J (en el orden de la estructura CSC) a partir
+        de las derivadas sobre el patrón de Y; admite escenarios por filas.
+        '''
+
+        parts = np.stack([dVa.real, dVm.real, dVa.imag, dVm.imag], axis=-2)
+
+        return parts[..., structure['part'], structure['source']]
+
     def build_J(self):
         '''
-        Construir matriz jacobiana.
+        Construir matriz jacobiana dispersa (formato CSC).
+
+        Las incógnitas son los ángulos de self.pqpv y las magnitudes de
+        self.pq, en ese orden. Solo se calculan los valores: la estructura
+        se toma de la caché (ver build_J_structure).
         '''
 
-        dS_dVm, dS_dVa = self.build_dS_dV()
+        structure = self.build_J_structure()
+        dVm, dVa = self.dS_dV_values(self.get_phasor_V())
 
-        M = len(self.PQ_buses)
-        J11 = dS_dVa[1:, 1:].real
-        J12 = dS_dVm[1:, 1:M+1].real
-        J21 = dS_dVa[1:M+1, 1:].imag
-        J22 = dS_dVm[1:M+1, 1:M+1].imag
+        self.J = scipy.sparse.csc_matrix(
+            (self.J_values(structure, dVm, dVa), structure['indices'],
+             structure['indptr']), shape=structure['shape'])
 
-        self.J = np.vstack([np.hstack([J11, J12]), np.hstack([J21, J22])])
+    def branch_currents(self, V=None):
+        '''
+        Devolver las corrientes (pu) que entran a cada rama desde sus barras
+        'from' y 'to', y las tensiones de esas barras, para todas las ramas
+        a la vez.
+
+        V son las tensiones fasoriales de las barras (por defecto las del
+        sistema); puede ser una matriz (escenarios x barras), por ejemplo
+        BatchResults.get_phasor_V(), y entonces los resultados tienen una
+        fila por escenario.
+        '''
 
-    def S_towards_network(self):
+        if V is None:
+            V = self.get_phasor_V()
+        Yff, Yft, Ytf, Ytt = self.branch_admittances()
+        Vf = V[..., self.branch_from]
+        Vt = V[..., self.branch_to]
+
+        If = Yff*Vf + Yft*Vt
+        It = Ytf*Vf + Ytt*Vt
+
+        return If, It, Vf, Vt
+
+    def branch_flows(self, V=None):
         '''
-        Devolver la potencia compleja que fluye hacia la red desde cada barra.
+        Devolver las potencias complejas (pu) que entran a cada rama desde sus
+        barras 'from' y 'to', para todas las ramas a la vez (V como en
+        branch_currents).
+        '''
+
+        If, It, Vf, Vt = self.branch_currents(V)
+
+        return Vf*np.conj(If), Vt*np.conj(It)
+
+    def branch_loading(self, V=None):
+        '''
+        Devolver la cargabilidad (%) de cada rama respecto de su capacidad
+        en MVA (nan en las ramas sin capacidad definida, como las líneas).
+        '''
+
+        Sf, St = self.branch_flows(V)
+
+        return 100*self.Sb*np.maximum(np.abs(Sf), np.abs(St))/self.branch_MVA
+
+    def branch_results(self, V=None):
+        '''
+        Calcular flujos, corrientes, pérdidas y cargabilidad de todas las
+        ramas (líneas y transformadores) en una sola pasada y devolverlos
+        en un BranchResults. V como en branch_currents; con una matriz de
+        tensiones se obtienen todos los escenarios a la vez.
         '''
 
-        V = np.array([bus.V*np.exp(1j*bus.theta) for bus in self.buses])
-        ib = range(len(V))
-        Ybus = scipy.sparse.csr_matrix(self.Y)
+        If, It, Vf, Vt = self.branch_currents(V)
 
-        Ibus = Ybus*V
-        diagV = scipy.sparse.csr_matrix((V, (ib, ib)))
+        return BranchResults(self, Vf*np.conj(If), Vt*np.conj(It), If, It)
+
+    def S_towards_network(self):
+        '''
+        Devolver la potencia compleja que fluye hacia la red desde cada barra.
+        '''
 
-        S_to_network = diagV*np.conj(Ybus*np.asmatrix(V).T)
+        V = self.get_phasor_V()
 
-        return S_to_network
+        return V*np.conj(self.Y @ V)
 
     def update_S(self, x):
         '''
@@ -288,12 +1598,11 @@ class System:
         '''
 
         # Get power going to the network
-        SL = - self.S_towards_network()
+        S_to_network = self.S_towards_network()
 
-        # Add it as an attribute to the bus
-        for (i, bus) in enumerate(self.buses):
-            bus.P_to_network = - SL[i, 0].real
-            bus.Q_to_network = - SL[i, 0].imag
+        # Store it in the bus arrays
+        self.P_to_network[:] = S_to_network.real
+        self.Q_to_network[:] = S_to_network.imag
 
     def build_F(self):
         '''
@@ -301,18 +1610,42 @@ class System:
         '''
 
         # Determinar potencia inyectada
-        S_injected = np.array([[-bus.PL - 1j*bus.QL] for bus in self.buses],
-                              dtype=complex)
+        S_injected = -self.PL - 1j*self.QL
 
         # Determinar diferencias de potencia
         delta_S = self.S_towards_network() - S_injected
 
         # Construir vector de diferencias de potencia
-        M = len(self.PQ_buses)
-        F00 = delta_S[1:, 0].real
-        F10 = delta_S[1:M+1, 0].imag
+        F00 = delta_S[self.pqpv].real
+        F10 = delta_S[self.pq].imag
 
-        self.F = np.vstack([F00, F10])
+        self.F = np.concatenate([F00, F10])
+
+    def build_F_J(self, backend=None):
+        '''
+        Construir el vector de diferencias de potencia y la jacobiana (como
+        build_F y build_J) en una sola pasada por las entradas de Y.
+
+        Se usan los núcleos de kernels.py (compilados con Numba si está
+        instalado y coincide con NumPy, ver kernels.default_backend, o de
+        NumPy; backend los elige) sobre arreglos de trabajo
+        guardados junto con la estructura de J, de modo que en cada
+        iteración no se crean matrices diagonales ni temporales del tamaño
+        de Y. Los valores de self.J se sobrescriben en la siguiente llamada.
+        '''
+
+        structure = self.build_J_structure()
+        workspace = structure.get('kernels')
+        if workspace is None:
+            workspace = structure['kernels'] = kernels.workspace(self.Y,
+                                                                 structure)
+
+        self.F, values = kernels.mismatch_jacobian(
+            workspace, self.Y, self.V, self.theta, -self.PL - 1j*self.QL,
+            self.pqpv, self.pq, backend)
+        self.J = scipy.sparse.csc_matrix(
+            (values, structure['indices'], structure['indptr']),
+            shape=structure['shape'])
 
     def update_v(self, x):
         '''
@@ -320,58 +1653,861 @@ class System:
         '''
 
         # Actualizar ángulos
-        for i, bus in enumerate(self.non_slack_buses):
-            bus.theta = x[i, 0]
+        n = len(self.pqpv)
+        self.theta[self.pqpv] = x[:n]
 
         # Actualizar magnitudes
-        for i, bus in enumerate(self.PQ_buses):
-            bus.V = x[len(self.non_slack_buses)+i, 0]
+        self.V[self.pq] = x[n:]
 
-    def run_pf(self, tol=1e-12, max_iters=20):
+    def solve_step(self, solver='splu'):
         '''
-        Correr estudio de flujo de potencia usando el método de Newton-Raphson.
+        Resolver J*dx = F para obtener el paso de Newton-Raphson.
+
+        - 'splu': factorización LU dispersa (SuperLU) de la jacobiana, con
+          el orden en caché (ver factorize_J).
+        - 'spsolve': solución dispersa directa sin conservar los factores.
+        - 'dense': inversión densa original; solo para redes pequeñas o
+          para comparar resultados.
+        - 'gmres' o 'bicgstab': método de Krylov precondicionado con ILU
+          (ver KrylovSolver), para redes muy grandes; el solucionador y su
+          precondicionador quedan en caché (ver krylov_solver).
+        - Un KrylovSolver con otros parámetros.
+        - Un decomposition.DecomposedSolver: descomposición en zonas con
+          complemento de Schur, factorizando cada zona en un proceso.
+        - Cualquier otro objeto invocable solver(J, F) -> dx.
+
+        Los métodos de Krylov reciben J permutada con el orden en caché, lo
+        que reduce mucho el llenado del precondicionador ILU.
         '''
 
+        if solver == 'splu':
+            return self.factorize_J()(self.F)
+        elif solver == 'spsolve':
+            return scipy.sparse.linalg.spsolve(self.J, self.F)
+        elif solver == 'dense':
+            return np.matmul(np.linalg.inv(self.J.toarray()), self.F)
+        elif isinstance(solver, KrylovSolver) or solver in KrylovSolver.methods:
+            if not isinstance(solver, KrylovSolver):
+                solver = self.krylov_solver(solver)
+            J, perm = self.permuted_J()
+            if perm is None:
+                return solver(J, self.F)
+            dx = np.empty_like(self.F)
+            dx[perm] = solver(J, self.F[perm], ordered=True)
+            return dx
+        elif callable(solver):
+            return solver(self.J, self.F)
+        else:
+            raise ValueError(f"Unknown linear solver '{solver}'")
+
+    def krylov_solver(self, method='gmres'):
+        '''
+        Devolver el KrylovSolver en caché del método dado (se comparte entre
+        corridas para reutilizar el precondicionador).
+        '''
+
+        key = ('krylov', method)
+        if key not in self._cache:
+            self._cache[key] = KrylovSolver(method)
+
+        return self._cache[key]
+
+    def set_PV_voltages(self):
+        '''
+        Llevar la tensión de las barras PV a su consigna (Vset). Las que no
+        tienen consigna toman como tal su tensión actual.
+        '''
+
+        pv = self.bus_type == PV
+        missing = pv & np.isnan(self.Vset)
+        self.Vset[missing] = self.V[missing]
+        self.V[pv] = self.Vset[pv]
+
+    def get_state(self):
+        '''
+        Devolver el vector de estado actual: ángulos de self.pqpv y magnitudes
+        de self.pq (el mismo orden que usa run_pf).
+        '''
+
+        return np.concatenate([self.theta[self.pqpv], self.V[self.pq]])
+
+    def get_flat_start(self):
+        '''
+        Devolver el vector de estado de 'flat start' (ángulos 0 y tensiones 1).
+        '''
+
+        return np.concatenate([np.zeros(len(self.pqpv)), np.ones(len(self.pq))])
+
+    def run_pf(self, tol=1e-12, max_iters=None, solver='splu',
+               warm_start=False, x0=None, method='nr', fdlf_variant='XB',
+               q_limits=False, callback=None, taps=False, max_tap_iters=10,
+               tap_tol=1e-4, step_control=None):
+        '''
+        Correr estudio de flujo de potencia.
+
+        Métodos disponibles:
+
+        - method='nr': Newton-Raphson (ver newton_raphson). Y, las derivadas
+          y J se mantienen dispersas de principio a fin; el sistema lineal de
+          cada iteración se resuelve según 'solver' (ver solve_step).
+        - method='fdlf': flujo desacoplado rápido (ver fast_decoupled), en
+          su versión 'XB' o 'BX' según fdlf_variant.
+
+        max_iters es por defecto 20 con Newton-Raphson y 100 con el flujo
+        desacoplado rápido, que converge linealmente.
+
+        Por defecto se parte de 'flat start'. Con warm_start=True se parte de
+        las tensiones actuales de las barras (por ejemplo, la solución
+        anterior), salvo que la corrida anterior no haya convergido (ver
+        self.failure): su estado final no sirve como punto de partida y se
+        usa 'flat start'. Con x0 se da explícitamente el estado inicial (ver
+        get_state). Si el estado inicial no es finito se usa 'flat
+        start'.
+
+        Con q_limits=True (solo Newton-Raphson) se respetan los límites Qmin
+        y Qmax de las barras PV (ver newton_raphson_q_limits); las que
+        quedan en un límite se guardan en self.Q_limited.
+
+        Antes de iterar se buscan las islas de la red (ver find_islands).
+        Si las salidas de ramas la dividen, cada isla con generadores se
+        resuelve con su propia referencia y las barras de las islas sin
+        ellos quedan desenergizadas (ver organize_islands); la isla de cada
+        barra queda en self.islands y las barras desenergizadas en
+        self.de_energized (cuando se reconectan, parten de la tensión de
+        una vecina, ver seed_de_energized). Las islas son independientes,
+        por lo que se resuelven juntas (J es diagonal por bloques).
+
+        Con taps=True, los transformadores con control de tensión (ver
+        set_tap_control) ajustan sus tomas en un lazo externo: tras cada
+        solución se mueven las tomas (ver adjust_taps) y se vuelve a
+        resolver desde la solución anterior, hasta que ninguna cambie o
+        tras max_tap_iters ajustes. self.taps_settled indica si la última
+        solución ya no pide mover ninguna toma.
+
+        Con step_control (solo Newton-Raphson: 'full', 'iwamoto',
+        'backtracking' o un StepControl) se controla el largo de cada paso
+        y las corridas que no van a converger se abandonan tras pocas
+        iteraciones; sin él se dan pasos completos hasta max_iters y una
+        jacobiana singular produce una excepción. Si la corrida no converge,
+        la causa queda en self.failure (ver StepControl.failures).
+
+        Cada iteración queda registrada en self.stats (ver SolverStats);
+        si se da callback, se llama con el registro de cada iteración.
+        '''
+
+        if taps:
+            options = dict(tol=tol, max_iters=max_iters, solver=solver,
+                           method=method, fdlf_variant=fdlf_variant,
+                           q_limits=q_limits, callback=callback,
+                           step_control=step_control)
+            converged = self.run_pf(warm_start=warm_start, x0=x0, **options)
+            moves = 0
+            for _ in range(max_tap_iters):
+                moved = self.adjust_taps(tap_tol) if converged else 0
+                if moved == 0:
+                    break
+                moves += moved
+                converged = self.run_pf(warm_start=True, **options)
+            # Las tomas quedan asentadas si la última solución ya no pide
+            # mover ninguna
+            self.taps_settled = converged and \
+                self.adjust_taps(tap_tol, move=False) == 0
+            if converged:
+                self.status += ', ' + str(moves) + ' tap moves'
+                if not self.taps_settled:
+                    self.status += ' (not settled)'
+            return converged
+
         # Construir matriz de admitancias nodales
-        self.build_Y()
+        self.stats.start(callback)
+        with self.stats.timer('Y'):
+            self.build_Y()
+
+        # Elegir estado inicial (las barras desenergizadas en la corrida
+        # anterior, desde sus vecinas; las PV, en su consigna)
+        self.seed_de_energized()
+        self.set_PV_voltages()
+        if x0 is not None:
+            x0 = np.array(x0, dtype=float)
+        elif warm_start and self.failure is None:
+            x0 = self.get_state()
+        if x0 is None or not np.all(np.isfinite(x0)):
+            x0 = self.get_flat_start()
+        # Un x0 con barras desenergizadas (V = 0) parte de 1 pu en ellas
+        n = len(self.pqpv)
+        x0[n:][x0[n:] <= 0] = 1.0
+
+        # Si la red está dividida, resolver cada isla con su referencia
+        n_islands, self.islands = self.find_islands()
+        self.de_energized = np.empty(0, dtype=int)
+        if n_islands > 1:
+            self.update_v(x0)
+            _, self.de_energized = self.organize_islands(self.islands)
+            x0 = self.get_state()
+
+        try:
+            return self._iterate(x0, tol, max_iters, solver, method,
+                                 fdlf_variant, q_limits, n_islands,
+                                 step_control)
+        finally:
+            if n_islands > 1:
+                self.organize_buses()
+
+    def _iterate(self, x0, tol, max_iters, solver, method, fdlf_variant,
+                 q_limits, n_islands, step_control=None):
+        '''
+        Iterar con el método elegido y actualizar el estado (ver run_pf).
+        '''
 
-        # Asegurar 'flat start'
-        x0 = len(self.non_slack_buses)*[0] + len(self.PQ_buses)*[1]
-        x0 = np.array([x0], dtype=float).T
+        # Iterar
+        self.Q_limited = np.empty(0, dtype=int)
+        backend = self.krylov_solver(solver) \
+            if isinstance(solver, str) and solver in KrylovSolver.methods \
+            else solver
+        if hasattr(backend, 'reset'):
+            backend.reset()
+        if q_limits and method != 'nr':
+            raise ValueError('Reactive power limits require method=\'nr\'')
+        control = step_control
+        if isinstance(step_control, str):
+            control = StepControl(step_control)
+        if control is not None:
+            if method != 'nr':
+                raise ValueError('Step control requires method=\'nr\'')
+            control.reset()
+        self.failure = None
+        if method == 'nr':
+            max_iters = 20 if max_iters is None else max_iters
+            if q_limits:
+                x, iters = self.newton_raphson_q_limits(x0, tol, max_iters,
+                                                        solver,
+                                                        control=control)
+            else:
+                x, iters = self.newton_raphson(x0, tol, max_iters, solver,
+                                               control)
+            method_name = 'Newton-Raphson'
+        elif method == 'fdlf':
+            max_iters = 100 if max_iters is None else max_iters
+            x, iters = self.fast_decoupled(x0, tol, max_iters, fdlf_variant)
+            method_name = 'Fast decoupled load flow'
+        else:
+            raise ValueError(f"Unknown power flow method '{method}'")
+
+        # Update complex powers
+        self.update_S(x)
+
+        # Update status
+        self.iterations = iters
+        converged = np.max(np.abs(self.F), initial=0) <= tol
+        self.stats.finish(converged, iters)
+        if converged:
+            self.failure = None
+            tol_W = round(tol*self.Sb*1e6, 3)
+            self.status = 'solved (max |F| < ' + str(tol_W) + ' W) ' \
+                        + 'in ' + str(iters) + ' iterations'
+            if len(self.Q_limited):
+                self.status += ', ' + str(len(self.Q_limited)) \
+                             + ' PV buses at Q limits'
+            if n_islands > 1:
+                self.status += ', ' + str(n_islands) + ' islands'
+            if len(self.de_energized):
+                self.status += ', ' + str(len(self.de_energized)) \
+                             + ' de-energized buses'
+            return True
+        else:
+            self.failure = self.failure or 'max iterations'
+            self.status = 'non-convergent after ' + str(iters) \
+                        + ' iterations (' + self.failure + ')'
+            warnings.warn(method_name + ' did not converge after ' \
+                         + str(iters) + ' iterations (' + self.failure + ').')
+            return False
+
+    def run_pf_batch(self, PL, QL=None, Vset=None, tol=1e-12, max_iters=20,
+                     warm_start=False, batch_size=64, callback=None):
+        '''
+        Resolver muchos escenarios de carga y generación con Newton-Raphson.
+
+        PL, QL y Vset son matrices (escenarios x barras, columnas en el orden
+        de los arreglos de barras). Vset solo se usa en las barras PV y
+        oscilantes; QL = None o Vset = None toman los valores actuales del
+        sistema (Vset en las barras PV y V en las oscilantes) para todos los
+        escenarios, y un vector (una sola fila) se repite en todos ellos.
+        Todos los escenarios comparten la topología y la misma Y. Las
+        diferencias de potencia y los valores de
+        J se calculan para todos los escenarios a la vez, y en cada iteración
+        los pasos de Newton de los escenarios que aún no convergen se
+        obtienen de un solo sistema disperso diagonal por bloques. Los
+        escenarios se procesan en grupos de batch_size.
+
+        Los arreglos del sistema no se modifican. Con warm_start=True los
+        escenarios parten de la solución actual del sistema. Los escenarios
+        cuya jacobiana resulta singular (por ejemplo, si la red está
+        dividida en islas) se abandonan y quedan como no convergidos.
+
+        En self.stats queda un registro por iteración de cada grupo, con el
+        escenario de mayor diferencia de potencia y el número de escenarios
+        activos, y los contadores suman todos los escenarios; callback se
+        llama con cada registro (ver SolverStats).
+        '''
+
+        PL, QL, Vset = np.broadcast_arrays(
+            np.atleast_2d(np.asarray(PL, dtype=float)),
+            self.QL if QL is None else np.asarray(QL, dtype=float),
+            np.where((self.bus_type == PV) & ~np.isnan(self.Vset), self.Vset,
+                     self.V) if Vset is None
+            else np.asarray(Vset, dtype=float))
+        n_scenarios = PL.shape[0]
+
+        self.stats.start(callback)
+        with self.stats.timer('Y'):
+            self.build_Y()
+        with self.stats.timer('J'):
+            structure = self.build_J_structure()
+
+        V = np.empty(PL.shape)
+        theta = np.empty(PL.shape)
+        converged = np.zeros(n_scenarios, dtype=bool)
+        iterations = np.zeros(n_scenarios, dtype=int)
+
+        for start in range(0, n_scenarios, batch_size):
+            batch = slice(start, min(start + batch_size, n_scenarios))
+            V[batch], theta[batch], converged[batch], iterations[batch] = \
+                self._solve_batch(structure, PL[batch], QL[batch],
+                                  Vset[batch], tol, max_iters, warm_start,
+                                  start)
+        self.stats.finish(converged, iterations, n_scenarios)
+
+        return BatchResults(V, theta, converged, iterations)
+
+    def _solve_batch(self, structure, PL, QL, Vset, tol, max_iters,
+                     warm_start, first_scenario=0):
+        '''
+        Resolver un grupo de escenarios (ver run_pf_batch); first_scenario
+        es el índice del primero, para la telemetría.
+        '''
+
+        pq = self.pq
+        pqpv = self.pqpv
+        n = len(pqpv)
+        size = structure['shape'][0]
+        nnz = len(structure['indices'])
+        n_scenarios = PL.shape[0]
+        ordering = structure.get('ordering')
+        splu = functools.partial(scipy.sparse.linalg.splu,
+                                 permc_spec='NATURAL', diag_pivot_thresh=0.1,
+                                 options={'SymmetricMode': True})
+        workspace = structure.get('kernels')
+        if workspace is None:
+            workspace = structure['kernels'] = kernels.workspace(self.Y,
+                                                                 structure)
+
+        # Estado inicial
+        Vm = np.where(self.bus_type == PQ, 1.0, Vset)
+        Va = np.zeros_like(Vm) + np.where(self.bus_type == SLACK,
+                                          self.theta, 0.0)
+        if warm_start:
+            Vm[:, pq] = self.V[pq]
+            Va[:, pqpv] = self.theta[pqpv]
+        S_injected = -PL - 1j*QL
+
+        stats = self.stats
+        converged = np.zeros(n_scenarios, dtype=bool)
+        singular = np.zeros(n_scenarios, dtype=bool)
+        iterations = np.zeros(n_scenarios, dtype=int)
+        iteration = 0
+        while True:
+            # Diferencias de potencia de todos los escenarios
+            with stats.timer('F'):
+                V = Vm*np.exp(1j*Va)
+                delta_S = V*np.conj((self.Y @ V.T).T) - S_injected
+                F = np.concatenate([delta_S[:, pqpv].real,
+                                    delta_S[:, pq].imag], axis=1)
+                max_F = np.max(np.abs(F), axis=1, initial=0)
+            converged = max_F <= tol
+            active = np.flatnonzero(~converged & ~singular
+                                    & (iterations < max_iters))
+            worst = int(np.argmax(max_F))
+            stats.iteration(self, iteration, F[worst], pqpv, pq,
+                            scenario=first_scenario + worst,
+                            active=len(active))
+            if len(active) == 0:
+                break
+
+            # Jacobianas de los escenarios activos, permutadas según el
+            # orden en caché, diagonal por bloques
+            with stats.timer('J'):
+                _, values = kernels.mismatch_jacobian(
+                    workspace, self.Y, Vm[active], Va[active],
+                    S_injected[active], pqpv, pq, 'numpy')
+                if ordering is None:
+                    ordering = self.J_ordering(structure, values[0])
+                perm = ordering['perm']
+                blocks = np.arange(len(active))[:, None]
+                indptr = np.append(
+                    (blocks*nnz + ordering['indptr'][:-1]).ravel(),
+                    len(active)*nnz)
+                indices = (blocks*size + ordering['indices']).ravel()
+                J = scipy.sparse.csc_matrix(
+                    (values[:, ordering['take']].ravel(), indices, indptr),
+                    shape=(len(active)*size, len(active)*size))
+
+            # Paso de Newton
+            with stats.timer('solve'):
+                dx = np.empty((len(active), size))
+                try:
+                    lu = splu(J)
+                    dx[:, perm] = lu.solve(
+                        F[active][:, perm].ravel()).reshape(len(active),
+                                                            size)
+                except RuntimeError:
+                    # Alguna jacobiana es singular: resolver cada escenario
+                    # por separado y abandonar los que no tienen solución
+                    solved = np.ones(len(active), dtype=bool)
+                    for m, k in enumerate(active):
+                        block = slice(m*size, (m + 1)*size)
+                        try:
+                            lu = splu(J[block, block])
+                        except RuntimeError:
+                            solved[m] = False
+                            continue
+                        dx[m, perm] = lu.solve(F[k, perm])
+                    singular[active[~solved]] = True
+                    active = active[solved]
+                    dx = dx[solved]
+            Va[np.ix_(active, pqpv)] -= dx[:, :n]
+            Vm[np.ix_(active, pq)] -= dx[:, n:]
+            iterations[active] += 1
+            iteration += 1
+
+        return Vm, Va, converged, iterations
+
+    def newton_raphson(self, x0, tol, max_iters, solver='splu', control=None):
+        '''
+        Aplicar el método de Newton-Raphson desde el estado x0.
+
+        F y J se evalúan juntas (ver build_F_J); su tiempo se registra en la
+        fase 'J' de la telemetría. Con control (un StepControl) se elige el
+        largo de cada paso y se abandona la corrida en cuanto se detecta
+        una falla, que queda en self.failure.
+
+        Devuelve el estado final y el número de iteraciones.
+        '''
 
         # Inicializar variables de iteración
         x = x0
         iters = 0
+        stats = self.stats
 
         # Inicializar atributos
         self.update_v(x)
-        self.build_F()
-        self.build_J()
+        with stats.timer('J'):
+            self.build_F_J()
+        stats.iteration(self, iters, self.F, self.pqpv, self.pq)
+        if control is not None:
+            control.check(self.F)
+
+        def evaluate(mu):
+            self.update_v(x - mu*dx)
+            self.build_F()
+            return self.F
 
         # Aplicar método de Newton-Raphson
         while np.max(np.abs(self.F)) > tol and iters < max_iters:
+            # Paso de Newton
+            with stats.timer('solve'):
+                try:
+                    dx = self.solve_step(solver)
+                except (np.linalg.LinAlgError, RuntimeError):
+                    self.failure = 'singular Jacobian'
+                    if control is None:
+                        raise
+                    break
+            mu = 1.0
+            if control is not None:
+                with stats.timer('F'):
+                    mu = control.step(self.F, evaluate)
             # Actualizar variables
-            x -= np.matmul(np.linalg.inv(self.J), self.F)
+            x -= mu*dx
             iters += 1
             # Actualizar atributos
             self.update_v(x)
+            with stats.timer('J'):
+                self.build_F_J()
+            stats.iteration(self, iters, self.F, self.pqpv, self.pq, step=mu)
+            if control is not None:
+                self.failure = control.check(self.F)
+                if self.failure is not None:
+                    break
+
+        return x, iters
+
+    def newton_raphson_q_limits(self, x0, tol, max_iters, solver='splu',
+                                q_check=1e-3, control=None):
+        '''
+        Aplicar Newton-Raphson con límites de potencia reactiva en las
+        barras PV, desde el estado x0.
+
+        Las incógnitas son el ángulo y la magnitud de tensión de todas las
+        barras de self.pqpv. La segunda ecuación de cada barra es su
+        diferencia de potencia reactiva (modo PQ) o V - Vset (modo PV),
+        según una máscara; la estructura de J no cambia al conmutar, solo
+        la máscara. Una vez que max |F| < q_check se revisan los límites en
+        cada iteración: una barra PV cuyos generadores superan Qmax (o bajan
+        de Qmin) pasa a modo PQ con Q fijo en ese límite, y vuelve a modo PV
+        si su tensión cruza la consigna en el sentido contrario (solo una
+        vez por barra, para evitar ciclos). Los tipos de barra y la
+        organización (self.pq, self.pv) no se modifican; las consignas son
+        las de Vset (ver set_PV_voltages). control es como en
+        newton_raphson.
+
+        Devuelve el estado final (ver get_state) y el número de iteraciones.
+        '''
+
+        pqpv = self.pqpv
+        n = len(pqpv)
+        structure = self.build_J_structure(pq=pqpv)
+        rows = structure['indices']
+        cols = np.repeat(np.arange(2*n), np.diff(structure['indptr']))
+
+        # Entradas de J en filas de la segunda ecuación: barra y diagonal
+        second = rows >= n
+        second_bus = rows[second] - n
+        second_diagonal = (rows == cols)[second].astype(float)
+
+        # Consignas y límites
+        is_PV = self.bus_type[pqpv] == PV
+        Vset = self.Vset[pqpv]
+        Qmin = self.Qmin[pqpv]
+        Qmax = self.Qmax[pqpv]
+        limited = is_PV & (np.isfinite(Qmin) | np.isfinite(Qmax))
+
+        # Estado inicial
+        self.update_v(x0)
+        voltage_mode = is_PV.copy()
+        at_Qmax = np.zeros(n, dtype=bool)
+        returned = np.zeros(n, dtype=bool)
+        Q_fixed = np.zeros(n)
+
+        def mismatch():
+            delta_S = self.S_towards_network() + self.PL + 1j*self.QL
+            Q_gen = delta_S[pqpv].imag
+            second = np.where(voltage_mode, self.V[pqpv] - Vset,
+                              Q_gen - Q_fixed)
+            return np.concatenate([delta_S[pqpv].real, second]), Q_gen
+
+        stats = self.stats
+        iters = 0
+        with stats.timer('F'):
+            F, Q_gen = mismatch()
+        while True:
+            # Conmutar barras PV <-> PQ
+            if np.max(np.abs(F)) < q_check:
+                to_max = voltage_mode & limited & (Q_gen > Qmax)
+                to_min = voltage_mode & limited & (Q_gen < Qmin)
+                V = self.V[pqpv]
+                back = ~voltage_mode & limited & ~returned & \
+                       np.where(at_Qmax, V > Vset, V < Vset)
+                if np.any(to_max | to_min | back):
+                    voltage_mode[to_max | to_min] = False
+                    voltage_mode[back] = True
+                    returned |= back
+                    at_Qmax[to_max] = True
+                    at_Qmax[to_min] = False
+                    Q_fixed = np.where(voltage_mode | ~limited, 0.0,
+                                       np.where(at_Qmax, Qmax, Qmin))
+                    with stats.timer('F'):
+                        F, Q_gen = mismatch()
+
+            stats.iteration(self, iters, F, pqpv, pqpv, labels=('P', 'Q/V'),
+                            Q_limited=int(np.sum(is_PV & ~voltage_mode)))
+            if np.max(np.abs(F)) <= tol or iters >= max_iters:
+                break
+            if control is not None:
+                self.failure = control.check(F)
+                if self.failure is not None:
+                    break
+
+            # Jacobiana: filas de modo PV reemplazadas por dV = 0
+            with stats.timer('J'):
+                dVm, dVa = self.dS_dV_values(self.get_phasor_V())
+                values = self.J_values(structure, dVm, dVa)
+                values[second] = np.where(voltage_mode[second_bus],
+                                          second_diagonal, values[second])
+                self.J = scipy.sparse.csc_matrix(
+                    (values, rows, structure['indptr']),
+                    shape=structure['shape'])
+            self.F = F
+
+            # Paso de Newton
+            with stats.timer('solve'):
+                try:
+                    dx = self.solve_step(solver)
+                except (np.linalg.LinAlgError, RuntimeError):
+                    self.failure = 'singular Jacobian'
+                    if control is None:
+                        raise
+                    break
+            theta = self.theta[pqpv]
+            V = self.V[pqpv]
+
+            def evaluate(mu):
+                self.theta[pqpv] = theta - mu*dx[:n]
+                self.V[pqpv] = V - mu*dx[n:]
+                return mismatch()[0]
+
+            mu = 1.0
+            if control is not None:
+                with stats.timer('F'):
+                    mu = control.step(F, evaluate)
+            self.theta[pqpv] = theta - mu*dx[:n]
+            self.V[pqpv] = V - mu*dx[n:]
+            iters += 1
+            with stats.timer('F'):
+                F, Q_gen = mismatch()
+
+        self.F = F
+        self.Q_limited = pqpv[is_PV & ~voltage_mode]
+
+        return self.get_state(), iters
+
+    def build_B_fdlf(self, variant='XB'):
+        '''
+        Construir las matrices B' y B'' del flujo desacoplado rápido.
+
+        B' (P-theta) se arma sin derivaciones ni tomas y B'' (Q-V) con
+        ellas. En la versión 'XB' se ignoran las resistencias en B'; en la
+        'BX', en B''. Se devuelven ya reducidas a las barras self.pqpv y
+        self.pq respectivamente.
+        '''
+
+        if variant not in ('XB', 'BX'):
+            raise ValueError(f"Unknown FDLF variant '{variant}'")
+
+        N = self.n_buses
+        f = self.branch_from
+        t = self.branch_to
+        on = self.branch_in_operation
+        ib = np.arange(N)
+
+        def assemble(R, n, from_Y, to_Y, Y_shunt):
+            Y_series = on/(R + 1j*self.branch_X)
+            rows = np.concatenate([ib, f, f, t, t])
+            cols = np.concatenate([ib, f, t, f, t])
+            vals = np.concatenate([Y_shunt,
+                                   Y_series/n**2 + on*from_Y,
+                                   -Y_series/n,
+                                   -Y_series/n,
+                                   Y_series + on*to_Y])
+            Y = scipy.sparse.coo_matrix((vals, (rows, cols)), shape=(N, N))
+            return -Y.tocsr().imag
+
+        zeros = np.zeros(self.n_branches)
+        R_p = zeros if variant == 'XB' else self.branch_R
+        R_pp = self.branch_R if variant == 'XB' else zeros
+        B_p = assemble(R_p, np.ones(self.n_branches), zeros, zeros,
+                       np.zeros(N))
+        B_pp = assemble(R_pp, self.branch_n, self.branch_from_Y,
+                        self.branch_to_Y, self.G + 1j*self.B)
+
+        return (B_p[self.pqpv][:, self.pqpv].tocsc(),
+                B_pp[self.pq][:, self.pq].tocsc())
+
+    def factorize_B_fdlf(self, variant='XB'):
+        '''
+        Devolver las factorizaciones LU de B' y B''.
+
+        Se guardan en caché según la topología, los parámetros de la red y
+        los tipos de barra, de modo que se reutilizan entre iteraciones y
+        entre escenarios (barridos de carga, por ejemplo).
+        '''
+
+        key = ('fdlf', variant, hash(b''.join(a.tobytes() for a in (
+            self.branch_from, self.branch_to, self.branch_in_operation,
+            self.branch_R, self.branch_X, self.branch_n, self.branch_from_Y,
+            self.branch_to_Y, self.G, self.B, self.pq, self.pv))))
+
+        if self._cache.get('fdlf_key') != key:
+            B_p, B_pp = self.build_B_fdlf(variant)
+            self._cache['fdlf'] = (scipy.sparse.linalg.splu(B_p),
+                                   scipy.sparse.linalg.splu(B_pp))
+            self._cache['fdlf_key'] = key
+
+        return self._cache['fdlf']
+
+    def fast_decoupled(self, x0, tol, max_iters, variant='XB'):
+        '''
+        Aplicar el flujo desacoplado rápido desde el estado x0.
+
+        Cada iteración consta de una media iteración P-theta con B' y otra
+        Q-V con B''; ambas matrices son constantes y se factorizan una sola
+        vez (ver factorize_B_fdlf). Devuelve el estado final y el número de
+        iteraciones.
+        '''
+
+        stats = self.stats
+        with stats.timer('J'):
+            lu_p, lu_pp = self.factorize_B_fdlf(variant)
+        pq = self.pq
+        pqpv = self.pqpv
+        n = len(pqpv)
+
+        self.update_v(x0)
+        with stats.timer('F'):
             self.build_F()
-            self.build_J()
+        stats.iteration(self, 0, self.F, pqpv, pq)
+        iters = 0
 
-        # Update complex powers
-        self.update_S(x)
+        while np.max(np.abs(self.F)) > tol and iters < max_iters:
+            iters += 1
+            # Media iteración P-theta
+            with stats.timer('solve'):
+                self.theta[pqpv] -= lu_p.solve(self.F[:n]/self.V[pqpv])
+            with stats.timer('F'):
+                self.build_F()
+            if np.max(np.abs(self.F)) > tol:
+                # Media iteración Q-V
+                with stats.timer('solve'):
+                    self.V[pq] -= lu_pp.solve(self.F[n:]/self.V[pq])
+                with stats.timer('F'):
+                    self.build_F()
+            stats.iteration(self, iters, self.F, pqpv, pq)
+
+        return self.get_state(), iters
+
+    def build_Bdc(self):
+        '''
+        Construir las matrices del flujo de potencia DC.
 
-        # Update status
-        if iters < max_iters:
-            tol_W = round(tol*self.Sb*1e6, 3)
-            self.status = 'solved (max |F| < ' + str(tol_W) + ' W) ' \
-                        + 'in ' + str(iters) + ' iterations'
-            return True
+        Devuelve Bbus (barras x barras) y Bf (ramas x barras), tales que las
+        inyecciones y los flujos de potencia activa son P = Bbus*theta y
+        Pf = Bf*theta. Se desprecian las resistencias, las derivaciones y
+        las magnitudes de las tensiones; las ramas fuera de servicio no
+        aportan.
+        '''
+
+        N = self.n_buses
+        k = np.arange(self.n_branches)
+        f = self.branch_from
+        t = self.branch_to
+        b = self.branch_in_operation/(self.branch_X*self.branch_n)
+
+        Bf = scipy.sparse.csr_matrix(
+            (np.concatenate([b, -b]), (np.concatenate([k, k]),
+                                       np.concatenate([f, t]))),
+            shape=(self.n_branches, N))
+        Cft = scipy.sparse.csr_matrix(
+            (np.concatenate([np.ones_like(b), -np.ones_like(b)]),
+             (np.concatenate([k, k]), np.concatenate([f, t]))),
+            shape=(self.n_branches, N))
+
+        return (Cft.T @ Bf).tocsr(), Bf
+
+    def run_dc_pf(self):
+        '''
+        Correr estudio de flujo de potencia DC (lineal).
+
+        Actualiza los ángulos de las barras no oscilantes (las magnitudes no
+        cambian) y la potencia activa hacia la red, y devuelve el flujo de
+        potencia activa (pu) de cada rama.
+        '''
+
+        Bbus, Bf = self.build_Bdc()
+        ref = self.ref
+        pqpv = self.pqpv
+
+        # Inyección neta: generación menos carga
+        P = -self.PL
+        B_red = Bbus[pqpv][:, pqpv].tocsc()
+        rhs = P[pqpv] - Bbus[pqpv][:, ref] @ self.theta[ref]
+        self.theta[pqpv] = scipy.sparse.linalg.splu(B_red).solve(rhs)
+
+        self.P_to_network[:] = Bbus @ self.theta
+        self.Q_to_network[:] = np.nan
+        self.iterations = 0
+        self.status = 'solved (DC power flow)'
+
+        return Bf @ self.theta
+
+    def build_PTDF(self):
+        '''
+        Construir la matriz PTDF (ramas x barras).
+
+        PTDF[l, i] es el cambio del flujo por la rama l ante una inyección
+        unitaria en la barra i que se retira en la barra oscilante.
+        '''
+
+        Bbus, Bf = self.build_Bdc()
+        pqpv = self.pqpv
+
+        # Bbus es simétrica: PTDF = Bf*inv(Bbus) = (inv(Bbus)*Bf^T)^T
+        lu = scipy.sparse.linalg.splu(Bbus[pqpv][:, pqpv].tocsc())
+        PTDF = np.zeros((self.n_branches, self.n_buses))
+        PTDF[:, pqpv] = lu.solve(Bf[:, pqpv].T.toarray()).T
+
+        return PTDF
+
+    def build_LODF(self, PTDF=None, branches=None):
+        '''
+        Construir la matriz LODF (ramas x ramas).
+
+        LODF[l, k] es la fracción del flujo previo de la rama k que pasa a la
+        rama l cuando k sale de servicio, de modo que el flujo posterior es
+        Pf[l] + LODF[l, k]*Pf[k]. Las columnas de las ramas cuya salida
+        divide la red (ramas radiales) son nan.
+
+        Con branches se calculan solo las columnas de esas ramas (ramas x
+        len(branches)); si además no se da PTDF, se obtienen resolviendo
+        Bbus para una transferencia entre los extremos de cada rama, sin
+        armar la PTDF completa, lo que permite usarla en redes grandes.
+        '''
+
+        f = self.branch_from
+        t = self.branch_to
+        if branches is None:
+            k = np.arange(self.n_branches)
         else:
-            self.status = 'non-convergent after ' + str(iters) + ' iterations'
-            warnings.warn('Newton-Raphson did not converge after ' \
-                         + str(iters) + ' iterations.')
-            return False
+            k = np.asarray(branches, dtype=int)
+        columns = np.arange(len(k))
+
+        # Sensibilidad de cada rama a una transferencia entre los extremos
+        # de cada rama
+        if PTDF is None and branches is None:
+            PTDF = self.build_PTDF()
+        if PTDF is not None:
+            H = PTDF[:, f[k]] - PTDF[:, t[k]]
+        else:
+            Bbus, Bf = self.build_Bdc()
+            pqpv = self.pqpv
+            transfer = np.zeros((self.n_buses, len(k)))
+            np.add.at(transfer, (f[k], columns), 1)
+            np.add.at(transfer, (t[k], columns), -1)
+            lu = scipy.sparse.linalg.splu(Bbus[pqpv][:, pqpv].tocsc())
+            theta = np.zeros((self.n_buses, len(k)))
+            theta[pqpv] = lu.solve(transfer[pqpv])
+            H = Bf @ theta
+
+        denominator = 1 - H[k, columns]
+        islanding = np.abs(denominator) < 1e-10
+
+        LODF = H/np.where(islanding, 1, denominator)
+        LODF[:, islanding] = np.nan
+        LODF[k, columns] = -1
+
+        return LODF
+
+    def reduce(self, internal, **options):
+        '''
+        Construir un equivalente de la red externa a las barras internal
+        (vistas, índices o nombres) a partir de la solución actual: la red
+        externa se reduce con Kron y, con ward=True, sus inyecciones se
+        reemplazan por un equivalente de Ward. Devuelve un
+        reduction.NetworkEquivalent, cuyo atributo system es el sistema
+        reducido; options se pasan a él.
+        '''
+
+        from reduction import NetworkEquivalent
+
+        return NetworkEquivalent(self, internal, **options)
 
     def __str__(self):
         '''
@@ -392,7 +2528,7 @@ class System:
         '''
 
         # Fetch data
-        data = [[self.buses.index(bus) + 1,
+        data = [[i + 1,
                  bus.name,
                  bus.bus_type,
                  bus.Vb,
@@ -402,7 +2538,7 @@ class System:
                  self.get_bus_load(bus, attr='Q'),
                  self.get_bus_generation(bus, attr='P'),
                  self.get_bus_generation(bus, attr='Q')]
-                for bus in self.buses]
+                for i, bus in enumerate(self.buses)]
 
         # Define headers
         headers = ['\n\nBus', '\n\nName', '\n\nType', 'Nominal\nvoltage\n(kV)',
@@ -1,15 +1,44 @@
+import hashlib
+import os
+import re
+
 import numpy as np
 
+import pf
+
 
 # ------------
 # Asignación 1
 # ------------
 # Leer el archivo nordico.txt y crear un modelo eléctrico
 # de la red.
-class MyBus:
+class MyRecord:
+    """Registro liviano.
+
+    Las subclases declaran sus atributos en ``__slots__`` en lugar de
+    usar un ``__dict__`` por instancia.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        """Información.
+
+        Mostrar atributos de la instancia particular.
+        """
+        attrs = {name: getattr(self, name)
+                 for cls in type(self).__mro__
+                 for name in getattr(cls, '__slots__', ())
+                 if hasattr(self, name)}
+        return f'{attrs}'
+
+
+class MyBus(MyRecord):
     # Todas las cantidades en pu suponen una base de 100 MVA.
     S_base = 100    # MVA
 
+    __slots__ = ('name', 'V', 'phase', 'PL', 'QL', 'Vb', 'G', 'B',
+                 'bus_type', 'pf_results_V', 'associated_pf_bus')
+
     def __init__(self,
                  name: str,
                  V: float,
@@ -31,15 +60,10 @@ class MyBus:
         self.B = B          # Susceptancia
         self.bus_type = bus_type    # Ya sea 'Slack', 'PV' o 'PQ'
 
-    def __str__(self):
-        """Información.
 
-        Mostrar atributos de la instancia particular.
-        """
-        return f'{self.__dict__}'
+class MyLine(MyRecord):
+    __slots__ = ('from_bus', 'to_bus', 'R', 'X', 'total_G', 'total_B')
 
-
-class MyLine:
     def __init__(
             self,
             from_bus: MyBus,
@@ -61,15 +85,8 @@ class MyLine:
         self.total_G = total_G
         self.total_B = total_B
 
-    def __str__(self):
-        """Información.
-
-        Mostrar atributos de la instancia particular.
-        """
-        return f'{self.__dict__}'
-
 
-class MyTransformer:
+class MyTransformer(MyRecord):
     """Transformador con relación de transformación no nominal.
 
     Modela los transformadores de dos devanados cuando su relación
@@ -79,6 +96,8 @@ class MyTransformer:
     una instancia de la clase ``Line``.
 
     """
+    __slots__ = ('from_bus', 'to_bus', 'R', 'X', 'n', 'MVA')
+
     def __init__(
             self,
             from_bus: MyBus,
@@ -95,171 +114,206 @@ class MyTransformer:
         self.n = n              # Relación de transformación
         self.MVA = MVA          # Capacidad
 
-    def __str__(self):
-        """Información.
 
-        Mostrar atributos de la instancia particular.
-        """
-        return f'{self.__dict__}'
+# Registros del formato de nordico.txt. Cada expresión recorre el texto una
+# sola vez y devuelve los campos de todos los registros de su tipo.
+NORDIC_RECORDS = {
+    'buses': re.compile(
+        r'^Barra llamada (\S+) con tensión nominal de (\S+) kV', re.M),
+    'lines': re.compile(
+        r'^Línea entre (\S+) y (\S+) con R = (\S+) ohm, X = (\S+) ohm '
+        r'y B/2 = (\S+) micro S', re.M),
+    'transformers': re.compile(
+        r'^Transformador entre (\S+) y (\S+) con R = (\S+) %, '
+        r'X = (\S+) %, n = (\S+) % y capacidad = (\S+) MVA', re.M),
+    'generators': re.compile(
+        r'^Generador conectado a (\S+) con salida de (\S+) MW '
+        r'y consigna de (\S+) kV', re.M),
+    'loads': re.compile(
+        r'^Carga conectada a (\S+) consumiendo (\S+) MW y (\S+) Mvar', re.M),
+    'shunts': re.compile(
+        r'^Compensador conectado a (\S+) que genera (\S+) Mvar', re.M),
+    'results': re.compile(
+        r'^La barra (\S+) opera a (\S+) pu con fase de (\S+) radianes',
+        re.M),
+}
+
+# Cambiar si cambia el contenido del caché
+NORDIC_CACHE_VERSION = 1
+
+
+def parse_nordic(text):
+    """Leer el texto de un archivo con el formato de nordico.txt.
+
+    Devuelve un diccionario de arreglos (unidades del archivo; barras
+    referidas por índice en el orden en que se declaran), listo para
+    guardarse con ``np.savez``.
+    """
+    records = {kind: pattern.findall(text)
+               for kind, pattern in NORDIC_RECORDS.items()}
+
+    names = [name for name, _ in records['buses']]
+    index = {name: i for i, name in enumerate(names)}
+
+    def fields(kind, n_buses, n_values):
+        # Columnas de texto -> índices de barras y filas de números
+        columns = list(zip(*records[kind])) or [()]*(n_buses + n_values)
+        buses = [np.array([index[name] for name in column], dtype=int)
+                 for column in columns[:n_buses]]
+        values = np.array(columns[n_buses:], dtype=float)
+        return (*buses, values.reshape(n_values, -1))
+
+    _, (bus_Vb,) = fields('buses', 1, 1)
+    line_from, line_to, line = fields('lines', 2, 3)
+    tx_from, tx_to, tx = fields('transformers', 2, 4)
+    gen_bus, gen = fields('generators', 1, 2)
+    load_bus, load = fields('loads', 1, 2)
+    shunt_bus, shunt = fields('shunts', 1, 1)
+    result_bus, result = fields('results', 1, 2)
+
+    # Resultados de referencia en el orden de las barras
+    result_V = np.full(len(names), np.nan)
+    result_theta = np.full(len(names), np.nan)
+    result_V[result_bus], result_theta[result_bus] = result
+
+    return {'bus_names': np.array(names, dtype=str),
+            'bus_Vb': bus_Vb,
+            'line_from': line_from, 'line_to': line_to,
+            'line_R': line[0], 'line_X': line[1], 'line_B_half': line[2],
+            'transformer_from': tx_from, 'transformer_to': tx_to,
+            'transformer_R': tx[0], 'transformer_X': tx[1],
+            'transformer_n': tx[2], 'transformer_MVA': tx[3],
+            'gen_bus': gen_bus, 'gen_P': gen[0], 'gen_V': gen[1],
+            'load_bus': load_bus, 'load_P': load[0], 'load_Q': load[1],
+            'shunt_bus': shunt_bus, 'shunt_Q': shunt[0],
+            'result_V': result_V, 'result_theta': result_theta}
+
+
+def read_nordic(path, cache=True, cache_dir=None):
+    """Leer un archivo con el formato de nordico.txt, con caché binario.
+
+    El resultado de ``parse_nordic`` se guarda en un ``.npz`` cuyo nombre
+    incluye el hash SHA-256 del archivo, por defecto junto a él. Si el
+    archivo no cambia, las lecturas siguientes cargan los arreglos del
+    caché sin volver a leer el texto.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+
+    if not cache:
+        return parse_nordic(raw.decode('utf-8'))
+
+    digest = hashlib.sha256(raw).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    cache_path = os.path.join(
+        cache_dir or os.path.dirname(os.path.abspath(path)),
+        f'.{stem}.{digest}.v{NORDIC_CACHE_VERSION}.npz')
+
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            return dict(cached)
+
+    data = parse_nordic(raw.decode('utf-8'))
+    # Escribir en un temporal y renombrar: otro proceso nunca ve un
+    # caché a medio escribir
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **data)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # Sin permiso de escritura: seguir sin caché
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return data
+
+
+def nordic_system(data, slack='g20', Sb=MyBus.S_base):
+    """Crear un ``pf.System`` con los arreglos de ``read_nordic``.
+
+    La barra del generador ``slack`` es la oscilante, las demás barras
+    con generador son PV y el resto son PQ. Las cargas de las barras PV
+    solo aportan potencia activa y la barra oscilante no lleva carga ni
+    compensación (igual que ``System.add_slack`` y ``System.add_PV``).
+    Las barras y ramas se agregan en bloque, en el orden del archivo.
+    """
+    names = data['bus_names']
+    Vb = data['bus_Vb']
+    n = len(names)
+
+    # Generación: consigna de tensión y potencia activa inyectada
+    gen = data['gen_bus']
+    is_slack = names[gen] == slack
+    bus_type = np.full(n, pf.PQ, dtype=np.int8)
+    bus_type[gen] = pf.PV
+    bus_type[gen[is_slack]] = pf.SLACK
+    V = np.ones(n)
+    V[gen] = data['gen_V'] / Vb[gen]
+
+    PL = np.zeros(n)
+    QL = np.zeros(n)
+    B = np.zeros(n)
+    np.add.at(PL, gen[~is_slack], -data['gen_P'][~is_slack] / Sb)
+    np.add.at(PL, data['load_bus'], data['load_P'] / Sb)
+    np.add.at(QL, data['load_bus'], data['load_Q'] / Sb)
+    B[data['shunt_bus']] = data['shunt_Q'] / Sb
+
+    slack_bus = bus_type == pf.SLACK
+    PL[slack_bus] = 0
+    QL[slack_bus | (bus_type == pf.PV)] = 0
+    B[slack_bus] = 0
+
+    system = pf.System(Sb=Sb)
+    system.add_buses(bus_type, names.tolist(), V=V, theta=0, PL=PL, QL=QL,
+                     G=0, B=B, Vb=Vb,
+                     Vset=np.where(bus_type != pf.PQ, V, np.nan))
+
+    # Líneas: ohm y micro S a pu con la tensión de la barra de inicio
+    Vb_line = Vb[data['line_from']]
+    B_half = data['line_B_half'] * 1e-6 * Vb_line**2 / Sb
+    system.add_branches(data['line_from'], data['line_to'],
+                        R=data['line_R'] * Sb / Vb_line**2,
+                        X=data['line_X'] * Sb / Vb_line**2,
+                        from_Y=1j*B_half, to_Y=1j*B_half)
+
+    # Transformadores: % en base propia a pu en la base del sistema (del
+    # lado de la barra final del archivo hacia la inicial)
+    MVA = data['transformer_MVA']
+    system.add_branches(data['transformer_to'], data['transformer_from'],
+                        R=data['transformer_R'] / 100 * Sb / MVA,
+                        X=data['transformer_X'] / 100 * Sb / MVA,
+                        n=data['transformer_n'] / 100,
+                        MVA=MVA, is_transformer=True)
+
+    return system
+
+
+# Archivo del sistema nórdico del repositorio (independiente del directorio
+# de trabajo)
+NORDIC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'data', 'nordico.txt')
+
+
+def load_nordic(path=NORDIC_PATH, slack='g20', cache=True):
+    """Leer un archivo con el formato de nordico.txt y crear su sistema.
+
+    Devuelve el ``pf.System`` y los arreglos leídos (que incluyen las
+    tensiones de referencia ``result_V``).
+    """
+    data = read_nordic(path, cache=cache)
+
+    return nordic_system(data, slack=slack), data
 
 
 if __name__ == "__main__":
 
-    import pf
+    from contingency import ContingencyAnalyzer
+    from cpf import ContinuationPowerFlow
     import matplotlib.pyplot as plt
-    buses = {}
-    lines = []
-    transformers = []
-
-    with open('data/nordico.txt') as f:
-        for line in f:
-            words = line.split(' ')
-
-            # Saltarse líneas vacías (continúa a siguiente iteración)
-            if len(words) == 0:
-                continue
-
-            # Crear instancias de barras
-            # Identificar barras
-            if words[0] == 'Barra':
-                name = words[2]
-                Vb = float(words[7])
-
-                buses[name] = MyBus(
-                    name=name, V=np.nan, phase=np.nan, PL=0,
-                    QL=0,  Vb=Vb, G=0, B=0, bus_type='PQ'
-                )
-
-            elif words[0] == 'La':
-                name = words[2]
-                bus = buses[name]
-                bus.pf_results_V = float(words[5])
-
-            # Pasar atributos según su tipo:
-            #
-            # De generación:
-            elif words[0] == 'Generador':
-                name = words[3]
-                # Slack
-                if name == 'g20':
-                    V = float(words[12]) / buses[name].Vb
-                    buses[name].V = V
-                    buses[name].phase = 0.0
-                    buses[name].bus_type = 'Slack'
-                else:
-                    # Potencia injectada: negativa por ser de generación
-                    buses[name].PL -= float(words[7]) / MyBus.S_base
-                    # Tensión (magnitud) en pu:
-                    V = float(words[12]) / buses[name].Vb
-                    buses[name].V = V
-                    # Tipo
-                    buses[name].bus_type = 'PV'
-
-            # De carga:
-            elif words[0] == 'Carga':
-                name = words[3]
-                # Potencia injectada: positiva por ser de carga
-                # Activa
-                buses[name].PL += float(words[5]) / MyBus.S_base
-                # Reactiva
-                buses[name].QL += float(words[8]) / MyBus.S_base
-                # # Tipo
-                # buses[name].bus_type = 'PQ'
-
-            # Aquellas que tienen compensadores en derivación
-            elif words[0] == 'Compensador':
-                name = words[3]
-                buses[name].B = float(words[6]) / MyBus.S_base
-
-            # Crear instancias de líneas
-            elif words[0] == 'Línea':
-                name_from = words[2]
-                name_to = words[4]
-                Vb = buses[name_from].Vb
-                Sb = buses[name_from].S_base
-                B_half = float(words[17]) * 1e-6 * Vb**2 / Sb
-                # Crear instancia
-                line = MyLine(
-                    from_bus=buses[name_from],
-                    to_bus=buses[name_to],
-                    R=float(words[8]) * Sb / Vb**2,
-                    X=float(words[12]) * Sb / Vb**2,
-                    total_G=0,
-                    total_B=2*B_half,
-                    # from_Y=float(words[17]) / buses[name_from].Vb,
-                    # to_Y=float(words[17]) / buses[name_from].Vb,
-                )
-                # Almacenar en lista
-                lines.append(line)
-
-            # Crear instancias de transformadores
-            elif words[0] == 'Transformador':
-                name_from = words[2]
-                name_to = words[4]
-                # Impedancia en base nueva
-                R = float(words[8])/100
-                X = float(words[12])/100
-                n = float(words[16]) / 100  # Relación de vueltas
-                capacidad = float(words[21])   # Capacidad nominal
-                # Crear instancia
-                transformer = MyTransformer(
-                    from_bus=buses[name_from],
-                    to_bus=buses[name_to],
-                    R=R,
-                    X=X,
-                    n=n,
-                    MVA=capacidad
-                )
-                # Almacenar en lista
-                transformers.append(transformer)
-
-    # Definir el nordic
-    sys = pf.System()
-
-    # Definir barras
-    for bus_name, bus in buses.items():
-
-        if bus.bus_type == 'Slack':
-            b = sys.add_slack(V=bus.V, Vb=bus.Vb, name=bus.name)
-
-        elif bus.bus_type == 'PQ':
-            b = sys.add_PQ(PL=bus.PL,
-                           QL=bus.QL,
-                           Vb=bus.Vb,
-                           G=bus.G,
-                           B=bus.B,
-                           name=bus.name)
-
-        elif bus.bus_type == 'PV':
-            b = sys.add_PV(V=bus.V,
-                           PL=bus.PL,
-                           QL=bus.QL,
-                           Vb=bus.Vb,
-                           G=bus.G,
-                           B=bus.B,
-                           name=bus.name)
-
-        # Sobre la marcha
-        bus.associated_pf_bus = b
-
-    # Definir líneas
-    for ln in lines:
-        sys.add_line(from_bus=ln.from_bus.associated_pf_bus,
-                     to_bus=ln.to_bus.associated_pf_bus,
-                     X=ln.X,
-                     R=ln.R,
-                     total_G=0,
-                     total_B=ln.total_B)
-
-    # Definir transformadores
-    for tx in transformers:
-        sys.add_transformer(from_bus=tx.to_bus.associated_pf_bus,
-                            to_bus=tx.from_bus.associated_pf_bus,
-                            R=tx.R,
-                            X=tx.X,
-                            n=tx.n,
-                            MVA=tx.MVA,
-                            Sbase=100)
+
+    # Definir el nordic (los datos leídos quedan en caché junto al archivo)
+    sys, datos = load_nordic()
 
     # Correr fujo de potencia
     sys.run_pf()
@@ -272,10 +326,13 @@ if __name__ == "__main__":
     # del archivo nordico.txt
 
     # Verificar resultados
-    for bus_name, bus in buses.items():
-        error = abs(bus.associated_pf_bus.V - bus.pf_results_V)
+    for bus_name, V, V_ref in zip(sys.bus_names, sys.V, datos['result_V']):
+        error = abs(V - V_ref)
         print(f'El error para {bus_name} es {error} pu')
 
+    # Flujos, pérdidas y cargabilidad de las ramas
+    print(sys.branch_results())
+
     # ------------
     # Asignación 3
     # ------------
@@ -285,50 +342,49 @@ if __name__ == "__main__":
     loads = ['1', '2', '3', '4', '5', '41', '42', '43', '46', '47', '51']
     central_PQ = {}
     for b in loads:
-        central_PQ[b] = buses[b].associated_pf_bus
-
-    # Taza
-    lambd = 1
-    delta = 0.001
-    lambds = []
-    # Respuesta de tensiones
-    tensiones = {v: [] for v in central_PQ}
-    # Aumentar carga
-    while sys.run_pf():
-        # Anexar lambds
-        lambds.append(lambd)
-        # Anexar tensión resultante
-        for (name, bus) in central_PQ.items():
-            tensiones[name].append(bus.V)
-        # Quitar incremento anterior
-        for (n, bus) in central_PQ.items():
-            bus.PL /= lambd
-            bus.QL /= lambd
-        # Actualizar lambd
-        lambd += delta
-        # Aumentar cada carga
-        for (name, bus) in central_PQ.items():
-            bus.PL *= lambd
-            bus.QL *= lambd
+        central_PQ[b] = sys.get_bus(sys.bus_names.index(b))
+
+    # Flujo de potencia de continuación: escala las cargas de la zona
+    # central por lambda y sigue las curvas PV hasta pasar la nariz
+    cpf = ContinuationPowerFlow(sys, central_PQ.values())
+    curvas = cpf.run()
+    print(curvas)
 
     plt.figure()
-    for name, v in tensiones.items():
-        plt.plot(lambds, tensiones[name], label=name)
+    for name, bus in central_PQ.items():
+        lambds, tensiones = curvas.pv_curve(bus)
+        plt.plot(lambds, tensiones, label=name)
+    plt.axvline(curvas.lambda_max, color='k', linestyle='--')
     plt.xlabel('lambda')
     plt.ylabel('Tensión [pu]')
     plt.title('Análisis de cargabilidad')
     plt.legend()
     plt.show()
 
+    # El mismo análisis sobre un equivalente de la red externa a la zona
+    # central (Kron y Ward, conservando los generadores externos), con
+    # menos incógnitas
+    equivalente = sys.reduce(loads, keep_generators=True)
+    curvas_eq = ContinuationPowerFlow(
+        equivalente.system, equivalente.reduced_buses(loads)).run()
+    print(f'Equivalente de {equivalente.system.n_buses} barras: {curvas_eq}')
+
     # ------------
     # Asignación 4
     # ------------
     # Análisis de contingencia: Prueba n - 1
-    # Nota: Volver a correr el programa para ésta prueba.
-
-    for ln in sys.lines:
-        ln.in_operation = False
-        if not sys.run_pf():
-            # Líneas críticas
-            print(f'Desconección de línea {ln}')
-        ln.in_operation = True
+    # (el flujo de continuación deja las cargas en el caso base)
+
+    # Las salidas de todas las ramas (líneas y transformadores) se
+    # resuelven en paralelo sobre copias del sistema; con el multiplicador
+    # de Iwamoto los casos sin solución se abandonan en pocas iteraciones
+    resultados = ContingencyAnalyzer(sys, step_control='iwamoto').run()
+    print(resultados)
+    for fila in resultados.failed():
+        # Ramas críticas
+        print(f'Desconección de rama {fila["contingency"]} '
+              f'({fila["failure"]})')
+    for fila in resultados.islanded():
+        # Líneas cuya salida divide la red
+        print(f'La desconección de {fila["contingency"]} divide la red en '
+              f'{fila["islands"]} islas')
@@ -0,0 +1,215 @@
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+
+import pf
+
+class NetworkEquivalent:
+    '''
+    Equivalente de la red externa a una zona de un System, para estudios
+    repetidos sobre esa zona (la red interna).
+
+    Se conservan las barras internas, sus vecinas (las barras frontera, de
+    modo que las ramas de enlace quedan intactas), la barra oscilante, las
+    que se den en retain y, con keep_generators=True, las barras PV
+    externas, que siguen regulando su tensión. Sin ellas el equivalente es
+    mucho más pequeño, pero subestima el soporte de reactivos de la red
+    externa (en estudios de cargabilidad conviene conservarlas); con ellas
+    en una red grande las ramas equivalentes entre generadores lejanos
+    pueden ser muchas. El resto de la red externa se elimina con la
+    reducción de Kron de Y:
+
+        Y_eq = Y_rr - Y_re Y_ee^-1 Y_er
+
+    cuyas entradas nuevas se representan con ramas equivalentes entre las
+    barras conservadas y admitancias en derivación en ellas (se omiten las
+    ramas equivalentes de admitancia menor que tol veces la mayor de Y).
+
+    La reducción es exacta para las barras pasivas (sin carga ni
+    generación). Con ward=True también se eliminan las barras externas con
+    inyección (equivalente de Ward): sus inyecciones en la solución actual
+    del sistema se convierten en corrientes constantes, que se trasladan a
+    las barras conservadas como cargas equivalentes; así el equivalente
+    reproduce exactamente el caso base. Con ward=False esas barras se
+    conservan.
+
+    El sistema reducido (self.system) es un System como cualquier otro,
+    con los mismos nombres de barras; reduced_buses traduce las barras del
+    original y expand y map_back devuelven los resultados a él.
+    '''
+
+    def __init__(self, system, internal, ward=True, keep_generators=False,
+                 retain=(), tol=1e-10):
+
+        self.original = system
+        self.ward = ward
+        N = system.n_buses
+
+        # Barras conservadas
+        kept = np.zeros(N, dtype=bool)
+        kept[self._indices(internal)] = True
+        kept[self._indices(retain)] = True
+        on = system.branch_in_operation
+        f = system.branch_from[on]
+        t = system.branch_to[on]
+        kept[f[kept[t]]] = True
+        kept[t[kept[f]]] = True
+        kept[system.bus_type == pf.SLACK] = True
+        if keep_generators:
+            kept[system.bus_type == pf.PV] = True
+        passive = (system.bus_type == pf.PQ) & (system.PL == 0) \
+                  & (system.QL == 0)
+        if not ward:
+            kept |= ~passive
+
+        r = np.flatnonzero(kept)
+        e = np.flatnonzero(~kept)
+        self.retained = r
+        self.eliminated = e
+        self.bus_map = np.full(N, -1)
+        self.bus_map[r] = np.arange(len(r))
+
+        # Reducción de Kron: solo cambian las barras conservadas vecinas de
+        # las eliminadas (la frontera de la reducción)
+        system.build_Y()
+        Y = system.Y.tocsr()
+        Y_re = Y[r][:, e]
+        frontier = np.flatnonzero(np.diff(Y_re.tocsr().indptr))
+        self._Y_er = Y[e][:, r].tocsc()
+        self._lu = scipy.sparse.linalg.splu(Y[e][:, e].tocsc()) \
+                   if len(e) else None
+        if len(e):
+            X = self._lu.solve(self._Y_er[:, frontier].toarray())
+            Y_eq = -(Y_re[frontier] @ X)
+        else:
+            Y_eq = np.zeros((0, 0), dtype=complex)
+        self.frontier = r[frontier]
+
+        # Inyecciones de las barras eliminadas en el caso base (Ward)
+        V = system.get_phasor_V()
+        self._I_e = (Y @ V)[e] if ward else np.zeros(len(e), dtype=complex)
+        I_eq = np.zeros(len(frontier), dtype=complex)
+        if ward and len(e):
+            I_eq = -(Y_re[frontier] @ self._lu.solve(self._I_e))
+        S_eq = V[self.frontier]*np.conj(I_eq)
+
+        # Ramas equivalentes (entradas fuera de la diagonal) y derivaciones
+        i, j = np.triu_indices(len(frontier), k=1)
+        y = -Y_eq[i, j]
+        scale = np.max(np.abs(Y.data), initial=1.0)
+        keep = np.abs(y) > tol*scale
+        i, j, y = i[keep], j[keep], y[keep]
+        shunt = np.diag(Y_eq).copy()
+        np.add.at(shunt, i, -y)
+        np.add.at(shunt, j, -y)
+
+        # Las ramas entre la frontera y la red eliminada no pasan al sistema
+        # reducido; su aporte a la diagonal de Y queda en las derivaciones
+        Yff, _, _, Ytt = system.branch_admittances()
+        position = np.full(N, -1)
+        position[self.frontier] = np.arange(len(frontier))
+        f = system.branch_from
+        t = system.branch_to
+        cut = kept[f] != kept[t]
+        np.add.at(shunt, position[f[cut & kept[f]]], Yff[cut & kept[f]])
+        np.add.at(shunt, position[t[cut & kept[t]]], Ytt[cut & kept[t]])
+
+        self.system = self._build(system, r, frontier, i, j, y, shunt, S_eq)
+
+    def _indices(self, buses):
+        '''
+        Índices en el sistema original de barras dadas como vistas, índices
+        o nombres.
+        '''
+
+        names = self.original.bus_names
+
+        return np.array([names.index(bus) if isinstance(bus, str)
+                         else int(getattr(bus, 'index', bus))
+                         for bus in buses], dtype=int)
+
+    def _build(self, system, r, frontier, i, j, y, shunt, S_eq):
+        '''
+        Armar el sistema reducido.
+        '''
+
+        reduced = pf.System(Sb=system.Sb,
+                            name=f'{system.name} (equivalent)'.strip())
+
+        # Barras conservadas con las derivaciones y cargas equivalentes
+        values = {field: getattr(system, field)[r].copy()
+                  for field in system.bus_fields if field != 'bus_type'}
+        values['G'][frontier] += shunt.real
+        values['B'][frontier] += shunt.imag
+        values['PL'][frontier] -= S_eq.real
+        values['QL'][frontier] -= S_eq.imag
+        reduced.add_buses(system.bus_type[r],
+                          [system.bus_names[k] for k in r], **values)
+
+        # Ramas entre barras conservadas (las de la frontera con la red
+        # eliminada quedan incluidas en el equivalente)
+        f = self.bus_map[system.branch_from]
+        t = self.bus_map[system.branch_to]
+        k = np.flatnonzero((f >= 0) & (t >= 0))
+        values = {field[len('branch_'):]: getattr(system, field)[k].copy()
+                  for field in system.branch_fields
+                  if field not in ('branch_from', 'branch_to')}
+        tap_bus = values['tap_bus']
+        tap_bus[tap_bus >= 0] = self.bus_map[tap_bus[tap_bus >= 0]]
+        self.branch_map = np.full(system.n_branches, -1)
+        self.branch_map[k] = reduced.add_branches(f[k], t[k], **values)
+
+        # Ramas equivalentes
+        z = 1/y
+        self.equivalent_branches = reduced.add_branches(
+            frontier[i], frontier[j], R=z.real, X=z.imag)
+
+        reduced.organize_buses()
+
+        return reduced
+
+    def reduced_buses(self, buses):
+        '''
+        Devolver los índices en el sistema reducido de barras del original
+        (vistas, índices o nombres), que deben estar conservadas.
+        '''
+
+        indices = self.bus_map[self._indices(buses)]
+        if np.any(indices < 0):
+            raise ValueError('Some buses were eliminated by the reduction')
+
+        return indices
+
+    def expand(self, V=None):
+        '''
+        Devolver las tensiones fasoriales de todas las barras del original
+        a partir de las del sistema reducido (por defecto, su solución
+        actual).
+
+        Las de las barras conservadas son exactas; las de las eliminadas se
+        estiman con sus inyecciones del caso base, V_e = Y_ee^-1 (I_e -
+        Y_er V_r).
+        '''
+
+        if V is None:
+            V = self.system.get_phasor_V()
+
+        V_full = np.empty(self.original.n_buses, dtype=complex)
+        V_full[self.retained] = V
+        if len(self.eliminated):
+            V_full[self.eliminated] = self._lu.solve(self._I_e
+                                                     - self._Y_er @ V)
+
+        return V_full
+
+    def map_back(self, V=None):
+        '''
+        Llevar las tensiones del sistema reducido (ver expand) al sistema
+        original y actualizar sus potencias hacia la red.
+        '''
+
+        system = self.original
+        V_full = self.expand(V)
+        system.V[:] = np.abs(V_full)
+        system.theta[:] = np.angle(V_full)
+        system.update_S(system.get_state())
@@ -0,0 +1,254 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import os
+import warnings
+
+import numpy as np
+
+import pf
+from contingency import _base_state, _restore, _solve, _summarize
+
+# Redes cargadas en este proceso de trabajo: archivo -> (sistema, estado del
+# caso base, arreglos del caso base que un escenario puede modificar)
+_networks = {}
+
+# Arreglos que definen la topología o la organización; no se pueden cambiar
+# en un escenario
+_FIXED_FIELDS = ('bus_type', 'branch_from', 'branch_to')
+
+def load_network(network):
+    '''
+    Cargar una red desde su archivo (formato de nordico.txt, MATPOWER .m o
+    PSS/E .raw) y resolver su caso base.
+    '''
+
+    if network.lower().endswith('.txt'):
+        from read_system import load_nordic
+        system, _ = load_nordic(network)
+    else:
+        from importers import read_case
+        system = read_case(network)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        system.run_pf()
+
+    return system
+
+def _get_network(network):
+    '''
+    Devolver la red de este proceso de trabajo (cargándola la primera vez),
+    el estado de su caso base y sus arreglos (ver contingency._base_state).
+    '''
+
+    if network not in _networks:
+        system = load_network(network)
+        _networks[network] = (system, system.get_state(),
+                              _base_state(system))
+
+    return _networks[network]
+
+def _init_worker(preload):
+    '''
+    Cargar de antemano las redes preload en el proceso de trabajo.
+    '''
+
+    for network in preload:
+        _get_network(network)
+
+@contextlib.contextmanager
+def _modified(system, changes):
+    '''
+    Aplicar temporalmente cambios a los arreglos del sistema.
+
+    changes es un diccionario arreglo -> {barra o rama: valor}; las barras
+    se dan por nombre o por índice y las ramas por índice, por ejemplo
+    {'PL': {'1': 6.6}, 'branch_n': {80: 1.02}}. La tensión de las barras
+    PV se cambia con 'Vset' (run_pf parte de esa consigna, ver
+    System.set_PV_voltages); un cambio de 'V' en ellas se rechaza.
+    '''
+
+    previous = []
+    try:
+        for field, values in changes.items():
+            if field in _FIXED_FIELDS or (field not in system.bus_fields and
+                                          field not in system.branch_fields):
+                raise ValueError(f"Field '{field}' cannot be changed")
+            array = getattr(system, field)
+            for key, value in values.items():
+                i = system.bus_names.index(key) if isinstance(key, str) \
+                    else int(key)
+                if field == 'V' and system.bus_type[i] == pf.PV:
+                    raise ValueError(f"Change 'Vset' instead of 'V' to set "
+                                     f"the voltage of PV bus "
+                                     f"{system.bus_names[i]}")
+                previous.append((array, i, array[i]))
+                array[i] = value
+        yield
+    finally:
+        for array, i, value in reversed(previous):
+            array[i] = value
+
+def _solve_scenario(task):
+    '''
+    Resolver un escenario en el proceso de trabajo y resumir el resultado.
+    Al terminar, la red vuelve al caso base (tensiones, consignas y tomas,
+    además de los cambios del escenario).
+    '''
+
+    network, index, scenario, loading_limit = task
+    system, x0, base = _get_network(network)
+    outages = tuple(int(k) for k in scenario.get('outages', ()))
+    name = scenario.get('name') or (
+        ' & '.join(str(system.get_branch(k)) for k in outages) or str(index))
+    options = {'x0': x0, **scenario.get('options', {})}
+
+    try:
+        with _modified(system, scenario.get('changes', {})), \
+                system.outage(*outages):
+            converged = _solve(system, options)
+            row = _summarize(system, name, outages, converged, loading_limit)
+            row.update(scenario=index, V=system.V.copy(),
+                       theta=system.theta.copy())
+    finally:
+        _restore(system, base)
+
+    return row
+
+def _in_service_branches(network):
+    '''
+    Devolver los índices de las ramas en servicio de la red.
+    '''
+
+    system, _, _ = _get_network(network)
+
+    return np.flatnonzero(system.branch_in_operation)
+
+class StudyService:
+    '''
+    Servicio asíncrono (asyncio) de estudios de flujo de potencia.
+
+    Los trabajos (flujos de potencia, barridos de escenarios y análisis de
+    contingencias) se reparten entre max_workers procesos. Cada proceso
+    guarda las redes que carga (ver load_network), identificadas por la
+    ruta absoluta de su archivo (las relativas se resuelven desde el
+    directorio de trabajo de este proceso), junto con la solución de su caso base, de modo que
+    las consultas siguientes sobre la misma red no vuelven a leer el
+    archivo y cada escenario parte de esa solución. Los cambios de cada
+    escenario se deshacen al terminarlo. Como mucho max_pending escenarios
+    (de todos los trabajos) esperan o corren en los procesos a la vez.
+
+        from read_system import NORDIC_PATH
+
+        async with StudyService(preload=[NORDIC_PATH]) as service:
+            row = await service.run_pf(NORDIC_PATH,
+                                       changes={'PL': {'1': 6.6}})
+            async for row in service.contingencies(NORDIC_PATH):
+                print(row['contingency'], row['converged'])
+
+    Cada resultado es una fila como las de ContingencyResults, con además
+    el índice del escenario ('scenario') y las tensiones (V, theta).
+    '''
+
+    def __init__(self, max_workers=None, preload=(), max_pending=None,
+                 loading_limit=100):
+
+        self.max_workers = max_workers or os.cpu_count()
+        self.preload = tuple(os.path.abspath(network) for network in preload)
+        self.max_pending = max_pending or 2*self.max_workers
+        self.loading_limit = loading_limit
+        self._executor = None
+        self._pending = asyncio.Semaphore(self.max_pending)
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def start(self):
+        '''
+        Crear los procesos de trabajo (si no existen).
+        '''
+
+        if self._executor is None:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.max_workers, initializer=_init_worker,
+                initargs=(self.preload,))
+
+    async def close(self):
+        '''
+        Esperar los escenarios en curso y cerrar los procesos de trabajo.
+        '''
+
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.get_running_loop().run_in_executor(
+                None, executor.shutdown)
+
+    async def _run(self, func, *args):
+        '''
+        Ejecutar func(*args) en un proceso de trabajo.
+        '''
+
+        self.start()
+        async with self._pending:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, func, *args)
+
+    async def solve(self, network, scenario, index=0):
+        '''
+        Resolver un escenario: un diccionario con 'changes' (ver _modified),
+        'outages' (índices de ramas), 'options' (para System.run_pf) y
+        'name', todos opcionales.
+        '''
+
+        return await self._run(_solve_scenario,
+                               (os.path.abspath(network), index, scenario,
+                                self.loading_limit))
+
+    async def run_pf(self, network, changes=None, outages=(), **options):
+        '''
+        Resolver un flujo de potencia con los cambios y salidas dados;
+        options se pasan a System.run_pf.
+        '''
+
+        return await self.solve(network, {'changes': changes or {},
+                                          'outages': outages,
+                                          'options': options})
+
+    async def sweep(self, network, scenarios):
+        '''
+        Resolver varios escenarios (ver solve) y entregar la fila de cada
+        uno en cuanto termina, en orden de llegada.
+        '''
+
+        tasks = [asyncio.ensure_future(self.solve(network, scenario, i))
+                 for i, scenario in enumerate(scenarios)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # Si se deja de iterar, no resolver el resto
+            for task in tasks:
+                task.cancel()
+
+    async def contingencies(self, network, outages=None, **options):
+        '''
+        Analizar contingencias como ContingencyAnalyzer.run: cada una es
+        una rama (índice) o una tupla de ramas que salen a la vez; por
+        defecto, cada rama en servicio (N-1). Las filas se entregan en
+        cuanto termina cada una.
+        '''
+
+        if outages is None:
+            outages = await self._run(_in_service_branches,
+                                      os.path.abspath(network))
+        scenarios = [{'outages': outage if isinstance(outage, (tuple, list))
+                      else (outage,), 'options': options}
+                     for outage in outages]
+
+        async for row in self.sweep(network, scenarios):
+            yield row
@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pytest
+
+import importers
+import pf
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+def test_case9_matches_published_solution():
+    system = importers.read_case(os.path.join(DATA, 'case9.m'))
+
+    assert system.name == 'case9'
+    assert system.bus_names == [str(k) for k in range(1, 10)]
+    assert system.run_pf()
+
+    # Generación de referencia de MATPOWER (MW y Mvar)
+    P = system.Sb*system.P_to_network[:3]
+    Q = system.Sb*system.Q_to_network[:3]
+    assert P == pytest.approx([71.64, 163.0, 85.0], abs=0.01)
+    assert Q == pytest.approx([27.05, 6.65, -10.86], abs=0.01)
+
+def test_large_bus_numbers_keep_all_digits():
+    assert importers._bus_name(1234567.0) == '1234567'
+    assert importers._bus_name(1234568.0) == '1234568'
+    assert importers._bus_name(12.5) == '12.5'
+
+def test_psse_v33_three_winding_transformer():
+    system = importers.read_case(os.path.join(DATA,
+                                              'three_winding_v33.raw'))
+    names = system.bus_names
+
+    # La barra en estrella se numera después de la mayor del archivo
+    assert names == ['101', '102', '201', '202', '301', '1234567',
+                     '1234568']
+    star = names.index('1234568')
+    assert system.bus_type[star] == pf.PQ
+    assert system.V[star] == pytest.approx(1.01)
+    assert np.rad2deg(system.theta[star]) == pytest.approx(-3.0)
+
+    # Una rama por devanado hacia la estrella: Z1 = (Z12 + Z31 - Z23)/2...
+    windings = np.flatnonzero(system.branch_to == star)
+    assert [names[i] for i in system.branch_from[windings]] == \
+           ['201', '301', '1234567']
+    Z = system.branch_R[windings] + 1j*system.branch_X[windings]
+    assert Z == pytest.approx([0.00075 + 0.06j, 0.00125 + 0.02j,
+                               0.00175 + 0.04j])
+    assert system.branch_n[windings] == pytest.approx([1.02, 1.0, 0.98])
+    assert np.all(system.branch_is_transformer[windings])
+
+    # Transformador de dos devanados: n = t1/t2, Z referida al devanado 2
+    k = np.flatnonzero((system.branch_from == names.index('102'))
+                       & (system.branch_to == names.index('202')))
+    assert system.branch_n[k] == pytest.approx([1/0.98])
+    assert system.branch_X[k] == pytest.approx([0.05*0.98**2])
+
+    # Cargas, compensador fijo y generadores
+    assert system.Sb*system.PL == pytest.approx([-80, -50, 0, 40, 60, 30, 0])
+    assert system.Sb*system.B[names.index('301')] == pytest.approx(15.0)
+    assert system.bus_type[names.index('102')] == pf.PV
+    assert system.Vset[names.index('102')] == pytest.approx(1.02)
+
+    assert system.run_pf()
@@ -0,0 +1,23 @@
+import numpy as np
+
+import pf
+
+def test_bus_type_array_writes_reorganize():
+    system = pf.System()
+    slack = system.add_slack(V=1.0, Vb=230, name='slack')
+    buses = [system.add_PQ(PL=0.5, QL=0.1, Vb=230, name=f'bus{i}') for i in range(2)]
+    system.add_line(slack, buses[0], X=0.05, R=0.005)
+    system.add_line(buses[0], buses[1], X=0.05, R=0.005)
+    assert system.run_pf()
+    assert list(system.pv) == []
+
+    # Escritura directa en el arreglo, sin pasar por Bus.bus_type
+    i = buses[1].index
+    system.bus_type[i] = pf.PV
+    system.Vset[i] = 1.02
+    assert list(system.pv) == [i]
+    assert i not in system.pq
+    assert [bus.index for bus in system.PV_buses] == [i]
+
+    assert system.run_pf()
+    assert np.isclose(system.V[i], 1.02)
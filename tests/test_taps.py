@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+import pf
+
+def radial_system():
+    '''
+    Barra oscilante, línea y dos transformadores que alimentan cargas.
+    '''
+
+    system = pf.System()
+    slack = system.add_slack(V=1.0, Vb=230, name='slack')
+    hv = system.add_PQ(PL=0.0, QL=0.0, Vb=230, name='hv')
+    loads = [system.add_PQ(PL=0.8, QL=0.4, Vb=20, name='load1'),
+             system.add_PQ(PL=0.5, QL=0.2, Vb=20, name='load2')]
+    system.add_line(slack, hv, X=0.05, R=0.005)
+    transformers = [system.add_transformer(hv, load, R=0.005, X=0.1, n=1.0,
+                                           MVA=100)
+                    for load in loads]
+
+    return system, transformers
+
+@pytest.mark.parametrize('step', [0.0, 0.00625])
+def test_taps_settle(step):
+    system, transformers = radial_system()
+    system.set_tap_control(transformers, Vset=1.0, step=step)
+
+    assert system.run_pf(taps=True)
+    assert system.taps_settled
+    assert 'not settled' not in system.status
+
+    k = [tr.index for tr in transformers]
+    error = np.abs(system.V[system.branch_tap_bus[k]] - 1.0)
+    if step:
+        # Tomas en su grilla y tensión dentro de la banda muerta
+        n = system.branch_n[k]
+        assert np.allclose(np.round((n - 1.0)/step)*step, n - 1.0)
+        assert np.all(error < 2*step)
+    else:
+        assert np.all(error <= 1e-4)
+    assert system.adjust_taps(move=False) == 0
+
+def test_taps_not_settled():
+    system, transformers = radial_system()
+    system.set_tap_control(transformers, Vset=1.0, step=0.0)
+
+    assert system.run_pf(taps=True, max_tap_iters=1, tap_tol=1e-12)
+    assert not system.taps_settled
+    assert system.status.endswith('(not settled)')